@@ -4,20 +4,51 @@ Handles ongoing conversation with diagnostic context
 """
 
 import os
-from typing import Optional, List
+import asyncio
+from typing import Optional, List, Dict, AsyncIterator
 from datetime import datetime
 
 import httpx
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from services.http_clients import anthropic_client
+from services.session_store import SessionStore
+from services.chat_streams import ChatStreams
+from services.chat_context import CHAT_SUMMARY_MAX_TOKENS, SummaryRefresher, build_window, transcript
+from services.streaming import SSE_HEADERS, anthropic_text_deltas, format_sse
+from services.prompts import cached_messages, cached_system
+from services.usage import usage_tracker
+from services.metrics import registry
+from services.upstream import upstream_request, upstream_stream
+from services.admission import claude_budget
+from services.responses import FastJSONResponse, project
+
 router = APIRouter()
 
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
-ANTHROPIC_BASE_URL = "https://api.anthropic.com/v1"
+# Base URLs are hosts (no /v1), matching the SDK convention, so stand-ins can be swapped in
+ANTHROPIC_BASE_URL = os.environ.get("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/") + "/v1"
+# A chat reply (retries included) gives up after this long, well before the diagnostic deadline
+CHAT_DEADLINE = float(os.environ.get("CHAT_DEADLINE", "60"))
+
+# Memory-bounded chat storage backed by append-only logs on disk
+chat_sessions = SessionStore()
+
+# In-progress streamed replies; any worker process can stop one
+chat_streams = ChatStreams()
 
-# In-memory chat storage (replace with database in production)
-chat_sessions: dict = {}
+registry.gauge(
+    "marketsauce_chat_sessions",
+    "Chat sessions resident in memory",
+    lambda: {(): chat_sessions.metrics()["resident_sessions"]}
+)
+registry.gauge(
+    "marketsauce_chat_streams_in_flight",
+    "Streamed chat replies currently being generated",
+    lambda: {(): len(chat_streams)}
+)
 
 
 class ChatMessage(BaseModel):
@@ -73,43 +104,180 @@ Voice guidelines:
     return base_prompt
 
 
+def demo_chat_response(message: str) -> str:
+    """Placeholder reply used when no API key is configured"""
+    return f"Based on your diagnostic context, here's my recommendation for: '{message[:50]}...'\n\nThis is a placeholder response. Configure your ANTHROPIC_API_KEY to get real AI responses."
+
+
+def chat_request_body(
+    system_prompt: str,
+    messages: List[Dict],
+    stream: bool = False,
+    summary: Optional[str] = None
+) -> Dict:
+    """Messages API request body for a chat turn.
+
+    Cache breakpoints sit after the system prompt and on the newest message,
+    so each turn re-reads the earlier turns of its window from the prompt
+    cache. The rolling summary follows the cached system prompt, so a
+    refreshed summary doesn't invalidate it.
+    """
+    system = cached_system(system_prompt)
+    if summary:
+        system.append({"type": "text", "text": f"## Conversation So Far\n\n{summary}"})
+    body = {
+        "model": "claude-sonnet-4-20250514",
+        "max_tokens": 2000,
+        "system": system,
+        "messages": cached_messages(messages)
+    }
+    if stream:
+        body["stream"] = True
+    return body
+
+
+SUMMARY_SYSTEM_PROMPT = """You maintain the running summary of a marketing strategy conversation between a user and MarketSauce Agent.
+
+Fold the new turns into the current summary. Keep every decision, fact about the business, constraint, open question and deliverable the assistant produced (names, numbers, chosen channels, copy that was approved). Drop pleasantries and repetition. Write terse bullet points, most recent context last. Reply with the updated summary only."""
+
+
+def demo_summary(previous: Optional[str], turns: List[Dict]) -> str:
+    """Extractive stand-in for the summarizer when no API key is configured"""
+    lines = previous.splitlines() if previous else []
+    lines += [f"- User asked: {m['content'][:160]}" for m in turns if m["role"] == "user"]
+    return "\n".join(lines[-20:])
+
+
+async def summarize_turns(previous: Optional[str], turns: List[Dict]) -> str:
+    """Fold turns that left the verbatim window into the session's rolling summary"""
+    if not ANTHROPIC_API_KEY:
+        return demo_summary(previous, turns)
+
+    body = {
+        "model": "claude-sonnet-4-20250514",
+        "max_tokens": CHAT_SUMMARY_MAX_TOKENS,
+        "system": cached_system(SUMMARY_SYSTEM_PROMPT),
+        "messages": [{
+            "role": "user",
+            "content": f"## Current Summary\n\n{previous or '(none yet)'}\n\n## New Turns\n\n{transcript(turns)}"
+        }]
+    }
+    async with claude_budget.admit("chat_summary", body) as reservation:
+        response = await upstream_request(
+            "anthropic",
+            "chat_summary",
+            "POST",
+            f"{ANTHROPIC_BASE_URL}/messages",
+            deadline=CHAT_DEADLINE,
+            headers={
+                "Content-Type": "application/json",
+                "x-api-key": ANTHROPIC_API_KEY,
+                "anthropic-version": "2024-01-01"
+            },
+            json=body,
+            timeout=60.0
+        )
+
+        if response.status_code != 200:
+            reservation.settle(headers=response.headers)
+            raise HTTPException(status_code=response.status_code, detail="Chat summary API error")
+        result = response.json()
+        reservation.settle(result.get("usage"), response.headers)
+    usage_tracker.record("chat_summary", result.get("usage"))
+    return result["content"][0]["text"]
+
+
+async def save_summary(session_id: str, summary: Dict):
+    await chat_sessions.set_summary(session_id, summary)
+
+
+summary_refresher = SummaryRefresher(summarize_turns, save_summary)
+
+
+async def ensure_session(request: ChatRequest) -> Dict:
+    """Return the session for a request, creating it if it doesn't exist"""
+    session = await chat_sessions.get(request.session_id)
+    if session is None:
+        session = await chat_sessions.create({
+            "session_id": request.session_id,
+            "diagnostic_context": request.diagnostic_context,
+            "system_prompt": get_chat_system_prompt(request.diagnostic_context),
+            "messages": [],
+            "created_at": datetime.utcnow().isoformat()
+        })
+    return session
+
+
+async def stream_chat_reply(
+    system_prompt: str,
+    messages: List[Dict],
+    client: httpx.AsyncClient,
+    summary: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Stream assistant text deltas for a chat turn"""
+    if not ANTHROPIC_API_KEY:
+        for word in demo_chat_response(messages[-1]["content"]).split(" "):
+            yield word + " "
+        return
+
+    body = chat_request_body(system_prompt, messages, stream=True, summary=summary)
+    async with claude_budget.admit("chat", body) as reservation, upstream_stream(
+        "anthropic",
+        "chat_stream",
+        "POST",
+        f"{ANTHROPIC_BASE_URL}/messages",
+        client=client,
+        deadline=CHAT_DEADLINE,
+        headers={
+            "Content-Type": "application/json",
+            "x-api-key": ANTHROPIC_API_KEY,
+            "anthropic-version": "2024-01-01"
+        },
+        json=body,
+        timeout=httpx.Timeout(60.0, read=30.0)
+    ) as response:
+        if response.status_code != 200:
+            await response.aread()
+            reservation.settle(headers=response.headers)
+            raise HTTPException(status_code=response.status_code, detail="Chat API error")
+        usage: Dict = {}
+        async for delta in anthropic_text_deltas(response, usage):
+            yield delta
+        reservation.settle(usage, response.headers)
+        usage_tracker.record("chat", usage)
+
+
 @router.post("/session")
 async def create_chat_session(session: ChatSession):
     """Create a new chat session"""
     import uuid
     session_id = str(uuid.uuid4())
 
-    chat_sessions[session_id] = {
+    await chat_sessions.create({
         "session_id": session_id,
         "diagnostic_id": session.diagnostic_id,
         "diagnostic_context": session.diagnostic_context,
         "system_prompt": session.system_prompt or get_chat_system_prompt(session.diagnostic_context),
         "messages": [],
         "created_at": datetime.utcnow().isoformat()
-    }
+    })
 
     return {"session_id": session_id}
 
 
 @router.post("/message", response_model=ChatResponse)
-async def send_message(request: ChatRequest):
+async def send_message(
+    request: ChatRequest,
+    client: httpx.AsyncClient = Depends(anthropic_client)
+):
     """Send a message and get a response"""
     session_id = request.session_id
 
     # Create session if it doesn't exist
-    if session_id not in chat_sessions:
-        chat_sessions[session_id] = {
-            "session_id": session_id,
-            "diagnostic_context": request.diagnostic_context,
-            "system_prompt": get_chat_system_prompt(request.diagnostic_context),
-            "messages": [],
-            "created_at": datetime.utcnow().isoformat()
-        }
-
-    session = chat_sessions[session_id]
+    await ensure_session(request)
 
     # Add user message
-    session["messages"].append({
+    session = await chat_sessions.append(session_id, {
         "role": "user",
         "content": request.message
     })
@@ -117,36 +285,43 @@ async def send_message(request: ChatRequest):
     # Generate response with Claude
     if not ANTHROPIC_API_KEY:
         # Demo response if no API key
-        response_text = f"Based on your diagnostic context, here's my recommendation for: '{request.message[:50]}...'\n\nThis is a placeholder response. Configure your ANTHROPIC_API_KEY to get real AI responses."
+        response_text = demo_chat_response(request.message)
     else:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
+        # Recent turns verbatim plus the rolling summary, not the whole history
+        window = build_window(session["system_prompt"], session, session["messages"])
+        body = chat_request_body(session["system_prompt"], window.messages, summary=window.summary)
+        async with claude_budget.admit("chat", body) as reservation:
+            response = await upstream_request(
+                "anthropic",
+                "chat",
+                "POST",
                 f"{ANTHROPIC_BASE_URL}/messages",
+                client=client,
+                deadline=CHAT_DEADLINE,
                 headers={
                     "Content-Type": "application/json",
                     "x-api-key": ANTHROPIC_API_KEY,
                     "anthropic-version": "2024-01-01"
                 },
-                json={
-                    "model": "claude-sonnet-4-20250514",
-                    "max_tokens": 2000,
-                    "system": session["system_prompt"],
-                    "messages": session["messages"]
-                },
+                json=body,
                 timeout=60.0
             )
 
             if response.status_code != 200:
+                reservation.settle(headers=response.headers)
                 raise HTTPException(status_code=response.status_code, detail="Chat API error")
 
             result = response.json()
-            response_text = result["content"][0]["text"]
+            reservation.settle(result.get("usage"), response.headers)
+        usage_tracker.record("chat", result.get("usage"))
+        response_text = result["content"][0]["text"]
 
     # Add assistant message
-    session["messages"].append({
+    session = await chat_sessions.append(session_id, {
         "role": "assistant",
         "content": response_text
     })
+    summary_refresher.schedule(session_id, session)
 
     return ChatResponse(
         session_id=session_id,
@@ -155,18 +330,97 @@ async def send_message(request: ChatRequest):
     )
 
 
+@router.post("/stream")
+async def stream_message(
+    request: ChatRequest,
+    client: httpx.AsyncClient = Depends(anthropic_client)
+):
+    """Send a message and stream the reply as Server-Sent Events.
+
+    The turn is written to the session once the stream ends. If the client
+    disconnects or calls DELETE /stream/{session_id}, generation stops and
+    whatever text was produced is kept as the assistant reply.
+    """
+    session_id = request.session_id
+    session = await ensure_session(request)
+    user_message = {"role": "user", "content": request.message}
+    window = build_window(session["system_prompt"], session, session["messages"] + [user_message])
+
+    # Stops any reply still streaming into this session, on whichever worker runs it
+    stream_id, cancelled = await chat_streams.open(session_id)
+
+    recorded = []
+
+    async def record_turn(parts: List[str]):
+        # Runs once, whether the stream finished or was cut short
+        if recorded:
+            return
+        recorded.append(True)
+        text = "".join(parts)
+        if text:
+            updated = await chat_sessions.append(
+                session_id, user_message, {"role": "assistant", "content": text}
+            )
+            summary_refresher.schedule(session_id, updated)
+
+    async def events():
+        parts: List[str] = []
+        event_id = 0
+        reply = stream_chat_reply(session["system_prompt"], window.messages, client, window.summary)
+        try:
+            try:
+                async for delta in reply:
+                    if cancelled.is_set():
+                        break
+                    parts.append(delta)
+                    yield format_sse(event_id, "delta", {"text": delta})
+                    event_id += 1
+            finally:
+                # Closes the upstream stream and settles the Claude reservation now, not whenever it is collected
+                await reply.aclose()
+            await asyncio.shield(record_turn(parts))
+            yield format_sse(event_id, "aborted" if cancelled.is_set() else "done", {
+                "session_id": session_id,
+                "response": "".join(parts)
+            })
+        except HTTPException as e:
+            yield format_sse(event_id, "error", {"status_code": e.status_code, "detail": e.detail})
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client went away mid-generation; keep the partial reply
+            await asyncio.shield(record_turn(parts))
+            raise
+        finally:
+            await asyncio.shield(chat_streams.close(session_id, stream_id))
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.delete("/stream/{session_id}")
+async def abort_stream(session_id: str):
+    """Stop an in-progress streamed reply, whichever worker is streaming it"""
+    if not await chat_streams.cancel(session_id):
+        raise HTTPException(status_code=404, detail="No active stream")
+    return {"status": "aborting"}
+
+
 @router.get("/session/{session_id}")
-async def get_session(session_id: str):
-    """Get chat session history"""
-    if session_id not in chat_sessions:
+async def get_session(session_id: str, fields: Optional[str] = None):
+    """Get chat session history; fields= limits it to a comma-separated list of fields, e.g. fields=messages,summary"""
+    session = await chat_sessions.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    return chat_sessions[session_id]
+    return FastJSONResponse(project(session, fields))
 
 
 @router.delete("/session/{session_id}")
 async def delete_session(session_id: str):
     """Delete a chat session"""
-    if session_id in chat_sessions:
-        del chat_sessions[session_id]
+    await chat_sessions.delete(session_id)
     return {"status": "deleted"}
+
+
+@router.get("/sessions/stats")
+async def get_session_store_stats():
+    """Get chat session store residency, eviction and summary refresh metrics"""
+    return {**chat_sessions.metrics(), "summaries": summary_refresher.stats()}
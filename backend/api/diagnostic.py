@@ -5,26 +5,76 @@ Handles diagnostic generation pipeline
 
 import os
 import json
+import time
 import uuid
-from typing import Optional, List, Dict, Any
+import asyncio
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, AsyncIterator, Iterable, Set, Tuple
 from datetime import datetime
 from pathlib import Path
 
 import httpx
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, HttpUrl
 
+from services.http_clients import upstream_slot
+from services.research_cache import research_cache, cache_key
+from services.job_events import job_events
+from services.job_store import JobStore
+from services.streaming import SSE_HEADERS, anthropic_text_deltas, format_sse
+from services.sections import SectionIndex
+from services.context_budget import budget_research, query_terms
+from services.prompts import cached_system, system_prompt_text
+from services.usage import usage_tracker
+from services.scheduler import DiagnosticScheduler, QueueFull
+from services.metrics import registry, phase_latency, upstream_timeouts
+from services.etags import etag_matches, make_etag
+from services.upstream import upstream_request, upstream_stream
+from services.admission import claude_budget
+from services.responses import FastJSONResponse, project
+from services.singleflight import SingleFlight
+from services.phase_graph import FINISHED_PHASE_STATES, Phase, PhaseGraph
+
 router = APIRouter()
 
 # Configuration
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
 FIRECRAWL_API_KEY = os.environ.get("FIRECRAWL_API_KEY")
-ANTHROPIC_BASE_URL = "https://api.anthropic.com/v1"
-FIRECRAWL_BASE_URL = "https://api.firecrawl.dev/v1"
+# Base URLs are hosts (no /v1), matching the SDK convention, so stand-ins can be swapped in
+ANTHROPIC_BASE_URL = os.environ.get("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/") + "/v1"
+FIRECRAWL_BASE_URL = os.environ.get("FIRECRAWL_BASE_URL", "https://api.firecrawl.dev").rstrip("/") + "/v1"
+RESEARCH_TASK_TIMEOUT = float(os.environ.get("RESEARCH_TASK_TIMEOUT", "45"))
+DIAGNOSTIC_STREAMING = os.environ.get("DIAGNOSTIC_STREAMING", "true").lower() == "true"
+DIAGNOSTIC_BATCH_MAX_ITEMS = int(os.environ.get("DIAGNOSTIC_BATCH_MAX_ITEMS", "200"))
+DIAGNOSTIC_MESSAGE_BATCHES = os.environ.get("DIAGNOSTIC_MESSAGE_BATCHES", "false").lower() == "true"
+DIAGNOSTIC_BATCH_POLL_INTERVAL = float(os.environ.get("DIAGNOSTIC_BATCH_POLL_INTERVAL", "30"))
+# Consecutive failed status polls before a message batch's items are failed
+DIAGNOSTIC_BATCH_POLL_FAILURES = 5
+DIAGNOSTIC_STATUS_CACHE_ENTRIES = int(os.environ.get("DIAGNOSTIC_STATUS_CACHE_ENTRIES", "256"))
+# Longest a progress long-poll is held open, in seconds
+LONG_POLL_TIMEOUT = 25.0
+
+# Persistent job storage; live jobs are also held in memory
+diagnostics_store = JobStore()
+
+# Batch metadata by batch_id; item jobs carry batch_id/batch_index, so this is rebuilt after a restart
+diagnostic_batches: Dict[str, Dict] = {}
+batch_tasks: Set[asyncio.Task] = set()
+
+# Identical scrapes and searches in flight at once (a wave of signups from one niche) share a call
+research_flights = SingleFlight()
+
+# Serialized full status of finished jobs, which never change again
+FINISHED_STATUSES = ("complete", "error")
+finished_status_bodies: "OrderedDict[str, bytes]" = OrderedDict()
+
+diagnostic_jobs = registry.counter(
+    "marketsauce_diagnostic_jobs_total",
+    "Diagnostic pipelines finished, by mode and outcome",
+    ("mode", "status")
+)
 
-# In-memory storage (replace with database in production)
-diagnostics_store: Dict[str, Dict] = {}
 
 
 class DiagnosticInput(BaseModel):
@@ -47,6 +97,15 @@ class DiagnosticResponse(BaseModel):
     message: str
 
 
+class PhaseStatus(BaseModel):
+    """Progress of one node of a job's phase graph"""
+    name: str
+    title: str
+    status: str  # pending, running, complete, restored, failed, cancelled
+    started_at: Optional[str] = None
+    duration_seconds: Optional[float] = None
+
+
 class DiagnosticStatus(BaseModel):
     """Status of a diagnostic job"""
     job_id: str
@@ -54,6 +113,8 @@ class DiagnosticStatus(BaseModel):
     current_phase: int
     total_phases: int
     phase_name: str
+    queue_position: Optional[int] = None
+    phases: Optional[List[PhaseStatus]] = None
     diagnostic: Optional[str] = None
     executive_summary: Optional[str] = None
     system_prompt: Optional[str] = None
@@ -61,65 +122,227 @@ class DiagnosticStatus(BaseModel):
     error: Optional[str] = None
 
 
-def get_system_prompt() -> str:
-    """Load the MarketSauce system prompt"""
-    prompt_path = Path(__file__).parent.parent / "prompts" / "system.md"
-    if prompt_path.exists():
-        return prompt_path.read_text()
-    return "You are MarketSauce Agent, an AI market intelligence assistant."
+class BatchRequest(BaseModel):
+    """Many diagnostics submitted together"""
+    items: List[DiagnosticInput]
+    use_message_batches: Optional[bool] = None  # generate through the Message Batches API
 
 
-async def scrape_website(url: str) -> Dict:
-    """Scrape website content using Firecrawl"""
-    if not FIRECRAWL_API_KEY:
-        return {"markdown": f"[Website content for {url} - API key not configured]"}
+class BatchResponse(BaseModel):
+    """Response for a batch request"""
+    batch_id: str
+    status: str
+    total: int
+    job_ids: List[str]
+    message: str
+
+
+class BatchItemStatus(BaseModel):
+    """Progress of one diagnostic in a batch"""
+    index: int
+    job_id: str
+    business_name: str
+    status: str
+    current_phase: int
+    phase_name: str
+    queue_position: Optional[int] = None
+    error: Optional[str] = None
+
+
+class BatchStatus(BaseModel):
+    """Status of a batch and each of its diagnostics"""
+    batch_id: str
+    status: str
+    total: int
+    counts: Dict[str, int]
+    generation: Optional[str] = None
+    research: Optional[Dict[str, int]] = None
+    message_batch: Optional[Dict[str, Any]] = None
+    items: List[BatchItemStatus]
+
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{FIRECRAWL_BASE_URL}/scrape",
+def get_system_prompt() -> str:
+    """Load the MarketSauce system prompt (cached in-process, reloaded when edited)"""
+    return system_prompt_text()
+
+
+async def firecrawl_research(
+    operation: str,
+    key: str,
+    payload: Dict,
+    client: Optional[httpx.AsyncClient] = None,
+    hedge: bool = False
+) -> Optional[Dict]:
+    """One Firecrawl scrape or search, shared by every concurrent caller with the same cache key.
+
+    Returns the (now cached) result, or None if Firecrawl answered with an
+    error status. Only the shared call holds a Firecrawl concurrency slot,
+    so callers that join it don't crowd out other requests.
+    """
+    async def fetch() -> Optional[Dict]:
+        async with upstream_slot("firecrawl"):
+            response = await upstream_request(
+                "firecrawl",
+                operation,
+                "POST",
+                f"{FIRECRAWL_BASE_URL}/{operation}",
+                client=client,
+                idempotent=True,
+                hedge=hedge,
                 headers={
                     "Content-Type": "application/json",
                     "Authorization": f"Bearer {FIRECRAWL_API_KEY}"
                 },
-                json={
-                    "url": url,
-                    "formats": ["markdown"],
-                    "onlyMainContent": True
-                },
+                json=payload,
                 timeout=60.0
             )
-            if response.status_code == 200:
-                return response.json()
-            return {"markdown": f"[Could not fetch {url}]"}
-        except Exception as e:
-            return {"markdown": f"[Error fetching {url}: {str(e)}]"}
+        if response.status_code != 200:
+            print(f"Firecrawl {operation} for {key} returned {response.status_code}")
+            return None
+        result = response.json()
+        await research_cache.set(key, result)
+        return result
 
+    return await research_flights.do(key, fetch)
 
-async def search_web(query: str, limit: int = 5) -> Dict:
+
+async def scrape_website(url: str, client: Optional[httpx.AsyncClient] = None) -> Dict:
+    """Scrape website content using Firecrawl"""
+    if not FIRECRAWL_API_KEY:
+        return {"markdown": f"[Website content for {url} - API key not configured]"}
+
+    key = cache_key("scrape", url)
+    cached = await research_cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        result = await firecrawl_research(
+            "scrape", key, {"url": url, "formats": ["markdown"], "onlyMainContent": True}, client
+        )
+    except Exception as e:
+        # Research is best effort: the diagnostic goes ahead without this page
+        print(f"Firecrawl scrape of {url} failed: {e!r}")
+        return {"markdown": f"[Error fetching {url}: {str(e)}]"}
+    return result if result is not None else {"markdown": f"[Could not fetch {url}]"}
+
+
+async def search_web(query: str, limit: int = 5, client: Optional[httpx.AsyncClient] = None) -> Dict:
     """Search the web using Firecrawl"""
     if not FIRECRAWL_API_KEY:
         return {"results": []}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{FIRECRAWL_BASE_URL}/search",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {FIRECRAWL_API_KEY}"
-                },
-                json={
-                    "query": query,
-                    "limit": limit
-                },
-                timeout=60.0
-            )
-            if response.status_code == 200:
-                return response.json()
-            return {"results": []}
-        except Exception:
-            return {"results": []}
+    key = cache_key("search", query, limit=limit)
+    cached = await research_cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        # Searches are read-only, so a slow one is raced against a duplicate
+        result = await firecrawl_research("search", key, {"query": query, "limit": limit}, client, hedge=True)
+    except Exception as e:
+        print(f"Firecrawl search for {query!r} failed: {e!r}")
+        return {"results": []}
+    return result if result is not None else {"results": []}
+
+
+async def run_research_task(upstream: str, coro, fallback: Dict, operation: str = "research") -> Dict:
+    """Run one research call under the research deadline.
+
+    The upstream's concurrency slot is taken inside the call, once per
+    distinct request, rather than once per caller.
+    """
+    try:
+        return await asyncio.wait_for(coro, timeout=RESEARCH_TASK_TIMEOUT)
+    except asyncio.TimeoutError:
+        upstream_timeouts.inc(upstream=upstream, operation=operation)
+        return fallback
+
+
+# A research call: (kind, scrape URL or search query, result limit)
+ResearchCall = Tuple[str, str, int]
+
+
+def competitor_names(inputs: "DiagnosticInput") -> List[str]:
+    """Up to five competitors from the comma-separated input"""
+    if not inputs.competitors:
+        return []
+    return [c.strip() for c in inputs.competitors.split(",")][:5]
+
+
+def website_call(inputs: "DiagnosticInput") -> ResearchCall:
+    return ("scrape", inputs.website_url, 0)
+
+
+def market_call(inputs: "DiagnosticInput") -> ResearchCall:
+    return ("search", f"{inputs.target_market} industry trends 2025 2026", 5)
+
+
+def competitor_calls(inputs: "DiagnosticInput") -> List[ResearchCall]:
+    return [("search", f"{comp} company reviews pricing", 3) for comp in competitor_names(inputs)]
+
+
+def research_calls(inputs: "DiagnosticInput") -> List[ResearchCall]:
+    """The website scrape, market search and (if the mode uses them) competitor searches a diagnostic needs"""
+    calls = [website_call(inputs), market_call(inputs)]
+    if "competitor_data" in mode_graph(inputs.mode).outputs:
+        calls += competitor_calls(inputs)
+    return calls
+
+
+def research_call_key(call: ResearchCall) -> str:
+    """Research cache key of a call, so equivalent URLs and queries compare equal"""
+    kind, target, limit = call
+    return cache_key("scrape", target) if kind == "scrape" else cache_key("search", target, limit=limit)
+
+
+async def run_research_call(call: ResearchCall) -> Dict:
+    """Run one research call with its timeout fallback"""
+    kind, target, limit = call
+    if kind == "scrape":
+        return await run_research_task(
+            "firecrawl", scrape_website(target), {"markdown": f"[Timed out fetching {target}]"}, "scrape"
+        )
+    return await run_research_task("firecrawl", search_web(target, limit), {"results": []}, "search")
+
+
+def website_markdown(data: Dict) -> str:
+    return data.get("data", {}).get("markdown", data.get("markdown", ""))
+
+
+def search_results(data: Dict) -> List:
+    return data.get("data", data.get("results", []))
+
+
+def competitor_research(inputs: "DiagnosticInput", results: List[Dict]) -> List[Dict]:
+    return [{"name": comp, "data": data} for comp, data in zip(competitor_names(inputs), results)]
+
+
+def assemble_research(inputs: "DiagnosticInput", results: List[Dict]) -> Dict:
+    """Shape the results of research_calls() into the prompt's research block"""
+    website_data, market_trends, *competitor_results = results
+    return {
+        "website_content": website_markdown(website_data),
+        "competitor_data": competitor_research(inputs, competitor_results),
+        "market_trends": search_results(market_trends)
+    }
+
+
+async def gather_batch_research(batch: List["DiagnosticInput"]) -> Tuple[List[Dict], Dict]:
+    """Research for every item of a batch, fetching each distinct scrape or search once"""
+    plans = [research_calls(inputs) for inputs in batch]
+    unique: Dict[str, ResearchCall] = {}
+    for calls in plans:
+        for call in calls:
+            unique.setdefault(research_call_key(call), call)
+
+    keys = list(unique)
+    results = dict(zip(keys, await asyncio.gather(*[run_research_call(unique[key]) for key in keys])))
+    research = [
+        assemble_research(inputs, [results[research_call_key(call)] for call in calls])
+        for inputs, calls in zip(batch, plans)
+    ]
+    return research, {"calls": sum(len(calls) for calls in plans), "unique_calls": len(unique)}
 
 
 def generate_demo_diagnostic(inputs: "DiagnosticInput") -> str:
@@ -299,7 +522,9 @@ async def generate_with_claude(
     user_prompt: str,
     system_prompt: str,
     max_tokens: int = 16000,
-    inputs: "DiagnosticInput" = None
+    inputs: "DiagnosticInput" = None,
+    client: Optional[httpx.AsyncClient] = None,
+    usage: Optional[Dict] = None
 ) -> str:
     """Generate content using Claude API"""
     if not ANTHROPIC_API_KEY:
@@ -308,28 +533,247 @@ async def generate_with_claude(
             return generate_demo_diagnostic(inputs)
         return "API key not configured. Please set ANTHROPIC_API_KEY in your .env file."
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
+    body = {
+        "model": "claude-sonnet-4-20250514",
+        "max_tokens": max_tokens,
+        "system": cached_system(system_prompt),
+        "messages": [{"role": "user", "content": user_prompt}]
+    }
+    async with claude_budget.admit("diagnostic", body) as reservation:
+        response = await upstream_request(
+            "anthropic",
+            "diagnostic",
+            "POST",
             f"{ANTHROPIC_BASE_URL}/messages",
+            client=client,
             headers={
                 "Content-Type": "application/json",
                 "x-api-key": ANTHROPIC_API_KEY,
                 "anthropic-version": "2024-01-01"
             },
-            json={
-                "model": "claude-sonnet-4-20250514",
-                "max_tokens": max_tokens,
-                "system": system_prompt,
-                "messages": [{"role": "user", "content": user_prompt}]
-            },
+            json=body,
             timeout=300.0
         )
 
         if response.status_code != 200:
+            reservation.settle(headers=response.headers)
             raise HTTPException(status_code=response.status_code, detail="Claude API error")
 
         result = response.json()
-        return result["content"][0]["text"]
+        reservation.settle(result.get("usage"), response.headers)
+    usage_tracker.record("diagnostic", result.get("usage"), into=usage)
+    return result["content"][0]["text"]
+
+
+async def stream_with_claude(
+    user_prompt: str,
+    system_prompt: str,
+    max_tokens: int = 16000,
+    inputs: "DiagnosticInput" = None,
+    client: Optional[httpx.AsyncClient] = None,
+    usage: Optional[Dict] = None
+) -> AsyncIterator[str]:
+    """Stream generated text deltas from the Claude Messages API"""
+    if not ANTHROPIC_API_KEY:
+        # Replay the demo diagnostic in chunks so the streaming path still runs
+        text = await generate_with_claude(user_prompt, system_prompt, max_tokens, inputs)
+        for start in range(0, len(text), 400):
+            yield text[start:start + 400]
+        return
+
+    body = {
+        "model": "claude-sonnet-4-20250514",
+        "max_tokens": max_tokens,
+        "system": cached_system(system_prompt),
+        "messages": [{"role": "user", "content": user_prompt}],
+        "stream": True
+    }
+    async with claude_budget.admit("diagnostic", body) as reservation, upstream_stream(
+        "anthropic",
+        "diagnostic_stream",
+        "POST",
+        f"{ANTHROPIC_BASE_URL}/messages",
+        client=client,
+        headers={
+            "Content-Type": "application/json",
+            "x-api-key": ANTHROPIC_API_KEY,
+            "anthropic-version": "2024-01-01"
+        },
+        json=body,
+        timeout=httpx.Timeout(300.0, read=120.0)
+    ) as response:
+        if response.status_code != 200:
+            await response.aread()
+            reservation.settle(headers=response.headers)
+            raise HTTPException(status_code=response.status_code, detail="Claude API error")
+
+        response_usage: Dict = {}
+        async for delta in anthropic_text_deltas(response, response_usage):
+            yield delta
+        reservation.settle(response_usage, response.headers)
+        usage_tracker.record("diagnostic", response_usage, into=usage)
+
+
+def diagnostic_batch_request(custom_id: str, user_prompt: str, system_prompt: str, max_tokens: int = 16000) -> Dict:
+    """One Message Batches request entry for a diagnostic"""
+    return {
+        "custom_id": custom_id,
+        "params": {
+            "model": "claude-sonnet-4-20250514",
+            "max_tokens": max_tokens,
+            "system": cached_system(system_prompt),
+            "messages": [{"role": "user", "content": user_prompt}]
+        }
+    }
+
+
+async def create_message_batch(requests: List[Dict], client: Optional[httpx.AsyncClient] = None) -> Dict:
+    """Submit requests to the Message Batches API"""
+    response = await upstream_request(
+        "anthropic",
+        "batch_create",
+        "POST",
+        f"{ANTHROPIC_BASE_URL}/messages/batches",
+        client=client,
+        deadline=120.0,
+        headers={
+            "Content-Type": "application/json",
+            "x-api-key": ANTHROPIC_API_KEY,
+            "anthropic-version": "2024-01-01"
+        },
+        json={"requests": requests},
+        timeout=120.0
+    )
+
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail="Claude batch API error")
+    return response.json()
+
+
+async def retrieve_message_batch(message_batch_id: str, client: Optional[httpx.AsyncClient] = None) -> Dict:
+    """Processing status and request counts of a message batch"""
+    response = await upstream_request(
+        "anthropic",
+        "batch_retrieve",
+        "GET",
+        f"{ANTHROPIC_BASE_URL}/messages/batches/{message_batch_id}",
+        client=client,
+        deadline=30.0,
+        headers={"x-api-key": ANTHROPIC_API_KEY, "anthropic-version": "2024-01-01"},
+        timeout=30.0
+    )
+
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail="Claude batch API error")
+    return response.json()
+
+
+async def message_batch_results(results_url: str, client: Optional[httpx.AsyncClient] = None) -> AsyncIterator[Dict]:
+    """Stream a finished batch's JSONL results one request at a time"""
+    async with upstream_stream(
+        "anthropic",
+        "batch_results",
+        "GET",
+        results_url,
+        client=client,
+        headers={"x-api-key": ANTHROPIC_API_KEY, "anthropic-version": "2024-01-01"},
+        timeout=httpx.Timeout(300.0, read=120.0)
+    ) as response:
+        if response.status_code != 200:
+            await response.aread()
+            raise HTTPException(status_code=response.status_code, detail="Claude batch API error")
+        async for line in response.aiter_lines():
+            if line.strip():
+                yield json.loads(line)
+
+
+class PhaseSectionTracker:
+    """Incrementally splits streamed text into completed `## PHASE n` sections.
+
+    Each line is examined once, as soon as its newline arrives, so the cost
+    is linear in the diagnostic length regardless of delta size.
+    """
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self._pending = ""
+        self._heading: Optional[str] = None
+        self._lines: List[str] = []
+
+    def feed(self, delta: str) -> List[Dict]:
+        """Consume a delta and return any sections it completed"""
+        self.parts.append(delta)
+        self._pending += delta
+        cut = self._pending.rfind("\n")
+        if cut == -1:
+            return []
+        complete, self._pending = self._pending[:cut + 1], self._pending[cut + 1:]
+        return self._consume(complete.splitlines(keepends=True))
+
+    def finish(self) -> List[Dict]:
+        """Flush the trailing partial line and close the open section"""
+        lines = [self._pending] if self._pending else []
+        self._pending = ""
+        completed = self._consume(lines)
+        if self._heading is not None:
+            completed.append(self._section())
+            self._heading = None
+        return completed
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def _consume(self, lines: List[str]) -> List[Dict]:
+        completed = []
+        for line in lines:
+            if line.startswith("## PHASE"):
+                if self._heading is not None:
+                    completed.append(self._section())
+                self._heading = line.strip()
+                self._lines = [line]
+            elif self._heading is not None:
+                self._lines.append(line)
+        return completed
+
+    def _section(self) -> Dict:
+        title = self._heading[3:]
+        number = title.split(":", 1)[0].replace("PHASE", "").strip()
+        return {
+            "phase": int(number) if number.isdigit() else None,
+            "title": title,
+            "content": "".join(self._lines).strip()
+        }
+
+
+async def stream_diagnostic(job_id: str, job: Dict, user_prompt: str, system_prompt: str, inputs: "DiagnosticInput") -> str:
+    """Generate the diagnostic as a stream, publishing deltas and finished sections"""
+    tracker = PhaseSectionTracker()
+    job["sections"] = []
+
+    def publish_sections(sections: List[Dict]) -> bool:
+        for section in sections:
+            job["sections"].append(section)
+            if section["phase"] == 8 or "EXECUTIVE SUMMARY" in section["title"].upper():
+                job["executive_summary"] = section["content"]
+            job_events.publish(job_id, "section", section)
+        return bool(sections)
+
+    async for delta in stream_with_claude(user_prompt, system_prompt, inputs=inputs, usage=job.setdefault("usage", {})):
+        job_events.publish(job_id, "delta", {"text": delta})
+        if publish_sections(tracker.feed(delta)):
+            # Other workers report sections_ready from the stored job
+            await diagnostics_store.save(job_id)
+    publish_sections(tracker.finish())
+    return tracker.text
+
+
+def research_terms(inputs: DiagnosticInput) -> Set[str]:
+    """Terms from the inputs that research is ranked against"""
+    return query_terms(
+        inputs.business_name, inputs.target_market, inputs.what_they_sell,
+        inputs.competitors, inputs.challenges, inputs.goals, inputs.context
+    )
 
 
 def build_diagnostic_prompt(inputs: DiagnosticInput, research: Dict) -> str:
@@ -340,6 +784,16 @@ def build_diagnostic_prompt(inputs: DiagnosticInput, research: Dict) -> str:
         "full": "Execute FULL DIAGNOSTIC: All 10 phases with complete analysis."
     }.get(inputs.mode, "Execute STRATEGIC MODE")
 
+    context = budget_research(
+        {
+            "website_content": research.get("website_content", ""),
+            "competitor_data": research.get("competitor_data", []),
+            "market_trends": research.get("market_trends", []),
+        },
+        research_terms(inputs),
+        inputs.mode
+    )
+
     return f"""
 {mode_instruction}
 
@@ -357,13 +811,13 @@ def build_diagnostic_prompt(inputs: DiagnosticInput, research: Dict) -> str:
 ## Research Data
 
 ### Website Content
-{research.get('website_content', '')[:5000]}
+{context["website_content"]}
 
 ### Competitor Intelligence
-{json.dumps(research.get('competitor_data', []), indent=2)[:3000]}
+{context["competitor_data"]}
 
 ### Market Trends
-{json.dumps(research.get('market_trends', []), indent=2)[:2000]}
+{context["market_trends"]}
 
 ---
 
@@ -371,188 +825,801 @@ Generate the complete MarketSauce diagnostic based on this information. Follow t
 """
 
 
-def extract_executive_summary(diagnostic: str) -> str:
+def build_section_index(diagnostic: str) -> SectionIndex:
+    """Parse the diagnostic's heading tree once; every extractor reads from it"""
+    return SectionIndex.build(diagnostic)
+
+
+def extract_executive_summary(diagnostic: str, index: Optional[SectionIndex] = None) -> str:
     """Extract executive summary from diagnostic"""
-    if "## PHASE 8" in diagnostic or "## Executive Summary" in diagnostic:
-        markers = ["## PHASE 8", "## Executive Summary", "### Executive Summary"]
-        for marker in markers:
-            if marker in diagnostic:
-                start = diagnostic.find(marker)
-                end = diagnostic.find("## PHASE 9", start)
-                if end == -1:
-                    end = diagnostic.find("## PHASE 10", start)
-                if end == -1:
-                    end = min(start + 3000, len(diagnostic))
-                return diagnostic[start:end].strip()
-    return diagnostic[:2000]
-
-
-def extract_system_prompt(diagnostic: str) -> Optional[str]:
+    return (index or build_section_index(diagnostic)).executive_summary()
+
+
+def extract_system_prompt(diagnostic: str, index: Optional[SectionIndex] = None) -> Optional[str]:
     """Extract system prompt from diagnostic"""
-    if "### 9.2" in diagnostic or "## System Prompt" in diagnostic:
-        markers = ["### 9.2 System Prompt", "## System Prompt", "### System Prompt"]
-        for marker in markers:
-            if marker in diagnostic:
-                start = diagnostic.find(marker)
-                end = diagnostic.find("## PHASE 10", start)
-                if end == -1:
-                    end = min(start + 5000, len(diagnostic))
-                return diagnostic[start:end].strip()
-    return None
-
-
-def extract_follow_up_prompts(diagnostic: str) -> Optional[List[str]]:
+    return (index or build_section_index(diagnostic)).system_prompt()
+
+
+def extract_follow_up_prompts(diagnostic: str, index: Optional[SectionIndex] = None) -> Optional[List[str]]:
     """Extract follow-up prompts from diagnostic"""
-    if "## PHASE 10" in diagnostic:
-        start = diagnostic.find("## PHASE 10")
-        section = diagnostic[start:]
-        prompts = []
-        for i in range(1, 16):
-            patterns = [f"**{i}.", f"{i}.", f"**{i})**", f"{i})"]
-            for pattern in patterns:
-                if pattern in section:
-                    prompt_start = section.find(pattern)
-                    next_markers = [f"**{i+1}.", f"{i+1}.", f"**{i+1})**", f"{i+1})"]
-                    prompt_end = len(section)
-                    for nm in next_markers:
-                        if nm in section[prompt_start+len(pattern):]:
-                            prompt_end = section.find(nm, prompt_start+len(pattern))
-                            break
-                    prompts.append(section[prompt_start:prompt_end].strip())
-                    break
-        return prompts if prompts else None
-    return None
+    return (index or build_section_index(diagnostic)).follow_up_prompts()
+
+
+def job_section_index(job: Dict) -> Optional[SectionIndex]:
+    """Section index for a finished job, reusing the one stored on it"""
+    diagnostic = job.get("diagnostic")
+    if not diagnostic:
+        return None
+    return SectionIndex.from_dict(diagnostic, job.get("section_index"))
+
+
+# Research phases run concurrently; each diagnostic phase starts as soon as its inputs are ready
+
+async def research_website(values: Dict) -> Dict:
+    data = await run_research_call(website_call(values["inputs"]))
+    return {"website_content": website_markdown(data)}
+
+
+async def research_market(values: Dict) -> Dict:
+    data = await run_research_call(market_call(values["inputs"]))
+    return {"market_trends": search_results(data)}
+
+
+async def research_competitors(values: Dict) -> Dict:
+    inputs = values["inputs"]
+    results = await asyncio.gather(*[run_research_call(call) for call in competitor_calls(inputs)])
+    return {"competitor_data": competitor_research(inputs, results)}
+
+
+async def compile_research(values: Dict) -> Dict:
+    """Combine the research and checkpoint it, so a restarted job doesn't fetch it again"""
+    research = {
+        "website_content": values["website_content"],
+        "competitor_data": values.get("competitor_data", []),
+        "market_trends": values["market_trends"]
+    }
+    await diagnostics_store.checkpoint(values["job_id"], finished_phases(values["job_id"]), research=research)
+    return {"research": research}
+
+
+async def generate_diagnostic(values: Dict) -> Dict:
+    job_id, inputs = values["job_id"], values["inputs"]
+    job = diagnostics_store[job_id]
+    user_prompt = build_diagnostic_prompt(inputs, values["research"])
+    system_prompt = get_system_prompt()
+
+    async with upstream_slot("anthropic"):
+        if DIAGNOSTIC_STREAMING:
+            diagnostic = await stream_diagnostic(job_id, job, user_prompt, system_prompt, inputs)
+        else:
+            diagnostic = await generate_with_claude(
+                user_prompt, system_prompt, inputs=inputs, usage=job.setdefault("usage", {})
+            )
+    await diagnostics_store.checkpoint(job_id, finished_phases(job_id), diagnostic=diagnostic)
+    return {"diagnostic": diagnostic}
+
+
+def extract_deliverables(diagnostic: str) -> Dict:
+    """Section index, executive summary, system prompt and follow-ups of a diagnostic"""
+    index = build_section_index(diagnostic)
+    return {
+        "section_index": index.to_dict(),
+        "executive_summary": extract_executive_summary(diagnostic, index),
+        "system_prompt": extract_system_prompt(diagnostic, index),
+        "follow_up_prompts": extract_follow_up_prompts(diagnostic, index)
+    }
+
+
+async def deliverables_phase(values: Dict) -> Dict:
+    return {"deliverables": extract_deliverables(values["diagnostic"])}
+
+
+# Competitive intelligence is Phase 3 of the methodology, which Express mode skips
+DIAGNOSTIC_GRAPH = PhaseGraph([
+    Phase("website", "Scraping the website", research_website, inputs=("inputs",), outputs=("website_content",)),
+    Phase("market", "Researching market trends", research_market, inputs=("inputs",), outputs=("market_trends",)),
+    Phase(
+        "competitors", "Researching competitors", research_competitors,
+        inputs=("inputs",), outputs=("competitor_data",), modes=frozenset(("strategic", "full"))
+    ),
+    Phase(
+        "research", "Compiling research", compile_research,
+        inputs=("job_id", "website_content", "market_trends"), optional=("competitor_data",), outputs=("research",)
+    ),
+    Phase(
+        "generate", "Generating the diagnostic", generate_diagnostic,
+        inputs=("job_id", "inputs", "research"), outputs=("diagnostic",)
+    ),
+    Phase("deliverables", "Extracting deliverables", deliverables_phase, inputs=("diagnostic",), outputs=("deliverables",)),
+])
+DIAGNOSTIC_TARGETS = ("diagnostic", "deliverables")
+# Phases batch research covers for every item before generation is scheduled
+RESEARCH_PHASES = ("website", "market", "competitors", "research")
+DIAGNOSTIC_MODES = ("express", "strategic", "full")
+mode_graphs: Dict[str, PhaseGraph] = {}
+
+
+def mode_graph(mode: Optional[str]) -> PhaseGraph:
+    """The diagnostic graph pruned to what a mode needs (unknown modes run as strategic)"""
+    mode = mode if mode in DIAGNOSTIC_MODES else "strategic"
+    graph = mode_graphs.get(mode)
+    if graph is None:
+        graph = mode_graphs[mode] = DIAGNOSTIC_GRAPH.for_mode(mode, DIAGNOSTIC_TARGETS)
+    return graph
+
+
+def job_plan(job_id: str) -> List[Dict]:
+    """The job's per-phase progress records, (re)built if missing or from another graph"""
+    job = diagnostics_store[job_id]
+    graph = mode_graph(job["inputs"].get("mode"))
+    names = [phase.name for phase in graph.order]
+    if [record["name"] for record in job.get("phases") or []] != names:
+        job["phases"] = graph.plan()
+        job["total_phases"] = len(names)
+    return job["phases"]
+
+
+def finished_phases(job_id: str) -> int:
+    return sum(1 for record in job_plan(job_id) if record["status"] in FINISHED_PHASE_STATES)
+
+
+def phase_changed(job_id: str, record: Dict):
+    """Roll a phase transition up into the job's progress fields and announce it to subscribers"""
+    job = diagnostics_store[job_id]
+    running = [phase["title"] for phase in job_plan(job_id) if phase["status"] == "running"]
+    job["current_phase"] = finished_phases(job_id)
+    job["phase_name"] = ", ".join(running) if running else record["title"]
+    if record["status"] == "complete" and record["duration_seconds"] is not None:
+        phase_latency.observe(record["duration_seconds"], phase=record["name"], mode=job["inputs"].get("mode"))
+    job_events.publish(job_id, "phase", {
+        "current_phase": job["current_phase"],
+        "phase_name": job["phase_name"],
+        "phase": dict(record)
+    })
+
+
+def update_phases(job_id: str, names: Iterable[str], status: str):
+    """Move phases that run outside the graph (batch research, message batches) to a new status"""
+    now = datetime.utcnow()
+    for record in job_plan(job_id):
+        if record["name"] not in names:
+            continue
+        if status == "running":
+            record.update(started_at=now.isoformat(), duration_seconds=None)
+        elif record["started_at"]:
+            record["duration_seconds"] = round((now - datetime.fromisoformat(record["started_at"])).total_seconds(), 3)
+        record["status"] = status
+        phase_changed(job_id, record)
 
 
 async def run_diagnostic_pipeline(job_id: str, inputs: DiagnosticInput):
-    """Run the full diagnostic generation pipeline"""
+    """Run the job's phase graph, resuming from whatever its checkpoint already holds"""
     job = diagnostics_store[job_id]
+    job["status"] = "processing"
+    checkpoint = await diagnostics_store.load_checkpoint(job_id)
+    values = {"job_id": job_id, "inputs": inputs}
+    values.update({name: checkpoint[name] for name in ("research", "diagnostic") if name in checkpoint})
+
+    async def changed(record: Dict):
+        phase_changed(job_id, record)
+        # Stored at every transition, so status reads on any worker see it
+        await diagnostics_store.save(job_id)
 
     try:
-        # Phase 1: Website scraping
-        job["current_phase"] = 1
-        job["phase_name"] = "Gathering website intelligence"
-        website_data = await scrape_website(inputs.website_url)
-
-        # Phase 2: Competitor research
-        job["current_phase"] = 2
-        job["phase_name"] = "Researching competitors"
-        competitor_data = []
-        if inputs.competitors:
-            competitors = [c.strip() for c in inputs.competitors.split(",")][:5]
-            for comp in competitors:
-                comp_research = await search_web(f"{comp} company reviews pricing", 3)
-                competitor_data.append({"name": comp, "data": comp_research})
-
-        # Phase 3: Market trends
-        job["current_phase"] = 3
-        job["phase_name"] = "Analyzing market trends"
-        market_trends = await search_web(f"{inputs.target_market} industry trends 2025 2026", 5)
-
-        # Phase 4: Build persona
-        job["current_phase"] = 4
-        job["phase_name"] = "Building persona profile"
-
-        # Phase 5: Identify opportunities
-        job["current_phase"] = 5
-        job["phase_name"] = "Identifying opportunities"
-
-        # Phase 6: Generate diagnostic
-        job["current_phase"] = 6
-        job["phase_name"] = "Generating strategic brief"
-
-        research = {
-            "website_content": website_data.get("data", {}).get("markdown", website_data.get("markdown", "")),
-            "competitor_data": competitor_data,
-            "market_trends": market_trends.get("data", market_trends.get("results", []))
-        }
+        outputs = await mode_graph(inputs.mode).run(
+            values, DIAGNOSTIC_TARGETS, plan=job_plan(job_id), on_change=changed
+        )
+        await complete_job(job_id, outputs["diagnostic"], outputs["deliverables"])
+
+    except Exception as e:
+        await fail_job(job_id, str(e))
 
-        user_prompt = build_diagnostic_prompt(inputs, research)
-        system_prompt = get_system_prompt()
+    finally:
+        end_job(job_id)
 
-        diagnostic = await generate_with_claude(user_prompt, system_prompt, inputs=inputs)
 
-        # Phase 7: Create implementation plan
-        job["current_phase"] = 7
-        job["phase_name"] = "Creating implementation plan"
+async def complete_job(job_id: str, diagnostic: str, deliverables: Optional[Dict] = None):
+    """Store a generated diagnostic and its deliverables and mark the job complete"""
+    job = diagnostics_store[job_id]
+    if deliverables is None:
+        # Generated outside the graph (a message batch), so its last phases finish here
+        update_phases(job_id, ["generate"], "complete")
+        update_phases(job_id, ["deliverables"], "running")
+        deliverables = extract_deliverables(diagnostic)
+        update_phases(job_id, ["deliverables"], "complete")
+
+    job["status"] = "complete"
+    job["diagnostic"] = diagnostic
+    job.update(deliverables)
+    job["completed_at"] = datetime.utcnow().isoformat()
+    await diagnostics_store.save(job_id)
+    job_events.publish(job_id, "complete", {"status": "complete"})
+
+
+async def fail_job(job_id: str, error: str):
+    """Mark a job failed and tell its subscribers"""
+    job = diagnostics_store[job_id]
+    job["status"] = "error"
+    job["error"] = error
+    await diagnostics_store.save(job_id)
+    job_events.publish(job_id, "error", {"status": "error", "error": error})
 
-        # Phase 8: Compile report
-        job["current_phase"] = 8
-        job["phase_name"] = "Compiling final report"
 
-        # Extract sections
-        executive_summary = extract_executive_summary(diagnostic)
-        system_prompt_output = extract_system_prompt(diagnostic)
-        follow_up_prompts = extract_follow_up_prompts(diagnostic)
+def end_job(job_id: str):
+    """Record a finished job's outcome, close its event log and let go of it"""
+    job = diagnostics_store[job_id]
+    # A pipeline cancelled at shutdown is unfinished; another worker picks it up
+    if job["status"] in FINISHED_STATUSES:
+        diagnostic_jobs.inc(mode=job["inputs"].get("mode"), status=job["status"])
+        job_events.close(job_id)
+    diagnostics_store.release(job_id)
 
-        # Update job with results
-        job["status"] = "complete"
-        job["diagnostic"] = diagnostic
-        job["executive_summary"] = executive_summary
-        job["system_prompt"] = system_prompt_output
-        job["follow_up_prompts"] = follow_up_prompts
-        job["completed_at"] = datetime.utcnow().isoformat()
 
+async def run_queued_job(job_id: str):
+    """Scheduler entry point: run a claimed job's pipeline, or take over its message batch"""
+    job = diagnostics_store[job_id]
+    await job_events.adopt(job_id)
+    if job.get("message_batch_id"):
+        # Its worker stopped while the batch was generating; poll it here for every item still waiting
+        job_ids = [job_id] + await diagnostics_store.claim_message_batch(job["message_batch_id"])
+        for other in job_ids[1:]:
+            await job_events.adopt(other)
+        spawn_batch_task(await_message_batch(job.get("batch_id"), job["message_batch_id"], job_ids))
+        return
+    await run_diagnostic_pipeline(job_id, DiagnosticInput(**job["inputs"]))
+
+
+# The queue is shared by every worker process through the job store
+diagnostic_scheduler = DiagnosticScheduler(run_queued_job, diagnostics_store)
+
+registry.gauge(
+    "marketsauce_diagnostic_jobs_in_flight",
+    "Diagnostic pipelines currently running",
+    lambda: {(): len(diagnostic_scheduler.running)}
+)
+registry.gauge(
+    "marketsauce_diagnostic_queue_depth",
+    "Interactive diagnostic jobs waiting for a worker (batch items are not counted)",
+    lambda: {(): diagnostic_scheduler.depth}
+)
+registry.callback_counter(
+    "marketsauce_research_coalesced_total",
+    "Scrapes and searches that joined an identical call already in flight",
+    lambda: {(): research_flights.stats()["coalesced"]}
+)
+
+
+def spawn_batch_task(coro) -> asyncio.Task:
+    """Run batch work in the background, holding a reference until it finishes"""
+    task = asyncio.create_task(coro)
+    batch_tasks.add(task)
+    task.add_done_callback(batch_tasks.discard)
+    return task
+
+
+async def run_batch(batch_id: str, job_ids: List[str], use_message_batches: bool):
+    """Research the whole batch once, then hand its items to the scheduler or the Message Batches API"""
+    batch = diagnostic_batches[batch_id]
+    items = [DiagnosticInput(**diagnostics_store[job_id]["inputs"]) for job_id in job_ids]
+
+    try:
+        # The research phases for every item at once; shared competitors, markets and sites are fetched once
+        for job_id in job_ids:
+            diagnostics_store[job_id]["status"] = "processing"
+            update_phases(job_id, RESEARCH_PHASES, "running")
+            await diagnostics_store.save(job_id)
+        research, batch["research"] = await gather_batch_research(items)
+        for job_id, item_research in zip(job_ids, research):
+            update_phases(job_id, RESEARCH_PHASES, "complete")
+            diagnostics_store[job_id].update(status="queued", phase_name="Queued")
+            await diagnostics_store.checkpoint(job_id, finished_phases(job_id), research=item_research)
     except Exception as e:
-        job["status"] = "error"
-        job["error"] = str(e)
+        for job_id in job_ids:
+            await fail_job(job_id, str(e))
+            end_job(job_id)
+        return
+
+    if use_message_batches:
+        await submit_message_batch(batch_id, job_ids, items, research)
+        return
+
+    # The pipeline finds the research checkpoint and starts at generation, on whichever worker claims it
+    for job_id, inputs in zip(job_ids, items):
+        await job_events.handoff(job_id)
+        await diagnostic_scheduler.submit(job_id, inputs.mode, force=True, batch=True)
+
+
+async def submit_message_batch(batch_id: str, job_ids: List[str], items: List[DiagnosticInput], research: List[Dict]):
+    """Send every item's generation call as one Message Batches request"""
+    system_prompt = get_system_prompt()
+    requests = []
+    for job_id, inputs, item_research in zip(job_ids, items, research):
+        diagnostics_store[job_id]["status"] = "processing"
+        update_phases(job_id, ["generate"], "running")
+        requests.append(diagnostic_batch_request(job_id, build_diagnostic_prompt(inputs, item_research), system_prompt))
+
+    try:
+        message_batch = await create_message_batch(requests)
+    except Exception as e:
+        for job_id in job_ids:
+            await fail_job(job_id, str(e) or "Could not create message batch")
+            end_job(job_id)
+        return
+
+    for job_id in job_ids:
+        # Lets a restarted process resume polling instead of regenerating
+        diagnostics_store[job_id]["message_batch_id"] = message_batch["id"]
+        await diagnostics_store.save(job_id)
+    await await_message_batch(batch_id, message_batch["id"], job_ids)
+
+
+async def await_message_batch(batch_id: str, message_batch_id: str, job_ids: List[str]):
+    """Poll a message batch until it ends, then finish its items from the results file"""
+    batch = diagnostic_batches.setdefault(batch_id, {"batch_id": batch_id})
+    batch["generation"] = "message_batches"
+    pending = set(job_ids)
+
+    try:
+        failures = 0
+        while True:
+            try:
+                message_batch = await retrieve_message_batch(message_batch_id)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                if failures >= DIAGNOSTIC_BATCH_POLL_FAILURES:
+                    raise
+                print(f"Polling message batch {message_batch_id} failed: {e}")
+            else:
+                batch["message_batch"] = {
+                    "id": message_batch_id,
+                    "processing_status": message_batch.get("processing_status"),
+                    "request_counts": message_batch.get("request_counts"),
+                }
+                if message_batch.get("processing_status") == "ended":
+                    break
+            await asyncio.sleep(DIAGNOSTIC_BATCH_POLL_INTERVAL)
+
+        async for entry in message_batch_results(message_batch["results_url"]):
+            job_id = entry.get("custom_id")
+            if job_id not in pending:
+                continue
+            pending.discard(job_id)
+            result = entry.get("result") or {}
+            try:
+                if result.get("type") == "succeeded":
+                    message = result["message"]
+                    usage_tracker.record(
+                        "diagnostic_batch", message.get("usage"), into=diagnostics_store[job_id].setdefault("usage", {})
+                    )
+                    diagnostic = "".join(
+                        block.get("text", "") for block in message.get("content", []) if block.get("type") == "text"
+                    )
+                    await diagnostics_store.checkpoint(job_id, finished_phases(job_id), diagnostic=diagnostic)
+                    await complete_job(job_id, diagnostic)
+                else:
+                    await fail_job(job_id, f"Message batch request {result.get('type', 'failed')}")
+            except Exception as e:
+                await fail_job(job_id, str(e))
+            finally:
+                end_job(job_id)
+
+        error = "Missing from message batch results"
+    except Exception as e:
+        error = str(e) or "Message batch failed"
+
+    for job_id in pending:
+        await fail_job(job_id, error)
+        end_job(job_id)
 
 
 @router.post("/create", response_model=DiagnosticResponse)
-async def create_diagnostic(
-    inputs: DiagnosticInput,
-    background_tasks: BackgroundTasks
-):
+async def create_diagnostic(inputs: DiagnosticInput):
     """Create a new diagnostic job"""
+    if await diagnostic_scheduler.full():
+        raise HTTPException(
+            status_code=429,
+            detail="Diagnostic queue is full, please retry shortly",
+            headers={"Retry-After": str(diagnostic_scheduler.retry_after())}
+        )
+
     job_id = str(uuid.uuid4())
+    plan = mode_graph(inputs.mode).plan()
 
     # Initialize job
     diagnostics_store[job_id] = {
         "job_id": job_id,
-        "status": "processing",
+        "status": "queued",
         "current_phase": 0,
-        "total_phases": 8,
-        "phase_name": "Initializing",
+        "total_phases": len(plan),
+        "phase_name": "Queued",
+        "phases": plan,
         "inputs": inputs.model_dump(),
         "created_at": datetime.utcnow().isoformat()
     }
+    await diagnostics_store.save(job_id)
 
-    # Start background processing
-    background_tasks.add_task(run_diagnostic_pipeline, job_id, inputs)
+    # Hand off to the worker pool; its events are published by whichever worker claims it
+    try:
+        position = await diagnostic_scheduler.submit(job_id, inputs.mode)
+    except QueueFull as e:
+        diagnostics_store[job_id].update(status="error", error="Diagnostic queue is full")
+        await diagnostics_store.save(job_id)
+        job_events.close(job_id)
+        diagnostics_store.release(job_id)
+        raise HTTPException(
+            status_code=429,
+            detail="Diagnostic queue is full, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
 
     return DiagnosticResponse(
         job_id=job_id,
-        status="processing",
-        message="Diagnostic generation started"
+        status="queued",
+        message=f"Diagnostic queued at position {position}"
     )
 
 
-@router.get("/status/{job_id}", response_model=DiagnosticStatus)
-async def get_diagnostic_status(job_id: str):
-    """Get the status of a diagnostic job"""
-    if job_id not in diagnostics_store:
+@router.post("/batch", response_model=BatchResponse)
+async def create_diagnostic_batch(request: BatchRequest):
+    """Create diagnostics for many businesses, sharing research across the batch"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Batch has no items")
+    if len(request.items) > DIAGNOSTIC_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {DIAGNOSTIC_BATCH_MAX_ITEMS} items")
+
+    use_message_batches = DIAGNOSTIC_MESSAGE_BATCHES if request.use_message_batches is None else request.use_message_batches
+    # Demo mode has no API key, so it always generates through the scheduler
+    use_message_batches = use_message_batches and bool(ANTHROPIC_API_KEY)
+
+    batch_id = str(uuid.uuid4())
+    created_at = datetime.utcnow().isoformat()
+    job_ids = []
+    for index, inputs in enumerate(request.items):
+        job_id = str(uuid.uuid4())
+        plan = mode_graph(inputs.mode).plan()
+        diagnostics_store[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "current_phase": 0,
+            "total_phases": len(plan),
+            "phase_name": "Waiting for batch research",
+            "phases": plan,
+            "inputs": inputs.model_dump(),
+            "batch_id": batch_id,
+            "batch_index": index,
+            "created_at": created_at
+        }
+        await diagnostics_store.save(job_id)
+        job_events.open(job_id)
+        job_ids.append(job_id)
+
+    diagnostic_batches[batch_id] = {
+        "batch_id": batch_id,
+        "job_ids": job_ids,
+        "generation": "message_batches" if use_message_batches else "scheduler",
+        "created_at": created_at
+    }
+    spawn_batch_task(run_batch(batch_id, job_ids, use_message_batches))
+
+    return BatchResponse(
+        batch_id=batch_id,
+        status="queued",
+        total=len(job_ids),
+        job_ids=job_ids,
+        message=f"Batch of {len(job_ids)} diagnostics queued"
+    )
+
+
+async def batch_job_ids(batch_id: str) -> List[str]:
+    """Item job ids of a batch, from memory or (after a restart) the job store"""
+    batch = diagnostic_batches.get(batch_id)
+    if batch is None or "job_ids" not in batch:
+        job_ids = await diagnostics_store.batch_job_ids(batch_id)
+        if not job_ids:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        batch = diagnostic_batches.setdefault(batch_id, {"batch_id": batch_id})
+        batch["job_ids"] = job_ids
+    return batch["job_ids"]
+
+
+@router.get("/batch/{batch_id}", response_model=BatchStatus)
+async def get_batch_status(batch_id: str):
+    """Get the progress of every diagnostic in a batch"""
+    job_ids = await batch_job_ids(batch_id)
+    batch = diagnostic_batches[batch_id]
+
+    progress = await diagnostics_store.progress_many(job_ids)
+    items = []
+    for index, job_id in enumerate(job_ids):
+        job = progress[job_id]
+        items.append(BatchItemStatus(
+            index=index,
+            job_id=job_id,
+            business_name=job["business_name"],
+            status=job["status"],
+            current_phase=job["current_phase"],
+            phase_name=job["phase_name"],
+            queue_position=job["queue_position"],
+            error=job["error"]
+        ))
+
+    counts: Dict[str, int] = {}
+    for item in items:
+        counts[item.status] = counts.get(item.status, 0) + 1
+    if counts.get("complete", 0) + counts.get("error", 0) == len(items):
+        status = "complete"
+    elif counts.get("queued", 0) == len(items):
+        status = "queued"
+    else:
+        status = "processing"
+
+    return BatchStatus(
+        batch_id=batch_id,
+        status=status,
+        total=len(items),
+        counts=counts,
+        generation=batch.get("generation"),
+        research=batch.get("research"),
+        message_batch=batch.get("message_batch"),
+        items=items
+    )
+
+
+@router.get("/batch/{batch_id}/results")
+async def download_batch_results(batch_id: str):
+    """Download a batch's results as NDJSON, one line per diagnostic, streamed item by item"""
+    job_ids = await batch_job_ids(batch_id)
+
+    async def lines():
+        for index, job_id in enumerate(job_ids):
+            job = await diagnostics_store.fetch(job_id)
+            yield json.dumps({
+                "index": index,
+                "job_id": job_id,
+                "business_name": job["inputs"]["business_name"],
+                "status": job["status"],
+                "diagnostic": job.get("diagnostic"),
+                "executive_summary": job.get("executive_summary"),
+                "system_prompt": job.get("system_prompt"),
+                "follow_up_prompts": job.get("follow_up_prompts"),
+                "error": job.get("error")
+            }) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="batch-{batch_id}.ndjson"'}
+    )
+
+
+@router.get("/stream/{job_id}")
+async def stream_diagnostic_events(job_id: str, request: Request):
+    """Stream generation deltas and completed sections as Server-Sent Events"""
+    progress = await diagnostics_store.progress(job_id)
+    if progress is None:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    job = diagnostics_store[job_id]
+    last_event_id = request.headers.get("last-event-id")
+    start = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+
+    async def events():
+        log = await job_events.follow_remote(job_id, progress["status"] in FINISHED_STATUSES)
+        if log is None:
+            # Job finished before anyone subscribed and its log has expired
+            job = await diagnostics_store.fetch(job_id)
+            yield format_sse(0, job["status"], {
+                "status": job["status"],
+                "diagnostic": job.get("diagnostic"),
+                "error": job.get("error")
+            })
+            return
+        async for item in log.follow(start):
+            if item is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(*item)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+@router.get("/queue/stats")
+async def get_queue_stats():
+    """Get diagnostic worker pool and queue statistics"""
+    return await diagnostic_scheduler.stats()
+
 
-    return DiagnosticStatus(
+@router.get("/cache/stats")
+async def get_research_cache_stats():
+    """Get research cache hit/miss and request coalescing statistics"""
+    return {**research_cache.stats(), "coalescing": research_flights.stats()}
+
+
+def slim_status(job_id: str, progress: Dict) -> Dict:
+    """Progress fields of a job without any of its result payload"""
+    return {
+        "job_id": job_id,
+        "status": progress["status"],
+        "current_phase": progress["current_phase"],
+        "total_phases": progress["total_phases"],
+        "phase_name": progress["phase_name"],
+        "queue_position": progress["queue_position"],
+        "phases": progress["phases"],
+        "sections_ready": progress["sections_ready"],
+        "error": progress["error"]
+    }
+
+
+async def full_status_body(job_id: str, progress: Dict) -> bytes:
+    """Serialized DiagnosticStatus; built once per finished job"""
+    body = finished_status_bodies.get(job_id)
+    if body is not None:
+        finished_status_bodies.move_to_end(job_id)
+        return body
+
+    job = await diagnostics_store.fetch(job_id)
+    body = DiagnosticStatus(
         job_id=job_id,
         status=job["status"],
         current_phase=job["current_phase"],
         total_phases=job["total_phases"],
         phase_name=job["phase_name"],
+        queue_position=progress["queue_position"],
+        phases=job.get("phases"),
         diagnostic=job.get("diagnostic"),
         executive_summary=job.get("executive_summary"),
         system_prompt=job.get("system_prompt"),
         follow_up_prompts=job.get("follow_up_prompts"),
         error=job.get("error")
-    )
+    ).model_dump_json().encode()
+    if job["status"] in FINISHED_STATUSES:
+        finished_status_bodies[job_id] = body
+        while len(finished_status_bodies) > DIAGNOSTIC_STATUS_CACHE_ENTRIES:
+            finished_status_bodies.popitem(last=False)
+    return body
+
+
+@router.get("/status/{job_id}", response_model=DiagnosticStatus)
+async def get_diagnostic_status(job_id: str, request: Request, slim: bool = False):
+    """Get the status of a diagnostic job.
+
+    slim=true leaves out the diagnostic and its extracted sections. Both
+    variants carry an ETag derived from the progress fields alone, which
+    are read without loading the job's result, so an unchanged job answers
+    If-None-Match with 304 before anything is serialized.
+    """
+    progress = await diagnostics_store.progress(job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    status = slim_status(job_id, progress)
+    # Result fields only change alongside a progress field or at completion
+    etag = make_etag(json.dumps(
+        ["slim" if slim else "full", status, progress["completed_at"]], separators=(",", ":")
+    ).encode())
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if slim:
+        return FastJSONResponse(status, headers=headers)
+    return Response(await full_status_body(job_id, progress), media_type="application/json", headers=headers)
+
+
+def progress_event(event_id: int, event: str, data: Any) -> Dict:
+    return {"id": event_id, "event": event, "data": data}
+
+
+@router.websocket("/ws/{job_id}")
+async def job_progress_socket(websocket: WebSocket, job_id: str, after: int = -1, deltas: bool = False):
+    """Push phase transitions, finished sections and the outcome as JSON messages.
+
+    Resume with ?after=<last id seen>; ?deltas=true also sends text deltas.
+    """
+    progress = await diagnostics_store.progress(job_id)
+    if progress is None:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+
+    try:
+        log = await job_events.follow_remote(job_id, progress["status"] in FINISHED_STATUSES)
+        if log is None:
+            # Finished before anyone subscribed and its log has expired
+            await websocket.send_json(progress_event(0, progress["status"], slim_status(job_id, progress)))
+        else:
+            async for item in log.follow(after + 1):
+                if item is None:
+                    await websocket.send_json({"event": "ping"})
+                elif deltas or item[1] != "delta":
+                    await websocket.send_json(progress_event(*item))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+@router.get("/events/{job_id}")
+async def poll_job_progress(job_id: str, after: int = -1, timeout: float = LONG_POLL_TIMEOUT, deltas: bool = False):
+    """Long-poll for progress events after `after`; returns as soon as there are any, or at the timeout"""
+    progress = await diagnostics_store.progress(job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    log = await job_events.follow_remote(job_id, progress["status"] in FINISHED_STATUSES)
+    if log is None:
+        status = slim_status(job_id, progress)
+        return {"events": [progress_event(0, progress["status"], status)], "last_event_id": 0, "done": True}
+
+    deadline = time.monotonic() + max(0.0, min(timeout, LONG_POLL_TIMEOUT))
+    position = max(after + 1, 0)
+    events = []
+    while True:
+        events = [item for item in log.events[position:] if deltas or item[1] != "delta"]
+        # Skipped deltas count as seen
+        position = len(log.events)
+        if events or log.closed:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not await log.wait(position, remaining):
+            break
+
+    return {
+        "events": [progress_event(*item) for item in events],
+        "last_event_id": position - 1,
+        "done": log.closed and position >= len(log.events)
+    }
 
 
 @router.get("/{job_id}")
-async def get_diagnostic(job_id: str):
-    """Get the full diagnostic results"""
-    if job_id not in diagnostics_store:
+async def get_diagnostic(job_id: str, fields: Optional[str] = None):
+    """Get the full diagnostic results.
+
+    fields= limits the response to a comma-separated list of fields, e.g.
+    fields=status,executive_summary,inputs.business_name
+    """
+    job = await diagnostics_store.fetch(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    return diagnostics_store[job_id]
+    return FastJSONResponse(project(job, fields))
+
+
+@router.get("/{job_id}/sections")
+async def get_diagnostic_sections(job_id: str):
+    """Get the heading outline of a finished diagnostic"""
+    job = await diagnostics_store.fetch(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    index = job_section_index(job)
+    if index is None:
+        raise HTTPException(status_code=409, detail="Diagnostic not ready")
+
+    return {"job_id": job_id, "sections": index.outline()}
+
+
+@router.get("/{job_id}/sections/{section_id}")
+async def get_diagnostic_section(job_id: str, section_id: int):
+    """Get the text of one section of a finished diagnostic"""
+    job = await diagnostics_store.fetch(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    index = job_section_index(job)
+    if index is None:
+        raise HTTPException(status_code=409, detail="Diagnostic not ready")
+    if not 0 <= section_id < len(index.sections):
+        raise HTTPException(status_code=404, detail="Section not found")
+
+    section = index.sections[section_id]
+    return {
+        "job_id": job_id,
+        "id": section.index,
+        "level": section.level,
+        "title": section.title,
+        "content": index.content(section)
+    }
@@ -4,22 +4,40 @@ Generates downloadable DOCX and PDF reports
 """
 
 import io
+import os
 import re
-from typing import Optional
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 
+from services.sections import SectionIndex
+from services.render_pool import render_pool
+from services.document_cache import document_cache, document_key
+from services.etags import etag_matches
+
 router = APIRouter()
 
+# Bump when rendered output changes so cached documents are rebuilt
+RENDERER_VERSION = "3"
+
+
+def document_date(timestamp: Optional[str] = None) -> str:
+    """The date printed on a document: when its diagnostic completed, or today for uploaded text"""
+    moment = datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+    return moment.strftime("%B %d, %Y")
+
 
 class DocumentRequest(BaseModel):
     """Request to generate a document"""
     diagnostic: str
     business_name: str
-    format: str = "docx"  # docx or md
+    format: str = "docx"  # docx, md or pdf
 
 
 def clean_markdown_for_docx(text: str) -> str:
@@ -29,7 +47,56 @@ def clean_markdown_for_docx(text: str) -> str:
     return text
 
 
-def generate_docx(diagnostic: str, business_name: str) -> io.BytesIO:
+# One pass over a section body classifies every non-blank line. Alternatives are
+# tried in the order the old startswith/re.match chain checked them; each body
+# group excludes the line's surrounding whitespace.
+BODY_LINE = re.compile(
+    r"""^[ \t]*(?:
+        [-*][ ](?P<bullet>[ \t]*\S.*?)
+      | (?P<ordinal>\d+)\.[ \t]*(?P<number>.*?)
+      | (?P<bold>\*\*.*)(?<=\*\*)
+      | (?P<table>\|.*?)
+      | (?P<text>\S.*?)
+    )[ \t\r]*$""",
+    re.M | re.X
+)
+
+
+TABLE_SEPARATOR = re.compile(r"^\|?[ \t]*:?-{3,}")
+
+
+def list_style_ids(doc) -> Dict[str, str]:
+    return {kind: doc.styles[name].style_id for kind, name in (("bullet", "List Bullet"), ("number", "List Number"))}
+
+
+def add_body_lines(doc, body: str, style_ids: Optional[Dict[str, str]] = None):
+    """Add the non-heading lines of a section to the document"""
+    style_ids = style_ids or list_style_ids(doc)
+    for match in BODY_LINE.finditer(body):
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind in style_ids:
+            # Bullet or numbered list item. Setting the style id directly skips the
+            # scan over every style that python-docx does for each styled paragraph
+            doc.add_paragraph(text)._p.style = style_ids[kind]
+        elif kind == "bold":
+            # Bold text as subheading
+            doc.add_paragraph().add_run(text.replace("**", "")).bold = True
+        elif kind == "table":
+            # Table row - simplified handling
+            doc.add_paragraph(text.replace("|", " | "))
+        elif "**" in text:
+            # Regular paragraph with inline bold
+            para = doc.add_paragraph()
+            for i, part in enumerate(text.split("**")):
+                run = para.add_run(part)
+                if i % 2 == 1:
+                    run.bold = True
+        else:
+            doc.add_paragraph(text)
+
+
+def generate_docx(diagnostic: str, business_name: str, date: str, index: Optional[SectionIndex] = None) -> io.BytesIO:
     """Generate a DOCX document from the diagnostic"""
     try:
         from docx import Document
@@ -42,6 +109,7 @@ def generate_docx(diagnostic: str, business_name: str) -> io.BytesIO:
         )
 
     doc = Document()
+    style_ids = list_style_ids(doc)
 
     # Title
     title = doc.add_heading(f'{business_name} Market Diagnostic', 0)
@@ -52,60 +120,19 @@ def generate_docx(diagnostic: str, business_name: str) -> io.BytesIO:
     subtitle.alignment = WD_ALIGN_PARAGRAPH.CENTER
 
     # Date
-    date_para = doc.add_paragraph(f'Date: {datetime.now().strftime("%B %d, %Y")}')
+    date_para = doc.add_paragraph(f'Date: {date}')
     date_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
 
     doc.add_paragraph()  # Spacer
 
-    # Process the diagnostic content
-    lines = diagnostic.split('\n')
-    current_list = None
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            current_list = None
-            continue
-
-        # Handle headers
-        if line.startswith('## PHASE') or line.startswith('## '):
-            doc.add_heading(line.replace('## ', '').replace('#', ''), level=1)
-            current_list = None
-        elif line.startswith('### '):
-            doc.add_heading(line.replace('### ', ''), level=2)
-            current_list = None
-        elif line.startswith('#### '):
-            doc.add_heading(line.replace('#### ', ''), level=3)
-            current_list = None
-        elif line.startswith('- ') or line.startswith('* '):
-            # Bullet points
-            text = line[2:]
-            para = doc.add_paragraph(text, style='List Bullet')
-        elif re.match(r'^\d+\.', line):
-            # Numbered list
-            text = re.sub(r'^\d+\.\s*', '', line)
-            para = doc.add_paragraph(text, style='List Number')
-        elif line.startswith('**') and line.endswith('**'):
-            # Bold text as subheading
-            text = line.replace('**', '')
-            para = doc.add_paragraph()
-            run = para.add_run(text)
-            run.bold = True
-        elif line.startswith('|'):
-            # Table row - simplified handling
-            para = doc.add_paragraph(line.replace('|', ' | '))
-        else:
-            # Regular paragraph
-            # Handle inline bold
-            if '**' in line:
-                para = doc.add_paragraph()
-                parts = re.split(r'\*\*', line)
-                for i, part in enumerate(parts):
-                    run = para.add_run(part)
-                    if i % 2 == 1:
-                        run.bold = True
-            else:
-                doc.add_paragraph(line)
+    # Headings come from the section index; the text between them is body
+    index = index or SectionIndex.build(diagnostic)
+    cursor = 0
+    for section in index.sections:
+        add_body_lines(doc, diagnostic[cursor:section.start], style_ids)
+        doc.add_heading(section.title.replace('#', ''), level=min(max(section.level - 1, 1), 3))
+        cursor = section.body_start
+    add_body_lines(doc, diagnostic[cursor:], style_ids)
 
     # Save to buffer
     buffer = io.BytesIO()
@@ -114,12 +141,17 @@ def generate_docx(diagnostic: str, business_name: str) -> io.BytesIO:
     return buffer
 
 
-def generate_markdown(diagnostic: str, business_name: str) -> io.BytesIO:
+def render_docx(diagnostic: str, business_name: str, date: str) -> bytes:
+    """DOCX bytes for a diagnostic; module-level so the render pool can pickle it"""
+    return generate_docx(diagnostic, business_name, date).getvalue()
+
+
+def generate_markdown(diagnostic: str, business_name: str, date: str) -> io.BytesIO:
     """Generate a Markdown document"""
     content = f"""# {business_name} Market Diagnostic
 
 Generated by MarketSauce Agent
-Date: {datetime.now().strftime("%B %d, %Y")}
+Date: {date}
 
 ---
 
@@ -135,26 +167,216 @@ Date: {datetime.now().strftime("%B %d, %Y")}
     return buffer
 
 
+def render_markdown(diagnostic: str, business_name: str, date: str) -> bytes:
+    return generate_markdown(diagnostic, business_name, date).getvalue()
+
+
+def pdf_markup(text: str) -> str:
+    """Escape text for a reportlab Paragraph and turn **runs** into bold"""
+    text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    parts = text.split("**")
+    return "".join(f"<b>{part}</b>" if i % 2 == 1 else part for i, part in enumerate(parts))
+
+
+def pdf_table(rows: List[str], styles, width: float):
+    """A real table from consecutive `| a | b |` lines (separator rows dropped)"""
+    from reportlab.lib import colors
+    from reportlab.platypus import Paragraph, Table, TableStyle
+
+    cells = [
+        [cell.strip() for cell in row.strip().strip("|").split("|")]
+        for row in rows
+        if not TABLE_SEPARATOR.match(row)
+    ]
+    columns = max(len(row) for row in cells)
+    data = [
+        [Paragraph(pdf_markup(cell), styles["TableHeader" if r == 0 else "TableCell"]) for cell in row]
+        + [""] * (columns - len(row))
+        for r, row in enumerate(cells)
+    ]
+    table = Table(data, colWidths=[width / columns] * columns, repeatRows=1)
+    table.setStyle(TableStyle([
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#eeeeee")),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+    ]))
+    return table
+
+
+def pdf_body(body: str, styles, width: float) -> List:
+    """Flowables for the non-heading lines of a section"""
+    from reportlab.platypus import Paragraph
+
+    flowables = []
+    table_rows: List[str] = []
+    for match in BODY_LINE.finditer(body):
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == "table":
+            table_rows.append(text)
+            continue
+        if table_rows:
+            flowables.append(pdf_table(table_rows, styles, width))
+            table_rows = []
+        if kind == "bullet":
+            flowables.append(Paragraph(pdf_markup(text), styles["ListItem"], bulletText="\u2022"))
+        elif kind == "number":
+            flowables.append(Paragraph(pdf_markup(text), styles["ListItem"], bulletText=f"{match.group('ordinal')}."))
+        elif kind == "bold":
+            flowables.append(Paragraph(f"<b>{pdf_markup(text.replace('**', ''))}</b>", styles["BodyText"]))
+        else:
+            flowables.append(Paragraph(pdf_markup(text), styles["BodyText"]))
+    if table_rows:
+        flowables.append(pdf_table(table_rows, styles, width))
+    return flowables
+
+
+def generate_pdf(diagnostic: str, business_name: str, date: str, path: str):
+    """Render the diagnostic as a PDF file at `path`"""
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.pagesizes import LETTER
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle("ListItem", parent=styles["BodyText"], leftIndent=18, bulletIndent=6))
+    styles.add(ParagraphStyle("TableCell", parent=styles["BodyText"], fontSize=9, leading=11))
+    styles.add(ParagraphStyle("TableHeader", parent=styles["TableCell"], fontName="Helvetica-Bold"))
+    styles.add(ParagraphStyle("Centered", parent=styles["Normal"], alignment=TA_CENTER))
+
+    doc = SimpleDocTemplate(
+        path,
+        pagesize=LETTER,
+        title=f"{business_name} Market Diagnostic",
+        author="MarketSauce Agent",
+        leftMargin=inch,
+        rightMargin=inch,
+        # No creation timestamp or random document ID, so equal input renders equal bytes
+        invariant=True,
+    )
+    story = [
+        Paragraph(pdf_markup(f"{business_name} Market Diagnostic"), styles["Title"]),
+        Paragraph("Generated by MarketSauce Agent", styles["Centered"]),
+        Paragraph(f"Date: {date}", styles["Centered"]),
+        Spacer(1, 0.3 * inch),
+    ]
+
+    # Same heading structure as the DOCX export
+    index = SectionIndex.build(diagnostic)
+    cursor = 0
+    for section in index.sections:
+        story.extend(pdf_body(diagnostic[cursor:section.start], styles, doc.width))
+        level = min(max(section.level - 1, 1), 3)
+        story.append(Paragraph(pdf_markup(section.title.replace("#", "")), styles[f"Heading{level}"]))
+        cursor = section.body_start
+    story.extend(pdf_body(diagnostic[cursor:], styles, doc.width))
+
+    doc.build(story)
+
+
+# format -> (media type, renderer, how it runs: "inline", "pool" for bytes, "file" for a pooled file render)
+FORMATS = {
+    "docx": ("application/vnd.openxmlformats-officedocument.wordprocessingml.document", render_docx, "pool"),
+    "md": ("text/markdown", render_markdown, "inline"),
+    "pdf": ("application/pdf", generate_pdf, "file"),
+}
+
+
+async def render_document(diagnostic: str, business_name: str, date: str, format: str) -> Tuple[str, bytes]:
+    """(etag, bytes) for a document, rendering it only on a cache miss"""
+    key = document_key(RENDERER_VERSION, format, business_name, date, diagnostic)
+    cached = await document_cache.get(key)
+    if cached is not None:
+        return cached
+
+    _, renderer, mode = FORMATS[format]
+    if mode == "pool":
+        # python-docx is CPU-bound; render in the pool so SSE streams and polls keep flowing
+        data = await render_pool.run(renderer, diagnostic, business_name, date)
+    else:
+        data = renderer(diagnostic, business_name, date)
+    return await document_cache.set(key, data)
+
+
+async def render_document_file(diagnostic: str, business_name: str, date: str, format: str) -> Tuple[str, Path, bool]:
+    """(etag, path, temporary) for a document rendered straight to disk.
+
+    Large formats never pass through this process's memory: the worker
+    writes the file, which is adopted into the disk cache tier (or is
+    temporary and deleted after sending when that tier is disabled).
+    """
+    key = document_key(RENDERER_VERSION, format, business_name, date, diagnostic)
+    cached = await document_cache.get_file(key)
+    if cached is not None:
+        return (*cached, False)
+
+    _, renderer, _ = FORMATS[format]
+    handle, scratch = tempfile.mkstemp(suffix=f".{format}", dir=document_cache.scratch_dir())
+    os.close(handle)
+    try:
+        await render_pool.run(renderer, diagnostic, business_name, date, scratch)
+        etag, path = await document_cache.put_file(key, Path(scratch))
+    except BaseException:
+        Path(scratch).unlink(missing_ok=True)
+        raise
+    return etag, path, path == Path(scratch)
+
+
+async def document_response(
+    http_request: Request, diagnostic: str, business_name: str, date: str, format: str
+) -> Response:
+    """Download response with a strong ETag; 304 when the client already has this version"""
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of: {', '.join(FORMATS)}")
+
+    media_type, _, mode = FORMATS[format]
+    filename = f"{business_name.replace(' ', '_')}_Diagnostic.{format}"
+    if mode == "file":
+        etag, path, temporary = await render_document_file(diagnostic, business_name, date, format)
+        cleanup = BackgroundTask(path.unlink, missing_ok=True) if temporary else None
+    else:
+        etag, data = await render_document(diagnostic, business_name, date, format)
+
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(http_request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers, background=cleanup if mode == "file" else None)
+
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    if mode == "file":
+        # Streamed from disk in chunks, so memory stays flat for long reports
+        return FileResponse(path, media_type=media_type, headers=headers, background=cleanup)
+    return Response(data, media_type=media_type, headers=headers)
+
+
 @router.post("/generate")
-async def generate_document(request: DocumentRequest):
+async def generate_document(request: DocumentRequest, http_request: Request):
     """Generate a downloadable document"""
-    if request.format == "docx":
-        buffer = generate_docx(request.diagnostic, request.business_name)
-        filename = f"{request.business_name.replace(' ', '_')}_Diagnostic.docx"
-        media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    elif request.format == "md":
-        buffer = generate_markdown(request.diagnostic, request.business_name)
-        filename = f"{request.business_name.replace(' ', '_')}_Diagnostic.md"
-        media_type = "text/markdown"
-    else:
-        raise HTTPException(status_code=400, detail="Invalid format. Use 'docx' or 'md'")
+    return await document_response(
+        http_request, request.diagnostic, request.business_name, document_date(), request.format
+    )
 
-    return StreamingResponse(
-        buffer,
-        media_type=media_type,
-        headers={
-            "Content-Disposition": f'attachment; filename="{filename}"'
-        }
+
+@router.get("/cache/stats")
+async def get_document_cache_stats():
+    """Get rendered document cache hit/miss statistics"""
+    return document_cache.stats()
+
+
+@router.get("/{job_id}.{format}")
+async def download_job_document(job_id: str, format: str, http_request: Request):
+    """Download a finished diagnostic by job id, without re-uploading its text"""
+    # Imported here so render pool workers, which import this module, stay light
+    from api.diagnostic import diagnostics_store
+
+    job = await diagnostics_store.fetch(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Diagnostic not found")
+    if job["status"] != "complete" or not job.get("diagnostic"):
+        raise HTTPException(status_code=409, detail="Diagnostic is not complete yet")
+    # Dated by completion, so every download of the job (and its cache entry) is the same document
+    return await document_response(
+        http_request, job["diagnostic"], job["inputs"]["business_name"], document_date(job.get("completed_at")), format
     )
 
 
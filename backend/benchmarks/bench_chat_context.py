@@ -0,0 +1,61 @@
+"""
+Chat context benchmark
+Per-turn input tokens for a long conversation: whole history versus the bounded context window
+
+Run from backend/: python -m benchmarks.bench_chat_context [--turns 100]
+"""
+
+import asyncio
+import argparse
+from typing import Dict, List, Optional
+
+from api.chat import demo_summary, get_chat_system_prompt
+from benchmarks.standins import filler
+from services.chat_context import SummaryRefresher, build_window, message_tokens
+from services.context_budget import estimate_tokens
+
+REPORT_TURNS = (1, 5, 10, 20, 50, 100, 200, 500)
+
+
+async def run(turns: int, user_chars: int, reply_chars: int):
+    system_prompt = get_chat_system_prompt(filler(8000))
+    session: Dict = {"messages": []}
+
+    async def summarize(previous: Optional[str], new_turns: List[Dict]) -> str:
+        return demo_summary(previous, new_turns)
+
+    async def save(session_id: str, summary: Dict):
+        session["summary"] = summary
+
+    refresher = SummaryRefresher(summarize, save)
+    system_tokens = estimate_tokens(system_prompt)
+
+    print(f"{'turn':>6} {'full history tok':>17} {'window tok':>11} {'verbatim msgs':>14} {'summarized':>11}")
+    full_peak = window_peak = 0
+    for turn in range(1, turns + 1):
+        messages = session["messages"] + [{"role": "user", "content": f"Question {turn}: " + filler(user_chars)}]
+        full = system_tokens + sum(message_tokens(message) for message in messages)
+        window = build_window(system_prompt, session, messages)
+        full_peak = max(full_peak, full)
+        window_peak = max(window_peak, window.tokens)
+        if turn in REPORT_TURNS:
+            print(f"{turn:>6} {full:>17} {window.tokens:>11} {len(window.messages):>14} "
+                  f"{(session.get('summary') or {}).get('through', 0):>11}")
+
+        session["messages"] = messages + [{"role": "assistant", "content": filler(reply_chars)}]
+        refresher.schedule("bench", session)
+        # Let the background refresh land before the next turn, as it would between user messages
+        await asyncio.sleep(0)
+        await asyncio.gather(*refresher._tasks)
+
+    print(f"\npeak input tokens over {turns} turns: full history {full_peak}, window {window_peak} "
+          f"({full_peak / window_peak:.1f}x); {refresher.refreshes} summary refreshes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--user-chars", type=int, default=300)
+    parser.add_argument("--reply-chars", type=int, default=2400)
+    args = parser.parse_args()
+    asyncio.run(run(args.turns, args.user_chars, args.reply_chars))
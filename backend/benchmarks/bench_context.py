@@ -0,0 +1,138 @@
+"""
+Research context benchmark
+Prompt tokens and retained research facts: hard character slices versus the token budgeter
+
+Run from backend/: python -m benchmarks.bench_context [--website-kb 30] [--competitors 5]
+"""
+
+import json
+import random
+import argparse
+from typing import Dict, List
+
+from api.diagnostic import DiagnosticInput, build_diagnostic_prompt
+from services.context_budget import RESEARCH_TOKEN_BUDGETS, estimate_tokens
+
+NAV = "\n".join(f"- [{item}](https://acme-dental.example/{item.lower()})" for item in
+                ("Home", "Services", "Pricing", "About", "Blog", "Careers", "Contact", "Login"))
+FOOTER = "Copyright 2025 Acme Dental Growth. [Privacy](https://acme-dental.example/privacy) | " \
+         "[Terms](https://acme-dental.example/terms) | ![badge](https://cdn.example/badge.png)"
+FILLER = ("Our team has been helping businesses for years with a friendly approach and great results. "
+          "We believe in doing things the right way and treating every client like family. ")
+
+
+# Original prompt research block, kept verbatim for comparison
+def legacy_prompt(inputs: DiagnosticInput, research: Dict) -> str:
+    mode_instruction = {
+        "express": "Execute EXPRESS MODE: Phases 1-2 + abbreviated Executive Summary.",
+        "strategic": "Execute STRATEGIC MODE: Phases 1-5, 8-9 with full detail.",
+        "full": "Execute FULL DIAGNOSTIC: All 10 phases with complete analysis."
+    }.get(inputs.mode, "Execute STRATEGIC MODE")
+
+    return f"""
+{mode_instruction}
+
+## Business Information
+
+**Business Name:** {inputs.business_name}
+**Website URL:** {inputs.website_url}
+**Target Market:** {inputs.target_market}
+**What They Sell:** {inputs.what_they_sell}
+**Known Competitors:** {inputs.competitors or "Not provided"}
+**Marketing Challenges:** {inputs.challenges or "Not provided"}
+**12-Month Goals:** {inputs.goals or "Not provided"}
+**Additional Context:** {inputs.context or "Not provided"}
+
+## Research Data
+
+### Website Content
+{research.get('website_content', '')[:5000]}
+
+### Competitor Intelligence
+{json.dumps(research.get('competitor_data', []), indent=2)[:3000]}
+
+### Market Trends
+{json.dumps(research.get('market_trends', []), indent=2)[:2000]}
+
+---
+
+Generate the complete MarketSauce diagnostic based on this information. Follow the methodology precisely. Include all required sections for the selected mode. Use visceral emotional language for persona sections. Cite sources with links where applicable.
+"""
+
+
+def synthetic_research(website_kb: int, competitors: List[str], rng: random.Random) -> Dict:
+    """Scrape/search results shaped like Firecrawl's, with FACT-n markers on the relevant passages"""
+    facts = iter(range(1000))
+    blocks = [NAV, "# Acme Dental Growth"]
+    while sum(len(block) for block in blocks) < website_kb * 1024:
+        roll = rng.random()
+        if roll < 0.15:
+            blocks.append(f"FACT-{next(facts)}: Acme runs patient acquisition campaigns for dental clinics, "
+                          f"with recall reminders and new patient booking funnels.")
+        elif roll < 0.25:
+            blocks.append(NAV)
+        else:
+            blocks.append(FILLER * rng.randint(1, 4))
+    blocks.append(FOOTER)
+
+    def results(query: str, count: int, relevant: int) -> Dict:
+        items = []
+        for i in range(count):
+            fact = f"FACT-{next(facts)}: " if i < relevant else ""
+            items.append({
+                "url": f"https://review-site.example/{query.replace(' ', '-')}/{i}",
+                "title": f"{query.title()} result {i}",
+                "description": fact + ("Patient acquisition pricing and reviews from dental clinics. " if fact else "")
+                + FILLER * rng.randint(1, 3),
+                "markdown": None,
+                "metadata": {"statusCode": 200, "sourceURL": f"https://review-site.example/{i}"},
+            })
+        rng.shuffle(items)
+        return {"success": True, "data": items}
+
+    return {
+        "website_content": "\n\n".join(blocks),
+        "competitor_data": [
+            {"name": name, "data": results(f"{name} company reviews pricing", 3, 1)}
+            for name in competitors
+        ],
+        "market_trends": results("dental clinics industry trends", 5, 2)["data"],
+    }
+
+
+def facts_in(text: str) -> int:
+    return len(set(part.split(":")[0] for part in text.split("FACT-")[1:]))
+
+
+def run(website_kb: int, competitor_count: int, seed: int):
+    rng = random.Random(seed)
+    names = ["Bright Smile Marketing", "DentalBoost", "ToothGrowth", "Patient Pipeline", "SmileOps"][:competitor_count]
+    research = synthetic_research(website_kb, names, rng)
+    planted = facts_in(json.dumps(research))
+    print(f"research: {website_kb}KB website, {competitor_count} competitors, {planted} relevant facts planted")
+    print(f"{'mode':>10} {'budget':>7} {'legacy tok':>11} {'budgeted tok':>13} {'saved':>7} {'legacy facts':>13} {'budgeted facts':>15}")
+    for mode in ("express", "strategic", "full"):
+        inputs = DiagnosticInput(
+            business_name="Acme Dental Growth",
+            website_url="https://acme-dental.example",
+            target_market="dental clinics",
+            what_they_sell="patient acquisition campaigns",
+            competitors=", ".join(names),
+            challenges="new patient booking and recall",
+            mode=mode,
+        )
+        legacy = legacy_prompt(inputs, research)
+        budgeted = build_diagnostic_prompt(inputs, research)
+        legacy_tokens = estimate_tokens(legacy)
+        budgeted_tokens = estimate_tokens(budgeted)
+        print(f"{mode:>10} {RESEARCH_TOKEN_BUDGETS[mode]:>7} {legacy_tokens:>11} {budgeted_tokens:>13} "
+              f"{legacy_tokens - budgeted_tokens:>7} {facts_in(legacy):>13} {facts_in(budgeted):>15}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--website-kb", type=int, default=30)
+    parser.add_argument("--competitors", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    run(args.website_kb, args.competitors, args.seed)
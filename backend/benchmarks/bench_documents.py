@@ -0,0 +1,141 @@
+"""
+Document export benchmark
+Event-loop lag while DOCX exports run inline versus in the render pool
+
+Run from backend/: python -m benchmarks.bench_documents [--kb 100] [--exports 4]
+"""
+
+import re
+import time
+import asyncio
+import argparse
+from typing import Dict, List
+
+from api import documents
+from benchmarks.bench_sections import synthetic_diagnostic
+from services.render_pool import RenderPool
+
+PROBE_INTERVAL = 0.005
+
+
+# Original line classifier, for comparison
+def legacy_add_body_lines(doc, body: str, styles=None):
+    for line in body.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith('- ') or line.startswith('* '):
+            text = line[2:]
+            para = doc.add_paragraph(text, style='List Bullet')
+        elif re.match(r'^\d+\.', line):
+            text = re.sub(r'^\d+\.\s*', '', line)
+            para = doc.add_paragraph(text, style='List Number')
+        elif line.startswith('**') and line.endswith('**'):
+            text = line.replace('**', '')
+            para = doc.add_paragraph()
+            run = para.add_run(text)
+            run.bold = True
+        elif line.startswith('|'):
+            para = doc.add_paragraph(line.replace('|', ' | '))
+        else:
+            if '**' in line:
+                para = doc.add_paragraph()
+                parts = re.split(r'\*\*', line)
+                for i, part in enumerate(parts):
+                    run = para.add_run(part)
+                    if i % 2 == 1:
+                        run.bold = True
+            else:
+                doc.add_paragraph(line)
+
+
+def legacy_render(diagnostic: str, business_name: str) -> bytes:
+    original = documents.add_body_lines
+    documents.add_body_lines = legacy_add_body_lines
+    try:
+        return documents.generate_docx(diagnostic, business_name, documents.document_date()).getvalue()
+    finally:
+        documents.add_body_lines = original
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def probe_lag(stop: asyncio.Event, lags: List[float]):
+    """Sleep in short ticks and record how late each wake-up is"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+
+async def measure(strategy: str, diagnostic: str, exports: int, pool: RenderPool = None) -> Dict:
+    lags: List[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_lag(stop, lags))
+    await asyncio.sleep(PROBE_INTERVAL * 4)
+
+    async def export(n: int):
+        if strategy == "inline-legacy":
+            # What the route used to do: build the document on the event loop
+            return legacy_render(diagnostic, f"Bench {n}")
+        if strategy == "inline":
+            return documents.render_docx(diagnostic, f"Bench {n}", documents.document_date())
+        return await pool.run(documents.render_docx, diagnostic, f"Bench {n}", documents.document_date())
+
+    started = time.perf_counter()
+    await asyncio.gather(*[export(n) for n in range(exports)])
+    wall = time.perf_counter() - started
+    stop.set()
+    await probe
+    return {
+        "wall": wall,
+        "p50": percentile(lags, 50),
+        "p99": percentile(lags, 99),
+        "max": max(lags),
+    }
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def run(kb: int, exports: int, workers: int):
+    diagnostic = synthetic_diagnostic(kb * 1024)
+
+    legacy_s = timed(lambda: legacy_render(diagnostic, "Bench"), 3)
+    current_s = timed(lambda: documents.render_docx(diagnostic, "Bench", documents.document_date()), 3)
+    print(f"single export of {len(diagnostic) / 1024:.0f}KB: legacy {legacy_s * 1000:.0f} ms, "
+          f"tokenizer {current_s * 1000:.0f} ms ({legacy_s / current_s:.2f}x)")
+
+    print(f"\n{exports} concurrent exports, {workers} render workers")
+    print(f"{'strategy':>14} {'wall s':>8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    pools = {
+        "thread-pool": RenderPool("thread", workers, workers),
+        "process-pool": RenderPool("process", workers, workers),
+    }
+    # Start the process pool's workers before timing
+    await pools["process-pool"].run(documents.render_docx, "warm up", "Bench", documents.document_date())
+    for strategy in ("inline-legacy", "inline", "thread-pool", "process-pool"):
+        result = await measure(strategy, diagnostic, exports, pools.get(strategy))
+        print(f"{strategy:>14} {result['wall']:>8.2f} {result['p50'] * 1000:>11.2f} "
+              f"{result['p99'] * 1000:>11.2f} {result['max'] * 1000:>11.2f}")
+    for pool in pools.values():
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--kb", type=int, default=100, help="diagnostic size")
+    parser.add_argument("--exports", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(run(args.kb, args.exports, args.workers))
@@ -0,0 +1,136 @@
+"""
+Response size and encoding benchmark
+Bytes and CPU for a finished full-mode job and a long chat session: stdlib vs orjson, fields= projections, gzip and brotli
+
+Run from backend/: python -m benchmarks.bench_responses [--kb 32 64 128]
+A full-mode diagnostic (max_tokens 16000) is roughly 64KB of markdown. The synthetic
+diagnostic repeats its filler, so it compresses far better than real output; expect
+gzip and brotli to shrink real diagnostics about 4-6x.
+"""
+
+import gzip
+import json
+import argparse
+import time
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+
+from api.diagnostic import PhaseSectionTracker, extract_deliverables, mode_graph
+from benchmarks.bench_sections import synthetic_diagnostic
+from services.chat_context import CHAT_SUMMARY_MAX_TOKENS
+from services.compression import BROTLI_QUALITY, GZIP_LEVEL, brotli
+from services.responses import dumps, project
+
+# What the frontend reads from each endpoint
+DIAGNOSTIC_FIELDS = "status,executive_summary,follow_up_prompts,inputs.business_name"
+SESSION_FIELDS = "messages,summary"
+CHAT_TURNS = 40
+
+
+def full_mode_job(diagnostic: str) -> Dict:
+    """A finished full-mode job as stored, with the sections published while it streamed"""
+    tracker = PhaseSectionTracker()
+    sections = tracker.feed(diagnostic) + tracker.finish()
+    phases = mode_graph("full").plan()
+    for record in phases:
+        record.update(status="complete", started_at="2026-10-17T12:00:00", duration_seconds=12.345)
+    return {
+        "job_id": "0b7f6c1e-5d1a-4c47-9a8e-2f9f0b1d2c3e",
+        "status": "complete",
+        "current_phase": len(phases),
+        "total_phases": len(phases),
+        "phase_name": "Complete",
+        "phases": phases,
+        "inputs": {
+            "business_name": "Benchmark Co",
+            "website_url": "https://benchmark.example.com",
+            "target_market": "Independent fitness studios in North America",
+            "what_they_sell": "Membership and class booking software",
+            "competitors": "Mindbody, Glofox, Vagaro",
+            "mode": "full",
+        },
+        "sections": sections,
+        "usage": {"input_tokens": 9120, "output_tokens": 16000, "cache_read_input_tokens": 4096},
+        "diagnostic": diagnostic,
+        **extract_deliverables(diagnostic),
+        "created_at": "2026-10-17T12:00:00",
+        "completed_at": "2026-10-17T12:03:30",
+    }
+
+
+def chat_session(diagnostic: str) -> Dict:
+    """A long chat session seeded with the diagnostic as context"""
+    reply = "Here is a concrete plan for the next two weeks, with channels, copy and budget. " * 12
+    messages: List[Dict] = []
+    for turn in range(CHAT_TURNS):
+        messages.append({"role": "user", "content": f"Question {turn}: how should we position against Mindbody?"})
+        messages.append({"role": "assistant", "content": reply})
+    return {
+        "session_id": "5a0c2d3e-1f4b-4e6a-8c9d-7b1a2e3f4c5d",
+        "diagnostic_context": diagnostic[:8000],
+        "system_prompt": "You are MarketSauce Agent." + diagnostic[:8000],
+        "created_at": "2026-10-17T12:05:00",
+        "messages": messages,
+        "summary": {"text": "- Chose paid social first\n" * (CHAT_SUMMARY_MAX_TOKENS // 8), "through": 24},
+    }
+
+
+def stdlib_encode(content: Any) -> bytes:
+    """What a plain dict returned from an endpoint cost before: jsonable_encoder, then json.dumps"""
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode()
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def report(name: str, content: Dict, fields: str, repeat: int):
+    variants = [("full", content), (f"fields={fields}", project(content, fields))]
+    for label, payload in variants:
+        body = dumps(payload)
+        stdlib_s = timed(lambda: stdlib_encode(payload), repeat)
+        orjson_s = timed(lambda: dumps(payload), repeat)
+        gzipped = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        gzip_s = timed(lambda: gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), repeat)
+        row = (
+            f"{name:<10} {label:<28.28} {len(stdlib_encode(payload)):>9} {stdlib_s * 1000:>9.3f} {orjson_s * 1000:>9.3f}"
+            f" {stdlib_s / orjson_s:>6.1f}x {len(gzipped):>8} {gzip_s * 1000:>8.3f}"
+        )
+        if brotli is not None:
+            brotlied = brotli.compress(body, quality=BROTLI_QUALITY)
+            brotli_s = timed(lambda: brotli.compress(body, quality=BROTLI_QUALITY), repeat)
+            row += f" {len(brotlied):>8} {brotli_s * 1000:>8.3f}"
+        print(row)
+
+
+def run(sizes_kb: List[float], repeat: int):
+    header = (
+        f"{'payload':<10} {'variant':<28} {'bytes':>9} {'stdlib ms':>9} {'orjson ms':>9} {'':>7}"
+        f" {'gzip B':>8} {'gzip ms':>8}"
+    )
+    if brotli is not None:
+        header += f" {'br B':>8} {'br ms':>8}"
+    else:
+        print("brotli is not installed; reporting gzip only")
+    print(header)
+    for kb in sizes_kb:
+        diagnostic = synthetic_diagnostic(int(kb * 1024))
+        print(f"-- diagnostic of {len(diagnostic) / 1024:.0f}KB")
+        report("job", full_mode_job(diagnostic), DIAGNOSTIC_FIELDS, repeat)
+        report("session", chat_session(diagnostic), SESSION_FIELDS, repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--kb", type=float, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    run(args.kb, args.repeat)
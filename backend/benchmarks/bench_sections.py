@@ -0,0 +1,129 @@
+"""
+Section extraction benchmark
+Compares the original str.find extractors with the single-pass SectionIndex
+
+Run from backend/: python -m benchmarks.bench_sections [--mb 1 4 8]
+"""
+
+import argparse
+import time
+from typing import List, Optional
+
+from services.sections import SectionIndex
+
+
+# Original extractors, kept verbatim for comparison
+def legacy_executive_summary(diagnostic: str) -> str:
+    if "## PHASE 8" in diagnostic or "## Executive Summary" in diagnostic:
+        markers = ["## PHASE 8", "## Executive Summary", "### Executive Summary"]
+        for marker in markers:
+            if marker in diagnostic:
+                start = diagnostic.find(marker)
+                end = diagnostic.find("## PHASE 9", start)
+                if end == -1:
+                    end = diagnostic.find("## PHASE 10", start)
+                if end == -1:
+                    end = min(start + 3000, len(diagnostic))
+                return diagnostic[start:end].strip()
+    return diagnostic[:2000]
+
+
+def legacy_system_prompt(diagnostic: str) -> Optional[str]:
+    if "### 9.2" in diagnostic or "## System Prompt" in diagnostic:
+        markers = ["### 9.2 System Prompt", "## System Prompt", "### System Prompt"]
+        for marker in markers:
+            if marker in diagnostic:
+                start = diagnostic.find(marker)
+                end = diagnostic.find("## PHASE 10", start)
+                if end == -1:
+                    end = min(start + 5000, len(diagnostic))
+                return diagnostic[start:end].strip()
+    return None
+
+
+def legacy_follow_up_prompts(diagnostic: str) -> Optional[List[str]]:
+    if "## PHASE 10" in diagnostic:
+        start = diagnostic.find("## PHASE 10")
+        section = diagnostic[start:]
+        prompts = []
+        for i in range(1, 16):
+            patterns = [f"**{i}.", f"{i}.", f"**{i})**", f"{i})"]
+            for pattern in patterns:
+                if pattern in section:
+                    prompt_start = section.find(pattern)
+                    next_markers = [f"**{i+1}.", f"{i+1}.", f"**{i+1})**", f"{i+1})"]
+                    prompt_end = len(section)
+                    for nm in next_markers:
+                        if nm in section[prompt_start+len(pattern):]:
+                            prompt_end = section.find(nm, prompt_start+len(pattern))
+                            break
+                    prompts.append(section[prompt_start:prompt_end].strip())
+                    break
+        return prompts if prompts else None
+    return None
+
+
+def synthetic_diagnostic(target_bytes: int) -> str:
+    """A full-mode-shaped diagnostic padded to roughly target_bytes"""
+    filler = (
+        "**Insight:** Buyers feel overwhelmed by options and want a trusted guide.\n"
+        "- Evidence point with a [source](https://example.com/report)\n"
+        "1. A numbered recommendation that reads like real output.\n\n"
+    )
+    phases = [
+        "FOUNDATION AND CONTEXT ANALYSIS", "DEEP PERSONA ANALYSIS", "COMPETITIVE LANDSCAPE",
+        "MESSAGING", "GOLDEN OPPORTUNITIES", "CHANNELS", "IMPLEMENTATION ROADMAP",
+        "EXECUTIVE SUMMARY", "SYSTEM PROMPT"
+    ]
+    per_phase = max(1, target_bytes // (len(filler) * len(phases) * 3))
+    parts = ["# Benchmark Co Market Diagnostic\n\n"]
+    for n, name in enumerate(phases, 1):
+        parts.append(f"## PHASE {n}: {name}\n\n")
+        for sub in range(1, 4):
+            title = "System Prompt" if (n, sub) == (9, 2) else f"Subsection {sub}"
+            parts.append(f"### {n}.{sub} {title}\n\n" + filler * per_phase)
+        parts.append("---\n\n")
+    parts.append("## PHASE 10: FOLLOW-UP PROMPTS\n\n")
+    parts.extend(f'**{i}.** "Follow-up prompt number {i} for the strategy chat."\n\n' for i in range(1, 16))
+    return "".join(parts)
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(sizes_mb: List[float], repeat: int):
+    print(f"{'size':>8} {'legacy ms':>10} {'index build ms':>15} {'index extract ms':>17} {'speedup':>8}")
+    for mb in sizes_mb:
+        text = synthetic_diagnostic(int(mb * 1024 * 1024))
+
+        def legacy():
+            legacy_executive_summary(text)
+            legacy_system_prompt(text)
+            legacy_follow_up_prompts(text)
+
+        index = SectionIndex.build(text)
+
+        def extract():
+            index.executive_summary()
+            index.system_prompt()
+            index.follow_up_prompts()
+
+        legacy_s = timed(legacy, repeat)
+        build_s = timed(lambda: SectionIndex.build(text), repeat)
+        extract_s = timed(extract, repeat)
+        speedup = legacy_s / (build_s + extract_s)
+        print(f"{len(text) / 1048576:>6.1f}MB {legacy_s * 1000:>10.2f} {build_s * 1000:>15.2f} {extract_s * 1000:>17.3f} {speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mb", type=float, nargs="+", default=[0.1, 1, 4, 8])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.mb, args.repeat)
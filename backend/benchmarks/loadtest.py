@@ -0,0 +1,355 @@
+"""
+End-to-end load test
+Drives the API at fixed concurrency levels against the local upstream stand-ins
+
+Run from backend/: python -m benchmarks.loadtest [--levels 1 4 16] [--requests 20]
+Reports throughput and p50/p95/p99 latency per endpoint and per pipeline phase, and
+writes the results to benchmarks/results/ so runs can be compared across commits
+(--compare results/<earlier>.json).
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+SCENARIOS = ("diagnostic", "chat", "chat-stream")
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(samples: List[float]) -> Dict:
+    if not samples:
+        return {"count": 0}
+    summary = {"count": len(samples), "mean": sum(samples) / len(samples)}
+    for p in PERCENTILES:
+        summary[f"p{p}"] = percentile(samples, p)
+    return summary
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_revision() -> Dict:
+    def git(*args: str) -> str:
+        result = subprocess.run(["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True)
+        return result.stdout.strip()
+    return {"commit": git("rev-parse", "--short", "HEAD") or "unknown", "dirty": bool(git("status", "--porcelain"))}
+
+
+class Recorder:
+    """Latency samples per endpoint and per pipeline phase, plus error counts"""
+
+    def __init__(self):
+        self.endpoints: Dict[str, List[float]] = defaultdict(list)
+        self.phases: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def endpoint(self, name: str, seconds: float):
+        self.endpoints[name].append(seconds)
+
+    def phase(self, name: str, seconds: float):
+        self.phases[name].append(seconds)
+
+    def error(self, name: str, reason: str):
+        self.errors[f"{name} {reason}"] += 1
+
+
+async def read_sse(response: httpx.Response):
+    """Yield (event, data) pairs from a Server-Sent Events response"""
+    event = None
+    async for line in response.aiter_lines():
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:") and event:
+            yield event, json.loads(line[5:])
+            event = None
+
+
+def diagnostic_input(n: int, mode: str) -> Dict:
+    # Unique business and URL per request so the research cache never short-circuits
+    tag = uuid.uuid4().hex[:8]
+    return {
+        "business_name": f"Loadtest {n} {tag}",
+        "website_url": f"https://loadtest-{tag}.example.com",
+        "target_market": f"independent retailers {tag}",
+        "what_they_sell": "inventory software",
+        "competitors": "Acme, Globex, Initech",
+        "mode": mode
+    }
+
+
+async def run_diagnostic(client: httpx.AsyncClient, recorder: Recorder, n: int, mode: str) -> bool:
+    """Create a diagnostic and follow its event stream to completion"""
+    started = time.perf_counter()
+    response = await client.post("/api/diagnostic/create", json=diagnostic_input(n, mode))
+    recorder.endpoint("POST /api/diagnostic/create", time.perf_counter() - started)
+    if response.status_code != 200:
+        recorder.error("POST /api/diagnostic/create", str(response.status_code))
+        return False
+    job_id = response.json()["job_id"]
+
+    # Phases overlap, so each is timed by the server; "queued" is the wait before the first one starts
+    first_phase = None
+    first_delta = None
+    async with client.stream("GET", f"/api/diagnostic/stream/{job_id}", timeout=None) as stream:
+        async for event, data in read_sse(stream):
+            now = time.perf_counter()
+            if event == "phase":
+                phase = data.get("phase") or {}
+                if phase.get("status") == "running" and first_phase is None:
+                    first_phase = now
+                    recorder.phase("queued", now - started)
+                elif phase.get("status") == "complete":
+                    recorder.phase(phase["name"], phase["duration_seconds"])
+            elif event == "delta" and first_delta is None:
+                first_delta = now
+                recorder.phase("time to first token", now - started)
+            elif event in ("complete", "error"):
+                recorder.endpoint("diagnostic end-to-end", now - started)
+                if event == "error":
+                    recorder.error("diagnostic end-to-end", data.get("error", "error")[:60])
+                return event == "complete"
+    recorder.error("diagnostic end-to-end", "stream ended early")
+    return False
+
+
+async def new_chat_session(client: httpx.AsyncClient) -> str:
+    response = await client.post("/api/chat/session", json={"diagnostic_context": "Loadtest diagnostic summary."})
+    return response.json()["session_id"]
+
+
+async def run_chat(client: httpx.AsyncClient, recorder: Recorder, n: int, mode: str) -> bool:
+    session_id = await new_chat_session(client)
+    started = time.perf_counter()
+    response = await client.post("/api/chat/message", json={"session_id": session_id, "message": f"Idea {n}?"})
+    recorder.endpoint("POST /api/chat/message", time.perf_counter() - started)
+    if response.status_code != 200:
+        recorder.error("POST /api/chat/message", str(response.status_code))
+        return False
+    return True
+
+
+async def run_chat_stream(client: httpx.AsyncClient, recorder: Recorder, n: int, mode: str) -> bool:
+    session_id = await new_chat_session(client)
+    started = time.perf_counter()
+    first_delta = None
+    async with client.stream(
+        "POST", "/api/chat/stream", json={"session_id": session_id, "message": f"Idea {n}?"}
+    ) as stream:
+        async for event, data in read_sse(stream):
+            if event == "delta" and first_delta is None:
+                first_delta = time.perf_counter()
+                recorder.phase("chat time to first token", first_delta - started)
+            elif event in ("done", "aborted", "error"):
+                recorder.endpoint("POST /api/chat/stream", time.perf_counter() - started)
+                if event != "done":
+                    recorder.error("POST /api/chat/stream", event)
+                return event == "done"
+    recorder.error("POST /api/chat/stream", "stream ended early")
+    return False
+
+
+RUNNERS = {"diagnostic": run_diagnostic, "chat": run_chat, "chat-stream": run_chat_stream}
+
+
+async def run_level(base_url: str, scenario: str, concurrency: int, requests: int, mode: str) -> Dict:
+    """Issue `requests` scenario runs with at most `concurrency` in flight"""
+    recorder = Recorder()
+    runner = RUNNERS[scenario]
+    counter = iter(range(requests))
+    completed = 0
+
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300.0, limits=limits) as client:
+        async def worker():
+            nonlocal completed
+            for n in counter:
+                try:
+                    if await runner(client, recorder, n, mode):
+                        completed += 1
+                except httpx.HTTPError as e:
+                    recorder.error(scenario, type(e).__name__)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - started
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "completed": completed,
+        "wall_seconds": wall,
+        "throughput": completed / wall if wall else 0.0,
+        "errors": dict(recorder.errors),
+        "endpoints": {name: summarize(s) for name, s in recorder.endpoints.items()},
+        "phases": {name: summarize(s) for name, s in recorder.phases.items()},
+    }
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+def spawn(module: str, port: int, env: Dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL
+    )
+
+
+def start_stack(workdir: str) -> tuple:
+    """Start the stand-ins and the API wired to them; returns (api url, stand-in url, processes)"""
+    standin_port, api_port = free_port(), free_port()
+    standin_url = f"http://127.0.0.1:{standin_port}"
+    standins = spawn("benchmarks.standins:app", standin_port, dict(os.environ))
+    wait_ready(f"{standin_url}/stats", standins)
+
+    env = dict(os.environ)
+    env.update({
+        "ANTHROPIC_API_KEY": "standin",
+        "FIRECRAWL_API_KEY": "standin",
+        "ANTHROPIC_BASE_URL": standin_url,
+        "FIRECRAWL_BASE_URL": standin_url,
+        "DATABASE_URL": f"sqlite:///{workdir}/loadtest.db",
+        "CHAT_SESSIONS_DIR": f"{workdir}/chat_sessions",
+        "RESEARCH_CACHE_PATH": "",
+    })
+    env.setdefault("DIAGNOSTIC_QUEUE_SIZE", "1000")
+    api = spawn("main:app", api_port, env)
+    api_url = f"http://127.0.0.1:{api_port}"
+    try:
+        wait_ready(f"{api_url}/health", api)
+    except RuntimeError:
+        standins.terminate()
+        raise
+    return api_url, standin_url, [api, standins]
+
+
+def print_level(result: Dict):
+    print(f"\n== {result['scenario']} @ concurrency {result['concurrency']}: "
+          f"{result['completed']}/{result['requests']} ok in {result['wall_seconds']:.1f}s, "
+          f"{result['throughput']:.2f} req/s")
+    for title, group in (("endpoint", result["endpoints"]), ("phase", result["phases"])):
+        if not group:
+            continue
+        print(f"  {title:<36} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, s in group.items():
+            print(f"  {name[:36]:<36} {s['count']:>5} "
+                  + " ".join(f"{s[f'p{p}'] * 1000:>9.1f}" for p in PERCENTILES))
+    for reason, count in result["errors"].items():
+        print(f"  error: {reason} x{count}")
+
+
+def compare(current: Dict, baseline_path: Path):
+    """Print p95 and throughput changes against an earlier results file"""
+    baseline = json.loads(baseline_path.read_text())
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["levels"]}
+    print(f"\n== vs {baseline['git']['commit']} ({baseline_path.name})")
+    for result in current["levels"]:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+        change = result["throughput"] / before["throughput"] - 1 if before["throughput"] else 0.0
+        print(f"  {result['scenario']} @ {result['concurrency']}: throughput {change:+.1%}")
+        for group in ("endpoints", "phases"):
+            for name, s in result[group].items():
+                old = before[group].get(name)
+                if s.get("count") and old and old.get("count"):
+                    print(f"    {name[:36]:<36} p95 {old['p95'] * 1000:>9.1f} -> {s['p95'] * 1000:>9.1f} ms")
+
+
+async def run(args) -> Dict:
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    standin_url = None
+    try:
+        if args.target:
+            base_url = args.target
+        else:
+            base_url, standin_url, processes = start_stack(workdir)
+        levels = []
+        for scenario in args.scenarios:
+            for concurrency in args.levels:
+                result = await run_level(base_url, scenario, concurrency, args.requests, args.mode)
+                print_level(result)
+                levels.append(result)
+        upstream_calls = httpx.get(f"{standin_url}/stats").json()["calls"] if standin_url else None
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "git": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "args": {"levels": args.levels, "requests": args.requests, "scenarios": args.scenarios, "mode": args.mode},
+        "standin_env": {k: v for k, v in os.environ.items() if k.startswith("STANDIN_")},
+        "upstream_calls": upstream_calls,
+        "levels": levels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=20, help="scenario runs per concurrency level")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--mode", default="strategic", help="diagnostic mode")
+    parser.add_argument("--target", help="drive an already-running API instead of spawning one")
+    parser.add_argument("--output", type=Path, help="results file (default: results/<time>-<commit>.json)")
+    parser.add_argument("--compare", type=Path, help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    output = args.output or RESULTS_DIR / (
+        f"{datetime.utcnow():%Y%m%dT%H%M%S}-{results['git']['commit']}"
+        f"{'-dirty' if results['git']['dirty'] else ''}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
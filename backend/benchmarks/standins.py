@@ -0,0 +1,319 @@
+"""
+Local upstream stand-ins
+Fake Anthropic Messages, Message Batches and Firecrawl APIs with injected latency, errors and payload sizes
+
+Run from backend/: python -m benchmarks.standins [--port 8100]
+Then point the app at it:
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8100 FIRECRAWL_BASE_URL=http://127.0.0.1:8100
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import Counter
+from dataclasses import dataclass, fields
+from typing import AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.bench_sections import synthetic_diagnostic
+
+# Completions at or above this max_tokens are treated as diagnostics, below as chat
+DIAGNOSTIC_MAX_TOKENS = 8000
+CHUNK_CHARS = 64
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class StandinProfile:
+    """Latency (median seconds), error rates and payload sizes; override with STANDIN_<NAME>"""
+    claude_ttft: float = 0.5
+    claude_tokens_per_second: float = 2000.0
+    diagnostic_bytes: int = 40000
+    chat_bytes: int = 1200
+    scrape_latency: float = 0.8
+    scrape_bytes: int = 30000
+    search_latency: float = 0.6
+    agent_latency: float = 3.0
+    batch_latency: float = 5.0
+    jitter: float = 0.4
+    error_rate: float = 0.0
+    overload_rate: float = 0.0
+    stream_error_rate: float = 0.0
+    retry_after: int = 2
+
+    @classmethod
+    def from_env(cls) -> "StandinProfile":
+        overrides = {}
+        for f in fields(cls):
+            value = os.environ.get(f"STANDIN_{f.name.upper()}")
+            if value is not None:
+                overrides[f.name] = type(f.default)(value)
+        return cls(**overrides)
+
+
+profile = StandinProfile.from_env()
+calls: Counter = Counter()
+# Message batches by id: the batch object plus its JSONL result lines once ended
+message_batches: Dict[str, Dict] = {}
+app = FastAPI(title="MarketSauce upstream stand-ins")
+
+
+def sample_latency(median: float) -> float:
+    """Log-normal around the median, which gives the long right tail real upstreams have"""
+    if median <= 0:
+        return 0.0
+    return random.lognormvariate(math.log(median), profile.jitter)
+
+
+def filler(size: int) -> str:
+    sentence = "Buyers in this market compare three vendors before booking a call. "
+    return (sentence * (size // len(sentence) + 1))[:size]
+
+
+def injected_error(upstream: str) -> Optional[JSONResponse]:
+    """Maybe fail the call: overloads carry retry-after, other errors are plain 500s"""
+    roll = random.random()
+    if roll < profile.overload_rate:
+        status = 529 if upstream == "anthropic" and roll < profile.overload_rate / 2 else 429
+        calls[f"{upstream}:{status}"] += 1
+        return JSONResponse(
+            {"type": "error", "error": {"type": "overloaded_error" if status == 529 else "rate_limit_error"}},
+            status_code=status,
+            headers={"retry-after": str(profile.retry_after)}
+        )
+    if roll < profile.overload_rate + profile.error_rate:
+        calls[f"{upstream}:500"] += 1
+        return JSONResponse({"type": "error", "error": {"type": "api_error"}}, status_code=500)
+    return None
+
+
+def completion_text(body: Dict) -> str:
+    if body.get("max_tokens", 0) >= DIAGNOSTIC_MAX_TOKENS:
+        return synthetic_diagnostic(profile.diagnostic_bytes)
+    return filler(profile.chat_bytes)
+
+
+def usage_for(body: Dict, text: str) -> Dict:
+    prompt_chars = len(json.dumps(body.get("system", ""))) + len(json.dumps(body.get("messages", [])))
+    return {
+        "input_tokens": prompt_chars // CHARS_PER_TOKEN,
+        "output_tokens": len(text) // CHARS_PER_TOKEN,
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": 0
+    }
+
+
+def sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def message_stream(body: Dict, text: str) -> AsyncIterator[str]:
+    """Replay a completion as Messages API stream events at the profile's token rate"""
+    usage = usage_for(body, text)
+    yield sse("message_start", {
+        "type": "message_start",
+        "message": {"id": "msg_standin", "type": "message", "role": "assistant", "content": [],
+                    "model": body.get("model"), "usage": {**usage, "output_tokens": 1}}
+    })
+    yield sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                      "content_block": {"type": "text", "text": ""}})
+    fail_at = len(text) * random.random() if random.random() < profile.stream_error_rate else None
+    delay = CHUNK_CHARS / CHARS_PER_TOKEN / profile.claude_tokens_per_second
+    for start in range(0, len(text), CHUNK_CHARS):
+        if fail_at is not None and start >= fail_at:
+            calls["anthropic:stream_error"] += 1
+            yield sse("error", {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+            return
+        await asyncio.sleep(delay)
+        yield sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                          "delta": {"type": "text_delta", "text": text[start:start + CHUNK_CHARS]}})
+    yield sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+    yield sse("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                "usage": {"output_tokens": usage["output_tokens"]}})
+    yield sse("message_stop", {"type": "message_stop"})
+
+
+@app.post("/v1/messages")
+async def messages(request: Request):
+    body = await request.json()
+    calls["anthropic:messages"] += 1
+    error = injected_error("anthropic")
+    if error is not None:
+        return error
+
+    await asyncio.sleep(sample_latency(profile.claude_ttft))
+    text = completion_text(body)
+    if body.get("stream"):
+        return StreamingResponse(message_stream(body, text), media_type="text/event-stream")
+
+    # Non-streaming callers wait for the whole generation
+    await asyncio.sleep(len(text) / CHARS_PER_TOKEN / profile.claude_tokens_per_second)
+    return {
+        "id": "msg_standin",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model"),
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "usage": usage_for(body, text)
+    }
+
+
+async def process_message_batch(batch: Dict, requests: List[Dict]):
+    """End the batch after one sampled delay; each request succeeds or fails independently"""
+    await asyncio.sleep(sample_latency(profile.batch_latency))
+    counts = batch["request_counts"]
+    results = []
+    for request in requests:
+        params = request.get("params", {})
+        if random.random() < profile.error_rate:
+            result = {"type": "errored", "error": {"type": "error", "error": {"type": "api_error"}}}
+            counts["errored"] += 1
+        else:
+            text = completion_text(params)
+            result = {"type": "succeeded", "message": {
+                "id": f"msg_{uuid.uuid4().hex[:24]}",
+                "type": "message",
+                "role": "assistant",
+                "model": params.get("model"),
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "usage": usage_for(params, text)
+            }}
+            counts["succeeded"] += 1
+        counts["processing"] -= 1
+        results.append(json.dumps({"custom_id": request.get("custom_id"), "result": result}))
+    batch["results"] = results
+    batch["processing_status"] = "ended"
+    batch["ended_at"] = time.time()
+
+
+@app.post("/v1/messages/batches")
+async def create_message_batch(request: Request):
+    body = await request.json()
+    calls["anthropic:batches"] += 1
+    error = injected_error("anthropic")
+    if error is not None:
+        return error
+
+    batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+    requests = body.get("requests", [])
+    batch = message_batches[batch_id] = {
+        "id": batch_id,
+        "type": "message_batch",
+        "processing_status": "in_progress",
+        "request_counts": {"processing": len(requests), "succeeded": 0, "errored": 0, "canceled": 0, "expired": 0},
+        "created_at": time.time(),
+        "ended_at": None,
+        "results_url": None,
+    }
+    batch["task"] = asyncio.create_task(process_message_batch(batch, requests))
+    return batch_view(batch, request)
+
+
+def batch_view(batch: Dict, request: Request) -> Dict:
+    view = {key: value for key, value in batch.items() if key not in ("task", "results")}
+    if batch["processing_status"] == "ended":
+        view["results_url"] = str(request.url_for("message_batch_results", batch_id=batch["id"]))
+    return view
+
+
+@app.get("/v1/messages/batches/{batch_id}")
+async def retrieve_message_batch(batch_id: str, request: Request):
+    calls["anthropic:batch_retrieve"] += 1
+    batch = message_batches.get(batch_id)
+    if batch is None:
+        return JSONResponse({"type": "error", "error": {"type": "not_found_error"}}, status_code=404)
+    return batch_view(batch, request)
+
+
+@app.get("/v1/messages/batches/{batch_id}/results", name="message_batch_results")
+async def message_batch_results(batch_id: str):
+    calls["anthropic:batch_results"] += 1
+    batch = message_batches.get(batch_id)
+    if batch is None or batch["processing_status"] != "ended":
+        return JSONResponse({"type": "error", "error": {"type": "not_found_error"}}, status_code=404)
+
+    async def lines():
+        for line in batch["results"]:
+            yield line + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-jsonl")
+
+
+@app.post("/v1/scrape")
+async def scrape(request: Request):
+    body = await request.json()
+    calls["firecrawl:scrape"] += 1
+    error = injected_error("firecrawl")
+    if error is not None:
+        return error
+    await asyncio.sleep(sample_latency(profile.scrape_latency))
+    return {
+        "success": True,
+        "data": {
+            "markdown": f"# {body.get('url')}\n\n" + filler(profile.scrape_bytes),
+            "metadata": {"sourceURL": body.get("url"), "statusCode": 200}
+        }
+    }
+
+
+@app.post("/v1/search")
+async def search(request: Request):
+    body = await request.json()
+    calls["firecrawl:search"] += 1
+    error = injected_error("firecrawl")
+    if error is not None:
+        return error
+    await asyncio.sleep(sample_latency(profile.search_latency))
+    return {
+        "success": True,
+        "data": [
+            {
+                "url": f"https://example.com/{i}",
+                "title": f"{body.get('query')} result {i}",
+                "description": filler(300)
+            }
+            for i in range(body.get("limit", 5))
+        ]
+    }
+
+
+@app.post("/v1/agent")
+async def agent(request: Request):
+    body = await request.json()
+    calls["firecrawl:agent"] += 1
+    error = injected_error("firecrawl")
+    if error is not None:
+        return error
+    await asyncio.sleep(sample_latency(profile.agent_latency))
+    return {
+        "success": True,
+        "data": {
+            "prompt": body.get("prompt"),
+            "findings": [filler(400) for _ in range(5)]
+        }
+    }
+
+
+@app.get("/stats")
+async def stats():
+    """Calls served and errors injected, by upstream"""
+    return {"profile": profile.__dict__, "calls": dict(calls), "time": time.time()}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -11,24 +11,47 @@ load_dotenv()
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
 
-from api.diagnostic import router as diagnostic_router
-from api.chat import router as chat_router
+from api.diagnostic import router as diagnostic_router, diagnostic_scheduler
+from api.chat import router as chat_router, chat_streams
 from api.documents import router as documents_router
+from services import http_clients
+from services.research_cache import research_cache
+from services.render_pool import render_pool
+from services.database import init_db
+from services.job_events import job_events
+from services import metrics
+from services.upstream import breaker_states
+from services.admission import claude_budget
+from services.compression import CompressionMiddleware
+from services.responses import FastJSONResponse
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler"""
     print("MarketSauce Agent API starting...")
+    app.state.http_clients = await http_clients.startup()
+    init_db()
+    await job_events.start()
+    # Unfinished jobs from a stopped worker are claimed from the shared queue like any other
+    await diagnostic_scheduler.start()
     yield
     print("MarketSauce Agent API shutting down...")
+    await diagnostic_scheduler.stop()
+    await job_events.stop()
+    await chat_streams.stop()
+    await http_clients.shutdown()
+    research_cache.close()
+    render_pool.shutdown()
 
 app = FastAPI(
     title="MarketSauce Agent API",
     description="AI-powered market intelligence platform",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # CORS configuration
@@ -43,6 +66,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Large JSON bodies (full diagnostics, chat histories) go out as brotli or gzip
+app.add_middleware(CompressionMiddleware)
 
 # Include routers
 app.include_router(diagnostic_router, prefix="/api/diagnostic", tags=["Diagnostic"])
@@ -55,7 +80,15 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    # Stays 200 while a breaker is open: the API is up, only calls to that upstream fail fast
+    breakers = breaker_states()
+    degraded = any(breaker["state"] != "closed" for breaker in breakers.values())
+    return {"status": "degraded" if degraded else "healthy", "upstreams": breakers, "claude_budget": claude_budget.stats()}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 if __name__ == "__main__":
     import uvicorn
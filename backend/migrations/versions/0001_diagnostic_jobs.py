@@ -0,0 +1,35 @@
+"""diagnostic jobs
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "diagnostic_jobs",
+        sa.Column("job_id", sa.String(length=36), primary_key=True),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("current_phase", sa.Integer(), nullable=False),
+        sa.Column("last_completed_phase", sa.Integer(), nullable=False),
+        sa.Column("data", sa.JSON(), nullable=False),
+        sa.Column("checkpoint", sa.JSON(), nullable=False),
+        sa.Column("created_at", sa.String(length=32), nullable=False),
+        sa.Column("updated_at", sa.String(length=32), nullable=False),
+    )
+    op.create_index("ix_diagnostic_jobs_status", "diagnostic_jobs", ["status"])
+
+
+def downgrade():
+    op.drop_index("ix_diagnostic_jobs_status", table_name="diagnostic_jobs")
+    op.drop_table("diagnostic_jobs")
@@ -0,0 +1,49 @@
+"""job leases and events
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("diagnostic_jobs") as batch:
+        batch.add_column(sa.Column("priority", sa.Integer(), nullable=False, server_default="0"))
+        batch.add_column(sa.Column("queued_at", sa.Float(), nullable=True))
+        batch.add_column(sa.Column("lease_owner", sa.String(length=64), nullable=True))
+        batch.add_column(sa.Column("lease_expires_at", sa.Float(), nullable=True))
+    op.create_index("ix_diagnostic_jobs_queue", "diagnostic_jobs", ["status", "priority", "queued_at"])
+    op.create_index("ix_diagnostic_jobs_lease_owner", "diagnostic_jobs", ["lease_owner"])
+
+    op.create_table(
+        "job_events",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("job_id", sa.String(length=36), nullable=False),
+        sa.Column("seq", sa.Integer(), nullable=False),
+        sa.Column("event", sa.String(length=20), nullable=False),
+        sa.Column("data", sa.JSON(), nullable=True),
+        sa.Column("created_at", sa.Float(), nullable=False),
+    )
+    op.create_index("ix_job_events_job_id_seq", "job_events", ["job_id", "seq"])
+
+
+def downgrade():
+    op.drop_index("ix_job_events_job_id_seq", table_name="job_events")
+    op.drop_table("job_events")
+
+    op.drop_index("ix_diagnostic_jobs_lease_owner", table_name="diagnostic_jobs")
+    op.drop_index("ix_diagnostic_jobs_queue", table_name="diagnostic_jobs")
+    with op.batch_alter_table("diagnostic_jobs") as batch:
+        batch.drop_column("lease_expires_at")
+        batch.drop_column("lease_owner")
+        batch.drop_column("queued_at")
+        batch.drop_column("priority")
@@ -0,0 +1,26 @@
+"""job progress records
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled on each job's next write; rows without one are read from `data`
+    with op.batch_alter_table("diagnostic_jobs") as batch:
+        batch.add_column(sa.Column("progress", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("diagnostic_jobs") as batch:
+        batch.drop_column("progress")
@@ -0,0 +1,30 @@
+"""chat streams
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "chat_streams",
+        sa.Column("session_id", sa.String(length=64), primary_key=True),
+        sa.Column("stream_id", sa.String(length=32), nullable=False),
+        sa.Column("owner", sa.String(length=64), nullable=False),
+        sa.Column("touched_at", sa.Float(), nullable=False),
+        sa.Column("cancelled", sa.Boolean(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("chat_streams")
@@ -0,0 +1,26 @@
+"""job write versions
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows start at 0; the next write of each job stores version 1 or later
+    with op.batch_alter_table("diagnostic_jobs") as batch:
+        batch.add_column(sa.Column("version", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade():
+    with op.batch_alter_table("diagnostic_jobs") as batch:
+        batch.drop_column("version")
@@ -0,0 +1,309 @@
+"""
+Claude admission control
+Token buckets that pace Claude calls under the org's requests, input tokens and output tokens per minute limits
+"""
+
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple
+
+from fastapi import HTTPException
+
+from services.context_budget import estimate_tokens
+from services.metrics import registry
+
+# Configuration
+# The org's per-minute limits for the model; 0 leaves that limit unenforced
+ANTHROPIC_RPM = int(os.environ.get("ANTHROPIC_RPM", "0"))
+ANTHROPIC_ITPM = int(os.environ.get("ANTHROPIC_ITPM", "0"))
+ANTHROPIC_OTPM = int(os.environ.get("ANTHROPIC_OTPM", "0"))
+# Share of each budget that background calls leave free for chat
+ANTHROPIC_INTERACTIVE_RESERVE = float(os.environ.get("ANTHROPIC_INTERACTIVE_RESERVE", "0.2"))
+# How long a chat turn waits for budget before it is answered with a 429
+ANTHROPIC_ADMISSION_MAX_WAIT = float(os.environ.get("ANTHROPIC_ADMISSION_MAX_WAIT", "20"))
+# Worker processes splitting the limits (the variable uvicorn reads for its --workers default)
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+# Lower rank is admitted first; only chat turns are interactive
+PURPOSE_PRIORITY = {"chat": 0, "chat_summary": 1, "diagnostic": 2}
+INTERACTIVE_RANK = 0
+BACKGROUND_RANK = max(PURPOSE_PRIORITY.values())
+
+# Role and framing tokens around each message, on top of its text
+MESSAGE_OVERHEAD_TOKENS = 4
+# Weight of each response in the running correction of input estimates
+CALIBRATION_WEIGHT = 0.1
+
+# Rate-limit headers on Anthropic responses, by bucket
+REMAINING_HEADERS = {
+    "requests": "anthropic-ratelimit-requests-remaining",
+    "input_tokens": "anthropic-ratelimit-input-tokens-remaining",
+    "output_tokens": "anthropic-ratelimit-output-tokens-remaining",
+}
+
+admission_wait = registry.histogram(
+    "marketsauce_claude_admission_wait_seconds",
+    "Time Claude calls wait for request and token budget before being sent",
+    ("purpose",)
+)
+admission_timeouts = registry.counter(
+    "marketsauce_claude_admission_timeouts_total",
+    "Claude calls turned away after waiting too long for budget",
+    ("purpose",)
+)
+
+
+class AdmissionTimeout(HTTPException):
+    """Raised when an interactive call can't be admitted within its wait limit"""
+
+    def __init__(self, purpose: str, retry_after: float):
+        super().__init__(
+            status_code=429,
+            detail="Claude rate limit budget is exhausted, please retry shortly",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        self.purpose = purpose
+
+
+def content_text(content: Any) -> str:
+    """Text of a string or a list of content blocks"""
+    if isinstance(content, str):
+        return content
+    return "\n".join(block.get("text", "") for block in content or [] if isinstance(block, dict))
+
+
+def estimate_request_tokens(body: Dict) -> int:
+    """Approximate prompt tokens of a Messages API request body"""
+    total = estimate_tokens(content_text(body.get("system")))
+    for message in body.get("messages", []):
+        total += MESSAGE_OVERHEAD_TOKENS + estimate_tokens(content_text(message.get("content")))
+    return total
+
+
+class TokenBucket:
+    """Holds up to a minute's allowance and refills continuously, as the API's limits do"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost: float, floor: float = 0.0) -> float:
+        """Seconds until `cost` can be taken without dropping below `floor`"""
+        return max(0.0, (cost + floor - self.level) / self.rate)
+
+    def credit(self, amount: float):
+        """Return (or, if negative, charge) tokens after the fact"""
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    """Budget held by one admitted call until it is settled against the response"""
+
+    def __init__(self, budget: "ClaudeBudget", purpose: str, costs: Dict[str, float], estimate: int):
+        self.budget = budget
+        self.purpose = purpose
+        self.costs = costs
+        self.estimate = estimate
+        self.settled = False
+
+    def settle(self, usage: Optional[Dict] = None, headers: Optional[Mapping[str, str]] = None):
+        """Swap the reservation for what the call used; only the first call counts"""
+        if not self.settled:
+            self.settled = True
+            self.budget._settle(self, usage, headers)
+
+
+class ClaudeBudget:
+    """Paces Claude calls under per-minute request and token limits.
+
+    A call is admitted once every bucket holds its cost: one request, its
+    estimated input tokens and its whole max_tokens, which is what the API
+    counts against the output limit until the response is done. Waiting
+    calls are admitted strictly by priority then arrival, so a backlog of
+    diagnostics can't hold up a chat turn, and background calls leave a
+    share of each bucket for chat. Settling returns what a call didn't
+    use: unused output, cache reads (which don't count towards the input
+    limit) and any overestimate of its input, which also corrects later
+    estimates.
+    """
+
+    def __init__(
+        self,
+        rpm: int = ANTHROPIC_RPM,
+        itpm: int = ANTHROPIC_ITPM,
+        otpm: int = ANTHROPIC_OTPM,
+        reserve: float = ANTHROPIC_INTERACTIVE_RESERVE,
+        processes: int = WEB_CONCURRENCY
+    ):
+        limits = {"requests": rpm, "input_tokens": itpm, "output_tokens": otpm}
+        self.buckets: Dict[str, TokenBucket] = {
+            name: TokenBucket(limit / processes) for name, limit in limits.items() if limit > 0
+        }
+        self.reserve = reserve
+        # Actual prompt tokens per estimated token, learned from responses
+        self.calibration = 1.0
+        self._waiting: List[Tuple[int, int]] = []
+        self._order = itertools.count()
+        self._changed = asyncio.Event()
+        self._in_flight = 0
+        self._admitted: Dict[str, int] = defaultdict(int)
+        self._timeouts: Dict[str, int] = defaultdict(int)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.buckets)
+
+    def _costs(self, rank: int, body: Dict) -> Tuple[Dict[str, float], int]:
+        estimate = estimate_request_tokens(body)
+        costs = {
+            "requests": 1,
+            "input_tokens": math.ceil(estimate * self.calibration),
+            "output_tokens": body.get("max_tokens", 0),
+        }
+        # A call bigger than what its priority may use is admitted when the bucket is full, not never
+        share = 1.0 if rank == INTERACTIVE_RANK else 1.0 - self.reserve
+        return {name: min(costs[name], bucket.capacity * share) for name, bucket in self.buckets.items()}, estimate
+
+    def _delay(self, rank: int, costs: Dict[str, float]) -> float:
+        """Seconds until every bucket can cover costs"""
+        now = time.monotonic()
+        floor = 0.0 if rank == INTERACTIVE_RANK else self.reserve
+        delay = 0.0
+        for name, cost in costs.items():
+            bucket = self.buckets[name]
+            bucket.refill(now)
+            delay = max(delay, bucket.delay(cost, bucket.capacity * floor))
+        return delay
+
+    def _notify(self):
+        # Wake every waiter to re-check the queue head, then arm a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def acquire(self, purpose: str, body: Dict, max_wait: Optional[float] = None) -> Reservation:
+        """Wait until the call fits the budget and reserve its cost.
+
+        Chat turns give up after ANTHROPIC_ADMISSION_MAX_WAIT unless
+        max_wait says otherwise; background calls wait as long as it takes.
+        """
+        if not self.buckets:
+            return Reservation(self, purpose, {}, 0)
+        rank = PURPOSE_PRIORITY.get(purpose, BACKGROUND_RANK)
+        if max_wait is None and rank == INTERACTIVE_RANK:
+            max_wait = ANTHROPIC_ADMISSION_MAX_WAIT
+        costs, estimate = self._costs(rank, body)
+
+        entry = (rank, next(self._order))
+        heapq.heappush(self._waiting, entry)
+        started = time.monotonic()
+        try:
+            while True:
+                # Only the queue head may take budget, so smaller calls can't starve a bigger one
+                delay = self._delay(rank, costs) if self._waiting[0] == entry else None
+                if delay == 0:
+                    break
+                timeout = delay
+                if max_wait is not None:
+                    remaining = started + max_wait - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts[purpose] += 1
+                        admission_timeouts.inc(purpose=purpose)
+                        raise AdmissionTimeout(purpose, delay if delay is not None else max_wait)
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            self._notify()
+
+        for name, cost in costs.items():
+            self.buckets[name].level -= cost
+        self._in_flight += 1
+        self._admitted[purpose] += 1
+        admission_wait.observe(time.monotonic() - started, purpose=purpose)
+        return Reservation(self, purpose, costs, estimate)
+
+    @asynccontextmanager
+    async def admit(self, purpose: str, body: Dict, max_wait: Optional[float] = None) -> AsyncIterator[Reservation]:
+        """Hold budget for one call; settle the reservation with the response's usage inside the block"""
+        reservation = await self.acquire(purpose, body, max_wait)
+        try:
+            yield reservation
+        finally:
+            reservation.settle()
+
+    def _settle(self, reservation: Reservation, usage: Optional[Dict], headers: Optional[Mapping[str, str]]):
+        if not reservation.costs:
+            return
+        now = time.monotonic()
+        for bucket in self.buckets.values():
+            bucket.refill(now)
+
+        # A sent request stays counted; without usage (an error or a cut-off stream)
+        # the input is assumed spent and only the output reservation comes back
+        credits = {name: cost for name, cost in reservation.costs.items() if name == "output_tokens"}
+        if usage:
+            charged_input = (usage.get("input_tokens") or 0) + (usage.get("cache_creation_input_tokens") or 0)
+            if "input_tokens" in reservation.costs:
+                credits["input_tokens"] = reservation.costs["input_tokens"] - charged_input
+            if "output_tokens" in credits:
+                credits["output_tokens"] -= usage.get("output_tokens") or 0
+            prompt = charged_input + (usage.get("cache_read_input_tokens") or 0)
+            if prompt and reservation.estimate:
+                self.calibration += CALIBRATION_WEIGHT * (prompt / reservation.estimate - self.calibration)
+        for name, amount in credits.items():
+            self.buckets[name].credit(amount)
+
+        # Other clients of the same org spend from the same limits; never assume more than the API reports
+        for name, header in REMAINING_HEADERS.items():
+            remaining = (headers or {}).get(header)
+            if name in self.buckets and remaining is not None:
+                try:
+                    self.buckets[name].level = min(self.buckets[name].level, float(remaining))
+                except ValueError:
+                    pass
+
+        self._in_flight -= 1
+        self._notify()
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        for bucket in self.buckets.values():
+            bucket.refill(now)
+        return {
+            "enabled": self.enabled,
+            "limits_per_minute": {name: round(bucket.capacity) for name, bucket in self.buckets.items()},
+            "available": {name: round(bucket.level) for name, bucket in self.buckets.items()},
+            "interactive_reserve": self.reserve,
+            "waiting": len(self._waiting),
+            "in_flight": self._in_flight,
+            "admitted": dict(self._admitted),
+            "timeouts": dict(self._timeouts),
+            "input_estimate_calibration": round(self.calibration, 3),
+        }
+
+
+claude_budget = ClaudeBudget()
+
+registry.gauge(
+    "marketsauce_claude_budget_available",
+    "Requests and tokens this process may still send to Claude right now, by limit",
+    lambda: {(name,): value for name, value in claude_budget.stats()["available"].items()},
+    ("limit",)
+)
@@ -0,0 +1,156 @@
+"""
+Chat context window
+Recent turns verbatim, older turns folded into a rolling summary, under a per-request token ceiling
+"""
+
+import os
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from services.context_budget import estimate_tokens
+
+# Configuration
+CHAT_VERBATIM_TURNS = int(os.environ.get("CHAT_VERBATIM_TURNS", "6"))
+CHAT_CONTEXT_MAX_TOKENS = int(os.environ.get("CHAT_CONTEXT_MAX_TOKENS", "16000"))
+# Summaries are refreshed once this many turns have aged out of the verbatim window,
+# so the request prefix (and its prompt-cache entry) stays stable between refreshes
+CHAT_SUMMARY_BATCH_TURNS = int(os.environ.get("CHAT_SUMMARY_BATCH_TURNS", "4"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.environ.get("CHAT_SUMMARY_MAX_TOKENS", "800"))
+
+# Role and framing tokens the API adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_tokens(message: Dict) -> int:
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def summary_through(session: Dict) -> int:
+    """How many leading messages the session's summary covers"""
+    return (session.get("summary") or {}).get("through", 0)
+
+
+def user_boundary(messages: List[Dict], index: int) -> int:
+    """First index at or after `index` where a user message starts a turn"""
+    while index < len(messages) and messages[index]["role"] != "user":
+        index += 1
+    return index
+
+
+def verbatim_start(messages: List[Dict], turns: int = CHAT_VERBATIM_TURNS) -> int:
+    """Index of the oldest message kept verbatim: the last `turns` user/assistant exchanges"""
+    return user_boundary(messages, max(0, len(messages) - 2 * turns))
+
+
+@dataclass
+class ContextWindow:
+    """What one chat request sends in place of the whole history"""
+    messages: List[Dict]
+    summary: Optional[str]
+    omitted: int
+    tokens: int
+
+
+def build_window(
+    system_prompt: str,
+    session: Dict,
+    messages: List[Dict],
+    turns: int = CHAT_VERBATIM_TURNS,
+    max_tokens: int = CHAT_CONTEXT_MAX_TOKENS
+) -> ContextWindow:
+    """Summary plus the messages it doesn't cover, trimmed from the oldest end to the ceiling.
+
+    Messages that have aged out of the verbatim window but are not in the
+    summary yet stay in the request, so nothing is dropped while a refresh
+    is pending.
+    """
+    summary = session.get("summary") or {}
+    summary_text = summary.get("text") or None
+    start = min(summary_through(session), verbatim_start(messages, turns))
+
+    fixed = estimate_tokens(system_prompt) + (estimate_tokens(summary_text) if summary_text else 0)
+    sizes = [message_tokens(message) for message in messages[start:]]
+    total = fixed + sum(sizes)
+    # Over the ceiling: drop whole turns from the front, never the newest user message
+    while total > max_tokens and start < len(messages) - 1:
+        end = user_boundary(messages, start + 1)
+        if end >= len(messages):
+            break
+        total -= sum(sizes[:end - start])
+        sizes = sizes[end - start:]
+        start = end
+
+    return ContextWindow(
+        messages=messages[start:],
+        summary=summary_text,
+        omitted=start,
+        tokens=total
+    )
+
+
+def transcript(messages: List[Dict]) -> str:
+    """Plain-text rendering of turns for the summarizer"""
+    return "\n\n".join(f"{message['role'].upper()}: {message['content']}" for message in messages)
+
+
+class SummaryRefresher:
+    """Folds turns that left the verbatim window into the session summary, off the request path"""
+
+    def __init__(
+        self,
+        summarize: Callable[[Optional[str], List[Dict]], Awaitable[str]],
+        save: Callable[[str, Dict], Awaitable[None]],
+        turns: int = CHAT_VERBATIM_TURNS,
+        batch_turns: int = CHAT_SUMMARY_BATCH_TURNS
+    ):
+        self.summarize = summarize
+        self.save = save
+        self.turns = turns
+        self.batch_turns = batch_turns
+        self._running: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.refreshes = 0
+        self.failures = 0
+
+    def due(self, session: Dict) -> Optional[int]:
+        """New `through` if enough turns await summarizing, else None"""
+        messages = session.get("messages", [])
+        target = verbatim_start(messages, self.turns)
+        pending = messages[summary_through(session):target]
+        if sum(1 for message in pending if message["role"] == "user") < self.batch_turns:
+            return None
+        return target
+
+    def schedule(self, session_id: str, session: Dict):
+        """Start a background refresh if one is due and none is running for this session"""
+        if session_id in self._running:
+            return
+        through = self.due(session)
+        if through is None:
+            return
+        self._running.add(session_id)
+        task = asyncio.create_task(self._refresh(session_id, session, through))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, session_id: str, session: Dict, through: int):
+        try:
+            previous = (session.get("summary") or {}).get("text")
+            turns = session["messages"][summary_through(session):through]
+            text = await self.summarize(previous, turns)
+            await self.save(session_id, {"text": text, "through": through})
+            self.refreshes += 1
+        except Exception as e:
+            # The unsummarized turns stay in the window, so the next turn simply retries
+            self.failures += 1
+            print(f"Chat summary refresh for {session_id} failed: {e}")
+        finally:
+            self._running.discard(session_id)
+
+    def stats(self) -> Dict:
+        return {
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "in_progress": len(self._running),
+        }
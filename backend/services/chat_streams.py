@@ -0,0 +1,150 @@
+"""
+Chat stream registry
+Streamed chat replies in progress, shared by every worker process so any of them can stop one
+"""
+
+import os
+import time
+import uuid
+import asyncio
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import Boolean, Float, String, delete, select, update
+from sqlalchemy.orm import Mapped, mapped_column
+
+from services.database import Base, SessionLocal
+
+# Configuration
+# How often a worker checks whether its streams were stopped elsewhere, in seconds
+CHAT_STREAM_POLL_INTERVAL = float(os.environ.get("CHAT_STREAM_POLL_INTERVAL", "0.5"))
+
+# A stream whose worker hasn't touched it for this many polls is gone (the worker died)
+STALE_POLLS = 6
+
+
+class ChatStream(Base):
+    """The stream currently generating a reply in a session"""
+    __tablename__ = "chat_streams"
+
+    session_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    stream_id: Mapped[str] = mapped_column(String(32))
+    owner: Mapped[str] = mapped_column(String(64))
+    touched_at: Mapped[float] = mapped_column(Float)
+    cancelled: Mapped[bool] = mapped_column(Boolean, default=False)
+
+
+class ChatStreams:
+    """Registry of streamed replies, at most one per session.
+
+    Each stream has a local cancellation flag and a row in the shared
+    table. Stopping a stream in the process running it sets the flag at
+    once. Any other process marks the row, and the owner notices on its
+    next poll. Starting a new stream for a session replaces the row,
+    which stops the previous stream wherever it runs. Owners touch their
+    rows on every poll, so rows left by a dead worker are ignored.
+    """
+
+    def __init__(self, session_factory=SessionLocal, poll_interval: float = CHAT_STREAM_POLL_INTERVAL):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local: Dict[str, Tuple[str, asyncio.Event]] = {}
+        self._watcher: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._local)
+
+    async def open(self, session_id: str) -> Tuple[str, asyncio.Event]:
+        """Register a new stream for a session, stopping any earlier one; returns its id and cancellation flag"""
+        previous = self._local.get(session_id)
+        if previous is not None:
+            previous[1].set()
+        stream_id = uuid.uuid4().hex
+        cancelled = asyncio.Event()
+        self._local[session_id] = (stream_id, cancelled)
+        await asyncio.to_thread(self._replace, session_id, stream_id)
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch())
+        return stream_id, cancelled
+
+    async def close(self, session_id: str, stream_id: str):
+        """Unregister a finished stream, unless a newer one has replaced it"""
+        if self._local.get(session_id, (None,))[0] == stream_id:
+            del self._local[session_id]
+        await asyncio.to_thread(self._delete, session_id, stream_id)
+
+    async def cancel(self, session_id: str) -> bool:
+        """Stop the session's stream on whichever worker runs it; False if none is running"""
+        local = self._local.get(session_id)
+        if local is not None:
+            local[1].set()
+            return True
+        return await asyncio.to_thread(self._mark_cancelled, session_id)
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+    def _replace(self, session_id: str, stream_id: str):
+        now = time.time()
+        with self.session_factory() as session:
+            session.execute(delete(ChatStream).where(
+                (ChatStream.session_id == session_id) | (ChatStream.touched_at < now - STALE_POLLS * self.poll_interval)
+            ))
+            session.add(ChatStream(
+                session_id=session_id, stream_id=stream_id, owner=self.owner, touched_at=now, cancelled=False
+            ))
+            session.commit()
+
+    def _delete(self, session_id: str, stream_id: str):
+        with self.session_factory() as session:
+            session.execute(delete(ChatStream).where(
+                ChatStream.session_id == session_id, ChatStream.stream_id == stream_id
+            ))
+            session.commit()
+
+    def _mark_cancelled(self, session_id: str) -> bool:
+        with self.session_factory() as session:
+            result = session.execute(
+                update(ChatStream)
+                .where(
+                    ChatStream.session_id == session_id,
+                    ChatStream.touched_at >= time.time() - STALE_POLLS * self.poll_interval
+                )
+                .values(cancelled=True)
+            )
+            session.commit()
+            return result.rowcount == 1
+
+    def _poll(self, session_ids) -> Dict[str, Tuple[str, bool]]:
+        with self.session_factory() as session:
+            session.execute(
+                update(ChatStream)
+                .where(ChatStream.owner == self.owner, ChatStream.session_id.in_(session_ids))
+                .values(touched_at=time.time())
+            )
+            rows = session.execute(
+                select(ChatStream.session_id, ChatStream.stream_id, ChatStream.cancelled)
+                .where(ChatStream.session_id.in_(session_ids))
+            ).all()
+            session.commit()
+            return {row.session_id: (row.stream_id, row.cancelled) for row in rows}
+
+    async def _watch(self):
+        while self._local:
+            await asyncio.sleep(self.poll_interval)
+            streams = dict(self._local)
+            if not streams:
+                break
+            try:
+                stored = await asyncio.to_thread(self._poll, list(streams))
+            except Exception as e:
+                print(f"Checking chat streams failed: {e}")
+                continue
+            for session_id, (stream_id, cancelled) in streams.items():
+                row = stored.get(session_id)
+                # Stopped by another worker, or replaced by a newer stream started elsewhere
+                if row is not None and (row[1] or row[0] != stream_id):
+                    cancelled.set()
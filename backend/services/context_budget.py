@@ -0,0 +1,277 @@
+"""
+Research context budgeter
+Fits research into a per-mode token budget: compact JSON, relevance-ranked items, no mid-object cuts
+"""
+
+import os
+import re
+import json
+import math
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Configuration
+# Tokens of research per diagnostic prompt, by mode
+RESEARCH_TOKEN_BUDGETS = {
+    "express": int(os.environ.get("RESEARCH_TOKEN_BUDGET_EXPRESS", "1100")),
+    "strategic": int(os.environ.get("RESEARCH_TOKEN_BUDGET_STRATEGIC", "2000")),
+    "full": int(os.environ.get("RESEARCH_TOKEN_BUDGET_FULL", "2800")),
+}
+DEFAULT_MODE = "strategic"
+
+# Starting share of the budget per section; whatever a section doesn't need flows to the rest
+SECTION_SHARES = {
+    "website_content": 0.4,
+    "competitor_data": 0.3,
+    "market_trends": 0.2,
+    "industry_insights": 0.1,
+}
+
+# Roughly how a BPE tokenizer splits text: short letter runs, digit groups,
+# single punctuation marks and runs of whitespace (JSON indentation) each cost a token
+TOKEN_PATTERN = re.compile(r"[^\W\d_]{1,6}|\d{1,3}|[^\w\s]|_|\s{2,}")
+WORD_PATTERN = re.compile(r"[^\W_]{3,}")
+MARKDOWN_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+MARKDOWN_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+BLANK_LINES = re.compile(r"\n\s*\n")
+
+STOPWORDS = frozenset(
+    "and the for with that this from your our are was were has have not but you they their them its "
+    "into about than then who what when where which how all any can will just more most other some "
+    "such only own same very also company companies provided".split()
+)
+OMITTED = "[...]"
+# Page-level fields Firecrawl attaches to results that say nothing about the market
+DROPPED_FIELDS = frozenset(("metadata", "links", "html", "rawHtml", "screenshot"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of text (no tokenizer round trip)"""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def compact_json(value: Any) -> str:
+    """JSON without indentation or spaces after separators"""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def query_terms(*texts: Optional[str]) -> Set[str]:
+    """Lowercase content words of the inputs that research is ranked against"""
+    terms = set()
+    for text in texts:
+        if text:
+            terms.update(word for word in WORD_PATTERN.findall(text.lower()) if word not in STOPWORDS)
+    return terms
+
+
+def relevance(text: str, terms: Set[str]) -> int:
+    """Number of distinct query terms the text mentions"""
+    if not terms:
+        return 0
+    return len(terms.intersection(WORD_PATTERN.findall(text.lower())))
+
+
+def truncate_tokens(text: str, tokens: int) -> str:
+    """Longest prefix of text within `tokens`, cut at a word boundary"""
+    if tokens <= 0:
+        return ""
+    matches = list(TOKEN_PATTERN.finditer(text))
+    if len(matches) <= tokens:
+        return text
+    cut = matches[tokens - 1].end()
+    space = text.rfind(" ", 0, cut)
+    if space > cut // 2:
+        cut = space
+    return text[:cut].rstrip() + "..."
+
+
+def allocate(needs: Dict[str, int], shares: Dict[str, float], budget: int) -> Dict[str, int]:
+    """Split a budget by share; a part that needs less than its share gives the surplus to the rest"""
+    allocation = {}
+    pending = {name: need for name, need in needs.items() if need > 0}
+    remaining = budget
+    while pending:
+        total_share = sum(shares.get(name, 1.0) for name in pending)
+        satisfied = {
+            name: need for name, need in pending.items()
+            if need <= remaining * shares.get(name, 1.0) / total_share
+        }
+        if not satisfied:
+            for name in pending:
+                allocation[name] = int(remaining * shares.get(name, 1.0) / total_share)
+            break
+        for name, need in satisfied.items():
+            allocation[name] = need
+            remaining -= need
+            del pending[name]
+    return {name: allocation.get(name, 0) for name in needs}
+
+
+def text_blocks(text: str) -> List[str]:
+    """Paragraph blocks of scraped markdown, with link targets and images dropped and repeats removed"""
+    text = MARKDOWN_LINK.sub(r"\1", MARKDOWN_IMAGE.sub("", text))
+    seen = set()
+    blocks = []
+    for block in BLANK_LINES.split(text):
+        block = block.strip()
+        if block and block not in seen:
+            seen.add(block)
+            blocks.append(block)
+    return blocks
+
+
+def fit_text(text: str, terms: Set[str], budget: int) -> str:
+    """The most relevant blocks of a page within budget, in page order, gaps marked"""
+    blocks = text_blocks(text)
+    sizes = [estimate_tokens(block) for block in blocks]
+    # Relevance first; earlier blocks (what the page leads with) break ties
+    ranked = sorted(
+        range(len(blocks)),
+        key=lambda i: (relevance(blocks[i], terms) / math.log2(sizes[i] + 2), -i),
+        reverse=True
+    )
+    chosen: Dict[int, str] = {}
+    used = 0
+    for i in ranked:
+        room = budget - used
+        if sizes[i] <= room:
+            chosen[i] = blocks[i]
+            used += sizes[i] + 1
+        elif room >= 32 and not chosen:
+            # Nothing fits whole yet, so keep the head of the best block
+            chosen[i] = truncate_tokens(blocks[i], room)
+            used = budget
+    parts = []
+    previous = -1
+    for i in sorted(chosen):
+        if i != previous + 1:
+            parts.append(OMITTED)
+        parts.append(chosen[i])
+        previous = i
+    if previous != len(blocks) - 1 and parts:
+        parts.append(OMITTED)
+    return "\n\n".join(parts)
+
+
+def result_items(value: Any) -> List[Any]:
+    """The list of results inside a search or agent response"""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        for key in ("data", "results", "findings"):
+            if isinstance(value.get(key), list):
+                return value[key]
+        return [value] if value else []
+    return [value] if value else []
+
+
+def prune(item: Any) -> Any:
+    """Drop empty and page-level fields, which cost tokens and carry nothing"""
+    if isinstance(item, dict):
+        return {
+            key: prune(value) for key, value in item.items()
+            if value not in (None, "", [], {}) and key not in DROPPED_FIELDS
+        }
+    return item
+
+
+def shrink(item: Any, tokens: int) -> Any:
+    """Truncate an item's longest string so its JSON fits in `tokens`"""
+    if isinstance(item, str):
+        return truncate_tokens(item, tokens - 2)
+    if not isinstance(item, dict):
+        return item
+    strings = [key for key, value in item.items() if isinstance(value, str)]
+    if not strings:
+        return item
+    longest = max(strings, key=lambda key: len(item[key]))
+    overhead = estimate_tokens(compact_json({**item, longest: ""}))
+    return {**item, longest: truncate_tokens(item[longest], tokens - overhead)}
+
+
+def rank_items(items: List[Any], terms: Set[str]) -> List[Tuple[Any, int]]:
+    """(item, tokens) ordered by relevance, keeping the upstream rank on ties"""
+    encoded = [(prune(item), compact_json(prune(item))) for item in items]
+    order = sorted(
+        range(len(encoded)),
+        key=lambda i: (relevance(encoded[i][1], terms), -i),
+        reverse=True
+    )
+    return [(encoded[i][0], estimate_tokens(encoded[i][1])) for i in order]
+
+
+def fill_items(ranked: List[Tuple[Any, int]], budget: int) -> List[Any]:
+    """Whole items in rank order while they fit; the first one is shrunk rather than dropped"""
+    kept = []
+    used = 1
+    for item, tokens in ranked:
+        room = budget - used
+        if tokens + 1 <= room:
+            kept.append(item)
+            used += tokens + 1
+        elif not kept and room >= 24:
+            kept.append(shrink(item, room))
+            used = budget
+    return kept
+
+
+def fit_items(value: Any, terms: Set[str], budget: int) -> str:
+    """Compact JSON array of the most relevant results within budget"""
+    return compact_json(fill_items(rank_items(result_items(value), terms), budget))
+
+
+def fit_competitors(competitors: List[Dict], terms: Set[str], budget: int) -> str:
+    """Compact JSON of every competitor's best results, sharing the budget between competitors"""
+    ranked = {}
+    headers = {}
+    needs = {}
+    for index, competitor in enumerate(competitors):
+        name = competitor.get("name", "")
+        # A competitor's results are ranked against its own name as well as the inputs
+        ranked[index] = rank_items(result_items(competitor.get("data")), terms | query_terms(name))
+        headers[index] = estimate_tokens(compact_json({"name": name, "results": []}))
+        needs[index] = headers[index] + 1 + sum(tokens + 1 for _, tokens in ranked[index])
+    allocation = allocate(needs, {}, budget)
+    return compact_json([
+        {"name": competitor.get("name", ""), "results": fill_items(ranked[index], allocation[index] - headers[index])}
+        for index, competitor in enumerate(competitors)
+    ])
+
+
+def section_need(name: str, value: Any) -> int:
+    """Tokens a section would take with nothing trimmed"""
+    if isinstance(value, str):
+        return sum(estimate_tokens(block) + 1 for block in text_blocks(value))
+    if name == "competitor_data":
+        return estimate_tokens(compact_json([
+            {"name": competitor.get("name", ""), "results": [prune(item) for item in result_items(competitor.get("data"))]}
+            for competitor in value
+        ]))
+    return estimate_tokens(compact_json([prune(item) for item in result_items(value)]))
+
+
+def budget_research(
+    research: Dict[str, Any],
+    terms: Iterable[str],
+    mode: Optional[str] = None,
+    budget: Optional[int] = None
+) -> Dict[str, str]:
+    """Render each research section for the prompt, together within the mode's token budget"""
+    terms = set(terms)
+    if budget is None:
+        budget = RESEARCH_TOKEN_BUDGETS.get(mode, RESEARCH_TOKEN_BUDGETS[DEFAULT_MODE])
+    sections = {name: value for name, value in research.items() if value}
+    allocation = allocate(
+        {name: section_need(name, value) for name, value in sections.items()}, SECTION_SHARES, budget
+    )
+
+    rendered = {}
+    for name, value in research.items():
+        if not value:
+            rendered[name] = "" if isinstance(value, str) else "[]"
+        elif isinstance(value, str):
+            rendered[name] = fit_text(value, terms, allocation[name])
+        elif name == "competitor_data":
+            rendered[name] = fit_competitors(value, terms, allocation[name])
+        else:
+            rendered[name] = fit_items(value, terms, allocation[name])
+    return rendered
@@ -0,0 +1,45 @@
+"""
+Database setup
+SQLAlchemy engine, session factory and declarative base
+"""
+
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import DeclarativeBase, sessionmaker
+
+# Configuration
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./marketsauce.db")
+
+connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+engine = create_engine(DATABASE_URL, connect_args=connect_args, pool_pre_ping=True)
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+
+if DATABASE_URL.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL lets status reads proceed while a checkpoint is being written"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        # Worker processes share the file; wait for another's write instead of failing
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+
+class Base(DeclarativeBase):
+    """Declarative base for all models"""
+
+
+def init_db():
+    """Create any missing tables (development convenience; production runs Alembic)"""
+    import services.job_store  # noqa: F401  registers models on Base.metadata
+    import services.job_events  # noqa: F401
+    import services.chat_streams  # noqa: F401
+    try:
+        Base.metadata.create_all(engine)
+    except OperationalError:
+        # Another worker process created a table between the check and the CREATE
+        Base.metadata.create_all(engine)
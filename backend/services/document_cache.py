@@ -0,0 +1,205 @@
+"""
+Rendered document cache
+Size-bounded LRU memory tier over an optional on-disk tier of rendered exports
+"""
+
+import os
+import asyncio
+import uuid
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from services.etags import file_etag, make_etag
+
+# Configuration
+DOCUMENT_CACHE_MAX_BYTES = int(os.environ.get("DOCUMENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+DOCUMENT_CACHE_DIR = os.environ.get("DOCUMENT_CACHE_DIR", "./document_cache")
+DOCUMENT_CACHE_DISK_MAX_BYTES = int(os.environ.get("DOCUMENT_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# (etag, document bytes)
+Entry = Tuple[str, bytes]
+
+
+def document_key(*parts: str) -> str:
+    """Content hash of the inputs that determine a rendered document"""
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = part.encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") differ
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class DocumentCache:
+    """Rendered documents by content key, evicted least recently used by total bytes"""
+
+    def __init__(
+        self,
+        max_bytes: int = DOCUMENT_CACHE_MAX_BYTES,
+        directory: Optional[str] = DOCUMENT_CACHE_DIR,
+        disk_max_bytes: int = DOCUMENT_CACHE_DISK_MAX_BYTES
+    ):
+        self.max_bytes = max_bytes
+        self.directory = Path(directory) if directory else None
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: "OrderedDict[str, Entry]" = OrderedDict()
+        self._bytes = 0
+        # ETags of documents kept only as files, so a hit doesn't rehash them
+        self._file_etags: Dict[str, str] = {}
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+            "disk_evictions": 0,
+        }
+
+    def _path(self, key: str) -> Optional[Path]:
+        return self.directory / f"{key}.bin" if self.directory else None
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        if path is None:
+            return None
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        # Touch so disk pruning is least-recently-used too
+        os.utime(path)
+        return data
+
+    def _disk_set(self, key: str, data: bytes):
+        path = self._path(key)
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.parent / f"{key}.{uuid.uuid4().hex}.tmp"
+        partial.write_bytes(data)
+        os.replace(partial, path)
+        self._disk_prune()
+
+    def _disk_prune(self):
+        files = []
+        for path in self.directory.glob("*.bin"):
+            try:
+                files.append((path.stat(), path))
+            except FileNotFoundError:
+                # Pruned by a concurrent write
+                continue
+        total = sum(stat.st_size for stat, _ in files)
+        for stat, path in sorted(files, key=lambda f: f[0].st_mtime):
+            if total <= self.disk_max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= stat.st_size
+            self._stats["disk_evictions"] += 1
+
+    def _remember(self, key: str, entry: Entry):
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous[1])
+        # A single document larger than the whole budget stays on disk only
+        if len(entry[1]) > self.max_bytes:
+            return
+        self._memory[key] = entry
+        self._bytes += len(entry[1])
+        while self._bytes > self.max_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._bytes -= len(evicted)
+            self._stats["evictions"] += 1
+
+    async def get(self, key: str) -> Optional[Entry]:
+        """Return (etag, bytes) for a cached document, checking memory before disk"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return entry
+
+        data = await asyncio.to_thread(self._disk_get, key)
+        if data is not None:
+            entry = (make_etag(data), data)
+            self._remember(key, entry)
+            self._stats["disk_hits"] += 1
+            return entry
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, data: bytes) -> Entry:
+        """Store a rendered document in both tiers and return its (etag, bytes)"""
+        entry = (make_etag(data), data)
+        self._remember(key, entry)
+        self._stats["writes"] += 1
+        await asyncio.to_thread(self._disk_set, key, data)
+        return entry
+
+    def scratch_dir(self) -> Optional[str]:
+        """Where to render files destined for put_file (same filesystem, so adoption is a rename)"""
+        if self.directory is None:
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return str(self.directory)
+
+    def _file_get(self, key: str) -> Optional[Tuple[str, Path]]:
+        path = self._path(key)
+        if path is None or not path.exists():
+            return None
+        os.utime(path)
+        etag = self._file_etags.get(key) or file_etag(path)
+        self._file_etags[key] = etag
+        return etag, path
+
+    async def get_file(self, key: str) -> Optional[Tuple[str, Path]]:
+        """Return (etag, path) for a document cached as a file on disk"""
+        try:
+            entry = await asyncio.to_thread(self._file_get, key)
+        except FileNotFoundError:
+            # Pruned between the existence check and the hash
+            entry = None
+        if entry is None:
+            self._file_etags.pop(key, None)
+            self._stats["misses"] += 1
+            return None
+        self._stats["disk_hits"] += 1
+        return entry
+
+    def _file_put(self, key: str, source: Path) -> Tuple[str, Path]:
+        etag = file_etag(source)
+        path = self._path(key)
+        if path is None:
+            return etag, source
+        os.replace(source, path)
+        self._file_etags[key] = etag
+        self._disk_prune()
+        return etag, path
+
+    async def put_file(self, key: str, source: Path) -> Tuple[str, Path]:
+        """Adopt a rendered file into the disk tier and return its (etag, path).
+
+        With the disk tier disabled the source path is returned as-is and
+        stays the caller's to delete.
+        """
+        self._stats["writes"] += 1
+        return await asyncio.to_thread(self._file_put, key, source)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and tier sizes"""
+        lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+        hits = lookups - self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "disk_enabled": self.directory is not None,
+        }
+
+
+document_cache = DocumentCache()
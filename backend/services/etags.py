@@ -0,0 +1,37 @@
+"""
+Entity tags
+Strong ETag generation and If-None-Match evaluation for conditional GETs
+"""
+
+import hashlib
+from typing import Optional
+
+
+def make_etag(data: bytes) -> str:
+    """Strong validator derived from the exact response bytes"""
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def file_etag(path, chunk_size: int = 1024 * 1024) -> str:
+    """make_etag for a file, hashed in chunks rather than read whole"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            digest.update(chunk)
+    return '"' + digest.hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header lists this ETag (weak comparison, per RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
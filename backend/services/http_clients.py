@@ -0,0 +1,86 @@
+"""
+Shared HTTP clients
+One pooled, keep-alive httpx client per upstream, owned by the app lifespan
+"""
+
+import os
+import asyncio
+from typing import Dict
+
+import httpx
+
+# Configuration
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "true").lower() == "true"
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+
+UPSTREAMS = ("anthropic", "firecrawl")
+
+# Maximum concurrent in-flight calls per upstream
+UPSTREAM_CONCURRENCY = {
+    "anthropic": int(os.environ.get("ANTHROPIC_CONCURRENCY", "4")),
+    "firecrawl": int(os.environ.get("FIRECRAWL_CONCURRENCY", "8")),
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_slots: Dict[str, asyncio.Semaphore] = {}
+
+
+def create_client() -> httpx.AsyncClient:
+    """Build a pooled client with the configured limits"""
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(60.0, connect=HTTP_CONNECT_TIMEOUT)
+    )
+
+
+async def startup() -> Dict[str, httpx.AsyncClient]:
+    """Open one client per upstream"""
+    for upstream in UPSTREAMS:
+        if upstream not in _clients or _clients[upstream].is_closed:
+            _clients[upstream] = create_client()
+    return _clients
+
+
+async def shutdown():
+    """Close every client and drain its connection pool"""
+    while _clients:
+        _, client = _clients.popitem()
+        await client.aclose()
+
+
+def get_client(upstream: str) -> httpx.AsyncClient:
+    """Return the shared client for an upstream.
+
+    Falls back to opening one lazily so helpers still work outside the
+    app lifespan (scripts, the REPL).
+    """
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        client = _clients[upstream] = create_client()
+    return client
+
+
+def anthropic_client() -> httpx.AsyncClient:
+    """FastAPI dependency for the Anthropic client"""
+    return get_client("anthropic")
+
+
+def firecrawl_client() -> httpx.AsyncClient:
+    """FastAPI dependency for the Firecrawl client"""
+    return get_client("firecrawl")
+
+
+def upstream_slot(upstream: str) -> asyncio.Semaphore:
+    """Semaphore bounding concurrent calls to an upstream"""
+    slot = _slots.get(upstream)
+    if slot is None:
+        slot = _slots[upstream] = asyncio.Semaphore(UPSTREAM_CONCURRENCY.get(upstream, 4))
+    return slot
@@ -0,0 +1,321 @@
+"""
+Job event log
+Append-only, replayable per-job event streams for SSE, WebSocket and long-poll subscribers,
+shared between worker processes through the database
+"""
+
+import os
+import time
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import JSON, Float, Index, Integer, String, delete, or_, select
+from sqlalchemy.orm import Mapped, mapped_column
+
+from services.database import Base, SessionLocal
+
+# Configuration
+JOB_EVENTS_RETENTION = float(os.environ.get("JOB_EVENTS_RETENTION", "900"))
+JOB_EVENTS_HEARTBEAT = float(os.environ.get("JOB_EVENTS_HEARTBEAT", "15"))
+JOB_EVENTS_FLUSH_INTERVAL = float(os.environ.get("JOB_EVENTS_FLUSH_INTERVAL", "0.2"))
+JOB_EVENTS_POLL_INTERVAL = float(os.environ.get("JOB_EVENTS_POLL_INTERVAL", "0.5"))
+# A mirrored log nobody has read for this long stops polling and is dropped, in seconds
+JOB_EVENTS_MIRROR_IDLE = float(os.environ.get("JOB_EVENTS_MIRROR_IDLE", "60"))
+
+# Stored after a job's last event, so other workers know its log is closed
+CLOSED_EVENT = "closed"
+# How often stored logs past retention are deleted, in seconds
+PRUNE_INTERVAL = 60.0
+# Each flush stores a job's consecutive text deltas as one row of this event, keyed by the last seq
+DELTA_EVENT = "delta"
+DELTA_RUN_EVENT = "deltas"
+
+Event = Tuple[int, str, Any]
+
+
+def coalesce_deltas(rows: List[Dict]) -> List[Dict]:
+    """Merge each job's consecutive delta rows into one DELTA_RUN_EVENT row whose seq is the run's last"""
+    merged: List[Dict] = []
+    runs: Dict[str, Dict] = {}
+    for row in rows:
+        run = runs.get(row["job_id"])
+        if row["event"] != DELTA_EVENT:
+            runs.pop(row["job_id"], None)
+            merged.append(row)
+        elif run is not None and run["seq"] + 1 == row["seq"]:
+            run["data"].append(row["data"])
+            run["seq"] = row["seq"]
+        else:
+            run = runs[row["job_id"]] = {**row, "event": DELTA_RUN_EVENT, "data": [row["data"]]}
+            merged.append(run)
+    return merged
+
+
+class JobEvent(Base):
+    """One stored event; `seq` is its id within the job's log"""
+    __tablename__ = "job_events"
+    __table_args__ = (Index("ix_job_events_job_id_seq", "job_id", "seq"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    job_id: Mapped[str] = mapped_column(String(36))
+    seq: Mapped[int] = mapped_column(Integer)
+    event: Mapped[str] = mapped_column(String(20))
+    data: Mapped[Any] = mapped_column(JSON, nullable=True)
+    created_at: Mapped[float] = mapped_column(Float)
+
+
+class EventLog:
+    """Events for one job; subscribers replay from any offset then follow live"""
+
+    def __init__(self):
+        self.events: List[Event] = []
+        self.closed = False
+        self.closed_at: Optional[float] = None
+        # Subscribers following the log now, and when anyone last read it
+        self.followers = 0
+        self.read_at = time.monotonic()
+        self._changed = asyncio.Event()
+
+    def append(self, event: str, data: Any):
+        self.events.append((len(self.events), event, data))
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self.closed_at = time.time()
+        self._notify()
+
+    async def wait(self, position: int, timeout: float) -> bool:
+        """Wait until an event exists at `position` or the log closes; False on timeout"""
+        self.touch()
+        deadline = time.monotonic() + timeout
+        while len(self.events) <= position and not self.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def touch(self):
+        self.read_at = time.monotonic()
+
+    def _notify(self):
+        # Wake every waiter, then arm a fresh event for the next change
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, start: int = 0, heartbeat: float = JOB_EVENTS_HEARTBEAT) -> AsyncIterator[Optional[Event]]:
+        """Yield events from start onwards; yields None as a heartbeat while idle"""
+        position = start
+        self.followers += 1
+        try:
+            while True:
+                while position < len(self.events):
+                    yield self.events[position]
+                    position += 1
+                if self.closed:
+                    return
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self.followers -= 1
+            self.touch()
+
+
+class JobEvents:
+    """Registry of event logs keyed by job id.
+
+    The worker running a job publishes its events into a local log and
+    writes them to the database in small batches. Other workers serve
+    subscribers from a mirror: a local log that polls the stored events
+    until the job's log closes. When a job moves between workers, the
+    new owner adopts its log and carries on from the stored events, so
+    event ids stay the same on every worker.
+    """
+
+    def __init__(self, retention: float = JOB_EVENTS_RETENTION, session_factory=SessionLocal):
+        self.retention = retention
+        self.session_factory = session_factory
+        self._logs: Dict[str, EventLog] = {}
+        self._mirrors: Dict[str, asyncio.Task] = {}
+        self._pending: List[Dict] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start writing published events to the database"""
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop mirrors and the writer, storing whatever is still pending"""
+        tasks = list(self._mirrors.values()) + ([self._flusher] if self._flusher else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._mirrors.clear()
+        self._flusher = None
+        await self.flush()
+
+    def open(self, job_id: str) -> EventLog:
+        self._prune()
+        log = self._logs[job_id] = EventLog()
+        return log
+
+    def get(self, job_id: str) -> Optional[EventLog]:
+        return self._logs.get(job_id)
+
+    def publish(self, job_id: str, event: str, data: Any):
+        log = self._logs.get(job_id)
+        if log is None:
+            log = self.open(job_id)
+        log.append(event, data)
+        self._store(job_id, len(log.events) - 1, event, data)
+
+    def close(self, job_id: str):
+        log = self._logs.get(job_id)
+        if log is not None:
+            log.close()
+        self._store(job_id, len(log.events) if log is not None else 0, CLOSED_EVENT, None)
+
+    async def adopt(self, job_id: str) -> EventLog:
+        """Publish a job's events from this worker, continuing the log earlier owners stored"""
+        mirror = self._mirrors.pop(job_id, None)
+        if mirror is not None:
+            mirror.cancel()
+        await self.flush()
+        log = self._logs.get(job_id) or EventLog()
+        for seq, event, data in await asyncio.to_thread(self._read, job_id, len(log.events)):
+            # A closed marker here is from an owner that stopped mid-job; the job is still running
+            if event != CLOSED_EVENT and seq == len(log.events):
+                log.append(event, data)
+        log.closed, log.closed_at = False, None
+        self._logs[job_id] = log
+        return log
+
+    async def handoff(self, job_id: str):
+        """Stop publishing a job's events here; local subscribers follow whichever worker claims it"""
+        await self.flush()
+        log = self._logs.get(job_id)
+        if log is not None and not log.closed and job_id not in self._mirrors:
+            self._mirrors[job_id] = asyncio.create_task(self._mirror(job_id, log))
+
+    async def follow_remote(self, job_id: str, finished: bool) -> Optional[EventLog]:
+        """The job's log, mirrored from the database if another worker publishes it.
+
+        None if a finished job has no stored events (they have expired).
+        """
+        log = self._logs.get(job_id)
+        if log is not None:
+            log.touch()
+            return log
+        self._prune()
+        stored = await asyncio.to_thread(self._read, job_id, 0)
+        if not stored and finished:
+            return None
+        # Another subscriber may have started a mirror while we were reading
+        if job_id in self._logs:
+            return self._logs[job_id]
+        log = self._logs[job_id] = EventLog()
+        self._apply(log, stored)
+        if not log.closed:
+            self._mirrors[job_id] = asyncio.create_task(self._mirror(job_id, log))
+        return log
+
+    def _apply(self, log: EventLog, stored: List[Event]):
+        for seq, event, data in stored:
+            if event == CLOSED_EVENT:
+                log.close()
+                return
+            # Skips duplicates, e.g. from an owner writing after losing its lease
+            if seq == len(log.events):
+                log.append(event, data)
+
+    async def _mirror(self, job_id: str, log: EventLog):
+        try:
+            while not log.closed:
+                await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+                if not log.followers and time.monotonic() - log.read_at > JOB_EVENTS_MIRROR_IDLE:
+                    # Nobody reads it; a later subscriber mirrors it afresh from the stored events
+                    if self._logs.get(job_id) is log:
+                        del self._logs[job_id]
+                    return
+                try:
+                    self._apply(log, await asyncio.to_thread(self._read, job_id, len(log.events)))
+                except Exception as e:
+                    print(f"Mirroring events of {job_id} failed: {e}")
+        finally:
+            if self._mirrors.get(job_id) is asyncio.current_task():
+                del self._mirrors[job_id]
+
+    def _store(self, job_id: str, seq: int, event: str, data: Any):
+        self._pending.append({"job_id": job_id, "seq": seq, "event": event, "data": data, "created_at": time.time()})
+
+    def _read(self, job_id: str, position: int) -> List[Event]:
+        with self.session_factory() as session:
+            rows = session.execute(
+                select(JobEvent.seq, JobEvent.event, JobEvent.data)
+                .where(JobEvent.job_id == job_id, or_(JobEvent.seq >= position, JobEvent.event == CLOSED_EVENT))
+                .order_by(JobEvent.seq, JobEvent.id)
+            ).all()
+        events: List[Event] = []
+        for seq, event, data in rows:
+            if event == DELTA_RUN_EVENT:
+                first = seq - len(data) + 1
+                events.extend(
+                    (first + offset, DELTA_EVENT, item) for offset, item in enumerate(data) if first + offset >= position
+                )
+            else:
+                events.append((seq, event, data))
+        return events
+
+    def _insert(self, rows: List[Dict]):
+        with self.session_factory() as session:
+            session.add_all([JobEvent(**row) for row in coalesce_deltas(rows)])
+            session.commit()
+
+    def _delete_expired(self):
+        cutoff = time.time() - self.retention
+        with self.session_factory() as session:
+            expired = select(JobEvent.job_id).where(JobEvent.event == CLOSED_EVENT, JobEvent.created_at < cutoff)
+            session.execute(delete(JobEvent).where(JobEvent.job_id.in_(expired)))
+            session.commit()
+
+    async def flush(self):
+        """Store the events published since the last flush"""
+        rows, self._pending = self._pending, []
+        if rows:
+            try:
+                await asyncio.to_thread(self._insert, rows)
+            except Exception:
+                # Kept for the next flush
+                self._pending[:0] = rows
+                raise
+
+    async def _flush_loop(self):
+        pruned = time.monotonic()
+        while True:
+            await asyncio.sleep(JOB_EVENTS_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+                if time.monotonic() - pruned > PRUNE_INTERVAL:
+                    pruned = time.monotonic()
+                    await asyncio.to_thread(self._delete_expired)
+            except Exception as e:
+                print(f"Storing job events failed: {e}")
+
+    def _prune(self):
+        """Drop closed logs older than the retention window"""
+        cutoff = time.time() - self.retention
+        for job_id in [
+            job_id for job_id, log in self._logs.items()
+            if log.closed and log.closed_at < cutoff
+        ]:
+            del self._logs[job_id]
+
+
+job_events = JobEvents()
@@ -0,0 +1,376 @@
+"""
+Diagnostic job store
+Persistent, checkpointed diagnostic jobs backed by SQLAlchemy, shared by every worker process
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import JSON, Float, Index, Integer, String, and_, func, or_, select, true, update
+from sqlalchemy.orm import Mapped, mapped_column
+
+from services.database import Base, SessionLocal
+from services.responses import dumps
+
+# Configuration
+JOB_LEASE_TTL = float(os.environ.get("JOB_LEASE_TTL", "30"))
+
+UNFINISHED_STATUSES = ("queued", "processing")
+
+
+class DiagnosticJob(Base):
+    """A diagnostic job row; `data` mirrors the API job record"""
+    __tablename__ = "diagnostic_jobs"
+    __table_args__ = (Index("ix_diagnostic_jobs_queue", "status", "priority", "queued_at"),)
+
+    job_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    status: Mapped[str] = mapped_column(String(20), index=True)
+    current_phase: Mapped[int] = mapped_column(Integer, default=0)
+    last_completed_phase: Mapped[int] = mapped_column(Integer, default=0)
+    data: Mapped[Dict[str, Any]] = mapped_column(JSON, default=dict)
+    checkpoint: Mapped[Dict[str, Any]] = mapped_column(JSON, default=dict)
+    created_at: Mapped[str] = mapped_column(String(32))
+    updated_at: Mapped[str] = mapped_column(String(32))
+    # Queue order (lower first) and when the job joined the queue
+    priority: Mapped[int] = mapped_column(Integer, default=0)
+    queued_at: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    # Worker process holding the job; anyone may claim it once the lease expires
+    lease_owner: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)
+    lease_expires_at: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    # progress_record of `data`, so status polls don't load the full result
+    progress: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSON, nullable=True)
+    # Bumped by every write; a write only lands over an older version
+    version: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+
+def progress_record(job: Dict) -> Dict:
+    """The small, often-polled part of a job record"""
+    return {
+        "status": job["status"],
+        "current_phase": job.get("current_phase", 0),
+        "total_phases": job.get("total_phases"),
+        "phase_name": job.get("phase_name"),
+        "phases": job.get("phases"),
+        "sections_ready": len(job.get("sections") or []),
+        "error": job.get("error"),
+        "business_name": (job.get("inputs") or {}).get("business_name"),
+        "completed_at": job.get("completed_at"),
+    }
+
+
+def waiting():
+    """Jobs in the shared queue that no worker has claimed"""
+    return and_(DiagnosticJob.status == "queued", DiagnosticJob.lease_owner.is_(None))
+
+
+def claimable(now: float):
+    """Unfinished jobs that no live worker holds"""
+    return and_(
+        DiagnosticJob.status.in_(UNFINISHED_STATUSES),
+        or_(DiagnosticJob.lease_owner.is_(None), DiagnosticJob.lease_expires_at < now)
+    )
+
+
+class JobStore:
+    """Job registry over a database every worker process shares.
+
+    Jobs this process is working on are live: held in memory, mutated in
+    place by the pipeline (`store[job_id]`), and leased to this process
+    in the database whenever `save` or `checkpoint` is awaited. Any other
+    job is read from the database off the event loop with `fetch`, or
+    `progress` for the polled fields alone. A job leaves a process either
+    finished or through `enqueue`, after which any worker may `claim` it;
+    leases not renewed within `lease_ttl` (the worker died) make
+    unfinished jobs claimable again.
+    """
+
+    def __init__(self, session_factory=SessionLocal, lease_ttl: float = JOB_LEASE_TTL):
+        self.session_factory = session_factory
+        self.lease_ttl = lease_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._jobs: Dict[str, Dict] = {}
+        # Per live job: the latest save requested, the version last stored and the lock ordering writes
+        self._versions: Dict[str, int] = {}
+        self._stored: Dict[str, int] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def __getitem__(self, job_id: str) -> Dict:
+        # Live jobs only; anything else needs a database read, which `fetch` runs in a thread
+        return self._jobs[job_id]
+
+    def __setitem__(self, job_id: str, job: Dict):
+        # Live in this process; persisted on the next `save`/`checkpoint`
+        self._jobs[job_id] = job
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._jobs)
+
+    async def fetch(self, job_id: str) -> Optional[Dict]:
+        """The full job record, or None if there is no such job"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        return await asyncio.to_thread(self._load, job_id)
+
+    def _load(self, job_id: str) -> Optional[Dict]:
+        # Not kept: another worker may be changing it
+        with self.session_factory() as session:
+            row = session.get(DiagnosticJob, job_id)
+            return dict(row.data) if row is not None else None
+
+    async def progress(self, job_id: str) -> Optional[Dict]:
+        """progress_record of a job plus its queue_position, or None if there is no such job"""
+        return (await self.progress_many([job_id])).get(job_id)
+
+    async def progress_many(self, job_ids: List[str]) -> Dict[str, Dict]:
+        """progress for several jobs in one database round trip"""
+        found = {
+            job_id: {**progress_record(self._jobs[job_id]), "queue_position": None}
+            for job_id in job_ids if job_id in self._jobs
+        }
+        stored = [job_id for job_id in job_ids if job_id not in found]
+        if stored:
+            found.update(await asyncio.to_thread(self._progress, stored))
+        return found
+
+    def _progress(self, job_ids: List[str]) -> Dict[str, Dict]:
+        with self.session_factory() as session:
+            rows = session.execute(
+                select(DiagnosticJob.job_id, DiagnosticJob.status, DiagnosticJob.lease_owner, DiagnosticJob.progress)
+                .where(DiagnosticJob.job_id.in_(job_ids))
+            ).all()
+            found = {}
+            for row in rows:
+                progress = row.progress
+                if progress is None:
+                    # Stored before progress records were kept beside the job
+                    progress = progress_record(session.get(DiagnosticJob, row.job_id).data)
+                found[row.job_id] = {**progress, "queue_position": None}
+
+            if any(row.status == "queued" and row.lease_owner is None for row in rows):
+                # Served by the queue index; the queue is bounded, so reading its order is cheap
+                order = session.scalars(
+                    select(DiagnosticJob.job_id)
+                    .where(waiting(), DiagnosticJob.queued_at.is_not(None))
+                    .order_by(DiagnosticJob.priority, DiagnosticJob.queued_at)
+                ).all()
+                for position, job_id in enumerate(order, 1):
+                    if job_id in found:
+                        found[job_id]["queue_position"] = position
+            return found
+
+    def _write(
+        self,
+        job_id: str,
+        snapshot: bytes,
+        version: int,
+        phase: Optional[int] = None,
+        checkpoint: Optional[Dict] = None,
+        priority: Optional[int] = None
+    ) -> bool:
+        job = json.loads(snapshot)
+        now = datetime.utcnow().isoformat()
+        clock = time.time()
+        values = {
+            "status": job["status"],
+            "current_phase": job.get("current_phase", 0),
+            "data": job,
+            "progress": progress_record(job),
+            "updated_at": now,
+            "version": version,
+        }
+        if priority is not None:
+            values.update(priority=priority, queued_at=clock, lease_owner=None, lease_expires_at=None)
+        elif job["status"] in UNFINISHED_STATUSES:
+            values.update(lease_owner=self.owner, lease_expires_at=clock + self.lease_ttl)
+        else:
+            values.update(lease_owner=None, lease_expires_at=None)
+        if phase is not None:
+            values["last_completed_phase"] = phase
+
+        with self.session_factory() as session:
+            # Compare-and-set: only a newer version, and only while no other worker holds the job
+            result = session.execute(
+                update(DiagnosticJob)
+                .where(
+                    DiagnosticJob.job_id == job_id,
+                    DiagnosticJob.version < version,
+                    or_(
+                        DiagnosticJob.lease_owner.is_(None),
+                        DiagnosticJob.lease_owner == self.owner,
+                        DiagnosticJob.lease_expires_at < clock
+                    )
+                )
+                .values(**values)
+            )
+            if result.rowcount == 0:
+                if session.get(DiagnosticJob, job_id) is not None:
+                    # Our lease lapsed and another worker has taken the job over
+                    print(f"Job {job_id} is held elsewhere or already newer; dropping a stale write")
+                    return False
+                session.add(DiagnosticJob(job_id=job_id, created_at=job.get("created_at", now), checkpoint={}, **values))
+            if checkpoint:
+                row = session.get(DiagnosticJob, job_id)
+                row.checkpoint = {**(row.checkpoint or {}), **checkpoint}
+            session.commit()
+            return True
+
+    async def _persist(self, job_id: str, **write) -> bool:
+        """Write the live job as it is now; one write per job at a time, in call order.
+
+        The snapshot is taken when the write starts, so it holds every
+        change made before then, and saves still queued behind it that
+        carry nothing else are skipped.
+        """
+        if job_id not in self._jobs:
+            raise KeyError(job_id)
+        requested = self._versions[job_id] = self._versions.get(job_id, 0) + 1
+        async with self._locks.setdefault(job_id, asyncio.Lock()):
+            job = self._jobs.get(job_id)
+            if job is None or (not write and self._stored.get(job_id, 0) >= requested):
+                return job is not None
+            version = self._versions[job_id]
+            # Serialized here, not copied: the pipeline keeps changing the job while the thread writes
+            written = await asyncio.to_thread(self._write, job_id, dumps(job), version, **write)
+            if written:
+                self._stored[job_id] = version
+            return written
+
+    async def save(self, job_id: str):
+        """Persist the current job record"""
+        await self._persist(job_id)
+
+    async def checkpoint(self, job_id: str, phase: int, **data):
+        """Persist the job together with the outputs of a completed phase"""
+        await self._persist(job_id, phase=phase, checkpoint=data)
+
+    async def load_checkpoint(self, job_id: str) -> Dict:
+        """Outputs saved by earlier phases of this job"""
+        def load():
+            with self.session_factory() as session:
+                row = session.get(DiagnosticJob, job_id)
+                return dict(row.checkpoint or {}) if row else {}
+        return await asyncio.to_thread(load)
+
+    def release(self, job_id: str):
+        """Stop holding a job in this process once it has finished here"""
+        self._jobs.pop(job_id, None)
+        self._versions.pop(job_id, None)
+        self._stored.pop(job_id, None)
+        self._locks.pop(job_id, None)
+
+    async def enqueue(self, job_id: str, priority: int):
+        """Persist a live job as waiting for any worker to claim it, and let go of it"""
+        await self._persist(job_id, priority=priority)
+        self.release(job_id)
+
+    def _claim(self, condition, limit: Optional[int] = None) -> List[Tuple[str, Optional[float]]]:
+        """Lease claimable jobs matching condition, in queue order, skipping any another worker wins"""
+        now = time.time()
+        claimed = []
+        with self.session_factory() as session:
+            candidates = session.execute(
+                select(DiagnosticJob.job_id, DiagnosticJob.queued_at)
+                .where(claimable(now), condition)
+                .order_by(DiagnosticJob.priority, DiagnosticJob.queued_at)
+                .limit(limit and limit * 8)
+            ).all()
+            for job_id, queued_at in candidates:
+                # Compare-and-set, so two workers can never both win the same job
+                result = session.execute(
+                    update(DiagnosticJob)
+                    .where(DiagnosticJob.job_id == job_id, claimable(now))
+                    .values(lease_owner=self.owner, lease_expires_at=now + self.lease_ttl)
+                )
+                session.commit()
+                if result.rowcount == 1:
+                    row = session.get(DiagnosticJob, job_id)
+                    self._jobs[job_id] = dict(row.data)
+                    # Our writes carry on from the last owner's
+                    self._versions[job_id] = self._stored[job_id] = row.version
+                    claimed.append((job_id, queued_at))
+                    if len(claimed) == limit:
+                        break
+        return claimed
+
+    async def claim(self) -> Optional[Tuple[str, Optional[float]]]:
+        """Lease the next queued job (or one a dead worker left behind); returns it and when it was queued"""
+        claimed = await asyncio.to_thread(self._claim, true(), 1)
+        return claimed[0] if claimed else None
+
+    async def claim_message_batch(self, message_batch_id: str) -> List[str]:
+        """Lease every claimable job waiting on one message batch"""
+        condition = DiagnosticJob.data["message_batch_id"].as_string() == message_batch_id
+        return [job_id for job_id, _ in await asyncio.to_thread(self._claim, condition)]
+
+    async def renew(self) -> int:
+        """Extend the leases of the jobs live in this process"""
+        job_ids = list(self._jobs)
+        if not job_ids:
+            return 0
+
+        def write():
+            with self.session_factory() as session:
+                result = session.execute(
+                    update(DiagnosticJob)
+                    .where(DiagnosticJob.lease_owner == self.owner, DiagnosticJob.job_id.in_(job_ids))
+                    .values(lease_expires_at=time.time() + self.lease_ttl)
+                )
+                session.commit()
+                return result.rowcount
+        return await asyncio.to_thread(write)
+
+    async def release_held(self) -> int:
+        """Hand every unfinished job this process holds back to the queue (on shutdown)"""
+        def write():
+            with self.session_factory() as session:
+                result = session.execute(
+                    update(DiagnosticJob)
+                    .where(DiagnosticJob.lease_owner == self.owner, DiagnosticJob.status.in_(UNFINISHED_STATUSES))
+                    .values(
+                        lease_owner=None,
+                        lease_expires_at=None,
+                        queued_at=func.coalesce(DiagnosticJob.queued_at, time.time())
+                    )
+                )
+                session.commit()
+                return result.rowcount
+        released = await asyncio.to_thread(write)
+        for job_id in list(self._jobs):
+            self.release(job_id)
+        return released
+
+    async def queue_depth(self, below: Optional[int] = None, at_least: Optional[int] = None) -> int:
+        """Jobs waiting in the shared queue, optionally only those within a priority band"""
+        condition = waiting()
+        if below is not None:
+            condition = and_(condition, DiagnosticJob.priority < below)
+        if at_least is not None:
+            condition = and_(condition, DiagnosticJob.priority >= at_least)
+
+        def count():
+            with self.session_factory() as session:
+                return session.scalar(select(func.count()).select_from(DiagnosticJob).where(condition))
+        return await asyncio.to_thread(count)
+
+    async def queue_position(self, job_id: str) -> Optional[int]:
+        """1-based place in the shared queue, or None if the job is not waiting"""
+        progress = await self.progress(job_id)
+        return progress["queue_position"] if progress is not None else None
+
+    async def batch_job_ids(self, batch_id: str) -> List[str]:
+        """Jobs created by one batch request, in submission order"""
+        def load():
+            with self.session_factory() as session:
+                return list(session.scalars(
+                    select(DiagnosticJob.job_id)
+                    .where(DiagnosticJob.data["batch_id"].as_string() == batch_id)
+                    .order_by(DiagnosticJob.data["batch_index"].as_integer())
+                ).all())
+        return await asyncio.to_thread(load)
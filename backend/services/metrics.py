@@ -0,0 +1,217 @@
+"""
+Metrics registry
+Counters, gauges and histograms rendered in the Prometheus text exposition format
+"""
+
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+# Upstream calls and pipeline phases range from ~50ms searches to multi-minute generations
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+LabelValues = Tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    """A named metric family with a fixed set of label names"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        # Stored per bucket; made cumulative when rendered
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        self._sums[key] += value
+
+    def samples(self) -> Iterable[str]:
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = format_labels(self.labels, key, f'le="{format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, key)} {format_value(self._sums[key])}"
+            yield f"{self.name}_count{format_labels(self.labels, key)} {cumulative}"
+
+
+class Gauge(Metric):
+    """Read at scrape time from a callback returning {label values: value}"""
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Dict[LabelValues, float]],
+        labels: Tuple[str, ...] = ()
+    ):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self.callback().items():
+            yield f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+
+
+class CallbackCounter(Gauge):
+    """A counter whose totals are kept elsewhere (e.g. token usage) and read at scrape time"""
+    kind = "counter"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        # Re-registering (e.g. on module reload) keeps the existing family
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name: str, documentation: str, callback, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, callback, labels))
+
+    def callback_counter(self, name: str, documentation: str, callback, labels: Tuple[str, ...] = ()) -> CallbackCounter:
+        return self.register(CallbackCounter(name, documentation, callback, labels))
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics.values())
+
+
+registry = MetricsRegistry()
+
+# Starlette appends the charset to text/* media types
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Shared families; gauges are registered next to the state they read
+upstream_latency = registry.histogram(
+    "marketsauce_upstream_request_duration_seconds",
+    "Latency of calls to upstream APIs",
+    ("upstream", "operation")
+)
+upstream_errors = registry.counter(
+    "marketsauce_upstream_errors_total",
+    "Upstream calls that failed, by status code (or transport error)",
+    ("upstream", "operation", "status")
+)
+upstream_timeouts = registry.counter(
+    "marketsauce_upstream_timeouts_total",
+    "Upstream calls abandoned after a client timeout or task deadline",
+    ("upstream", "operation")
+)
+phase_latency = registry.histogram(
+    "marketsauce_pipeline_phase_duration_seconds",
+    "Time spent in each diagnostic pipeline phase",
+    ("phase", "mode")
+)
+
+
+class UpstreamCall:
+    """Handle for one timed upstream call; report the response status through it"""
+
+    def __init__(self, upstream: str, operation: str):
+        self.upstream = upstream
+        self.operation = operation
+        self.failed = False
+
+    def status(self, code: int):
+        if code >= 400:
+            self.failed = True
+            upstream_errors.inc(upstream=self.upstream, operation=self.operation, status=str(code))
+
+
+@asynccontextmanager
+async def track_upstream(upstream: str, operation: str):
+    """Time an upstream call and count its timeouts and transport errors"""
+    call = UpstreamCall(upstream, operation)
+    started = time.perf_counter()
+    try:
+        yield call
+    except (httpx.TimeoutException, asyncio.TimeoutError):
+        upstream_timeouts.inc(upstream=upstream, operation=operation)
+        raise
+    except httpx.HTTPError as e:
+        upstream_errors.inc(upstream=upstream, operation=operation, status=type(e).__name__)
+        raise
+    except HTTPException as e:
+        # Errors raised mid-stream (e.g. an `error` event) that no status code reported
+        if not call.failed:
+            upstream_errors.inc(upstream=upstream, operation=operation, status=str(e.status_code))
+        raise
+    finally:
+        upstream_latency.observe(time.perf_counter() - started, upstream=upstream, operation=operation)
@@ -0,0 +1,183 @@
+"""
+Phase graph
+Pipeline phases as a dependency graph: each starts once its inputs exist, pruned to what a mode needs
+"""
+
+import time
+import asyncio
+import inspect
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+# Outcomes that count towards progress; "restored" phases were covered by checkpointed outputs
+FINISHED_PHASE_STATES = ("complete", "restored")
+
+
+@dataclass(frozen=True)
+class Phase:
+    """One unit of pipeline work and the named values it consumes and produces"""
+    name: str
+    title: str
+    run: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    # Consumed if a phase that will run produces them, otherwise left out
+    optional: Tuple[str, ...] = ()
+    # Modes that need this phase; None for every mode
+    modes: Optional[FrozenSet[str]] = None
+
+
+def phase_record(phase: Phase) -> Dict:
+    """Progress record of a phase, as reported in job status"""
+    return {"name": phase.name, "title": phase.title, "status": "pending", "started_at": None, "duration_seconds": None}
+
+
+class PhaseGraph:
+    """Runs phases concurrently in dependency order.
+
+    A phase receives the values named by its inputs and returns a dict of
+    its outputs. Values that already exist when a run starts (seeds such
+    as the job inputs, or outputs restored from a checkpoint) are used as
+    they are, and phases only needed to produce them are not run.
+    """
+
+    def __init__(self, phases: Iterable[Phase]):
+        self.phases: List[Phase] = list(phases)
+        self.producers: Dict[str, Phase] = {}
+        for phase in self.phases:
+            for output in phase.outputs:
+                if output in self.producers:
+                    raise ValueError(f"{output!r} is produced by both {self.producers[output].name} and {phase.name}")
+                self.producers[output] = phase
+        self.order = self._sorted()
+
+    def _sorted(self) -> List[Phase]:
+        """Phases with every producer before its consumers; raises on a cycle"""
+        order: List[Phase] = []
+        marks: Dict[str, str] = {}
+
+        def visit(phase: Phase):
+            mark = marks.get(phase.name)
+            if mark == "done":
+                return
+            if mark == "visiting":
+                raise ValueError(f"Phase graph has a cycle through {phase.name}")
+            marks[phase.name] = "visiting"
+            for name in phase.inputs + phase.optional:
+                if name in self.producers:
+                    visit(self.producers[name])
+            marks[phase.name] = "done"
+            order.append(phase)
+
+        for phase in self.phases:
+            visit(phase)
+        return order
+
+    @property
+    def outputs(self) -> Set[str]:
+        return set(self.producers)
+
+    def for_mode(self, mode: str, targets: Iterable[str]) -> "PhaseGraph":
+        """The phases `mode` runs to produce `targets`; anything else is pruned"""
+        allowed = {phase.name for phase in self.phases if phase.modes is None or mode in phase.modes}
+        return PhaseGraph(phase for phase in self.phases if phase.name in self._needed(targets, {}, allowed))
+
+    def _needed(self, targets: Iterable[str], values: Dict[str, Any], allowed: Optional[Set[str]] = None) -> Set[str]:
+        """Names of the phases that must run to produce the targets missing from values"""
+        needed: Set[str] = set()
+        stack = [name for name in targets if name not in values]
+        while stack:
+            producer = self.producers.get(stack.pop())
+            if producer is None or producer.name in needed or (allowed is not None and producer.name not in allowed):
+                continue
+            needed.add(producer.name)
+            stack.extend(name for name in producer.inputs + producer.optional if name not in values)
+        return needed
+
+    def plan(self) -> List[Dict]:
+        """A pending progress record per phase, in dependency order"""
+        return [phase_record(phase) for phase in self.order]
+
+    async def run(
+        self,
+        values: Dict[str, Any],
+        targets: Iterable[str],
+        plan: Optional[List[Dict]] = None,
+        on_change: Optional[Callable[[Dict], Any]] = None
+    ) -> Dict[str, Any]:
+        """Produce the targets, starting each phase as soon as its inputs are ready.
+
+        `plan` records are updated in place (status, start time, duration)
+        and passed to `on_change` after every transition. On the first
+        failure the phases still running are cancelled and the error
+        propagates.
+        """
+        values = dict(values)
+        todo = self._needed(targets, values)
+        for name in todo:
+            phase = next(phase for phase in self.phases if phase.name == name)
+            missing = [value for value in phase.inputs if value not in values and value not in self.producers]
+            if missing:
+                raise ValueError(f"Phase {name} needs {', '.join(missing)}, which nothing provides")
+
+        records = {record["name"]: record for record in plan} if plan is not None else {}
+        for phase in self.order:
+            records.setdefault(phase.name, phase_record(phase))
+
+        async def changed(record: Dict):
+            if on_change is not None:
+                result = on_change(record)
+                if inspect.isawaitable(result):
+                    await result
+
+        for phase in self.order:
+            record = records[phase.name]
+            if phase.name in todo:
+                record.update(status="pending", started_at=None, duration_seconds=None)
+            elif record["status"] != "complete":
+                # Its outputs (or everything downstream of them) came from a checkpoint
+                record["status"] = "restored"
+
+        def awaited(phase: Phase) -> List[str]:
+            return list(phase.inputs) + [
+                name for name in phase.optional if name in self.producers and self.producers[name].name in todo
+            ]
+
+        waiting = [phase for phase in self.order if phase.name in todo]
+        running: Dict[asyncio.Task, Tuple[Phase, float]] = {}
+        try:
+            while waiting or running:
+                for phase in [phase for phase in waiting if all(name in values for name in awaited(phase))]:
+                    waiting.remove(phase)
+                    arguments = {name: values[name] for name in phase.inputs + phase.optional if name in values}
+                    running[asyncio.create_task(phase.run(arguments))] = (phase, time.perf_counter())
+                    record = records[phase.name]
+                    record.update(status="running", started_at=datetime.utcnow().isoformat())
+                    await changed(record)
+                if not running:
+                    raise RuntimeError(f"Phases {', '.join(phase.name for phase in waiting)} can never start")
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    phase, started = running.pop(task)
+                    record = records[phase.name]
+                    record["duration_seconds"] = round(time.perf_counter() - started, 3)
+                    error = task.exception()
+                    produced = task.result() if error is None else None
+                    if error is None and not all(name in (produced or {}) for name in phase.outputs):
+                        error = ValueError(f"Phase {phase.name} did not produce {', '.join(phase.outputs)}")
+                    if error is not None:
+                        record["status"] = "failed"
+                        await changed(record)
+                        raise error
+                    values.update({name: produced[name] for name in phase.outputs})
+                    record["status"] = "complete"
+                    await changed(record)
+        finally:
+            for task, (phase, _) in running.items():
+                task.cancel()
+                records[phase.name]["status"] = "cancelled"
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        return values
@@ -0,0 +1,71 @@
+"""
+Prompt registry
+Loads prompt files once, reloads on mtime change, and marks prompt-cache breakpoints
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+PROMPTS_DIR = Path(__file__).parent.parent / "prompts"
+SYSTEM_PROMPT_PATH = PROMPTS_DIR / "system.md"
+DEFAULT_SYSTEM_PROMPT = "You are MarketSauce Agent, an AI market intelligence assistant."
+
+PROMPT_CACHING = os.environ.get("PROMPT_CACHING", "true").lower() == "true"
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+class PromptRegistry:
+    """In-process prompt cache keyed by path; a stat() per lookup detects edits"""
+
+    def __init__(self):
+        self._entries: Dict[Path, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: Path, default: Optional[str] = None) -> Optional[str]:
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return default
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+        with self._lock:
+            text = path.read_text()
+            self._entries[path] = (mtime, text)
+        return text
+
+
+prompt_registry = PromptRegistry()
+
+
+def system_prompt_text() -> str:
+    """The MarketSauce methodology prompt"""
+    return prompt_registry.get(SYSTEM_PROMPT_PATH, DEFAULT_SYSTEM_PROMPT)
+
+
+def cached_system(*texts: str) -> List[Dict]:
+    """System blocks with a cache breakpoint after the last (stable) block"""
+    blocks = [{"type": "text", "text": text} for text in texts if text]
+    if PROMPT_CACHING and blocks:
+        blocks[-1]["cache_control"] = CACHE_CONTROL
+    return blocks
+
+
+def cached_messages(messages: List[Dict]) -> List[Dict]:
+    """Copy of a conversation with a cache breakpoint on its final message.
+
+    Each turn then reads the previous turns' prefix from the cache and only
+    the newest exchange is billed as fresh input.
+    """
+    if not PROMPT_CACHING or not messages:
+        return messages
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    else:
+        content = [dict(block) for block in content]
+    content[-1]["cache_control"] = CACHE_CONTROL
+    return messages[:-1] + [{**last, "content": content}]
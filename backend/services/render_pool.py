@@ -0,0 +1,76 @@
+"""
+Document render pool
+Runs CPU-bound document rendering off the event loop, with a cap on concurrent renders
+"""
+
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+# Configuration
+# Processes keep python-docx from holding the GIL on the event loop's thread; threads
+# avoid the pickling cost and suit small documents or platforms without fork
+DOCUMENT_RENDER_EXECUTOR = os.environ.get("DOCUMENT_RENDER_EXECUTOR", "process")
+DOCUMENT_RENDER_WORKERS = int(os.environ.get("DOCUMENT_RENDER_WORKERS", "2"))
+DOCUMENT_RENDER_CONCURRENCY = int(os.environ.get("DOCUMENT_RENDER_CONCURRENCY", "4"))
+
+
+class RenderPool:
+    """Lazily started executor; at most `concurrency` renders are submitted at once"""
+
+    def __init__(
+        self,
+        kind: str = DOCUMENT_RENDER_EXECUTOR,
+        workers: int = DOCUMENT_RENDER_WORKERS,
+        concurrency: int = DOCUMENT_RENDER_CONCURRENCY
+    ):
+        self.kind = kind
+        self.workers = workers
+        self.concurrency = concurrency
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn, not fork: the API process already runs threads (to_thread, SQLite)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render")
+        return self._executor
+
+    async def run(self, fn: Callable, *args):
+        """Run fn(*args) in the pool; fn and its arguments must be picklable for processes"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "executor": self.kind,
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "waiting": self.waiting,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+render_pool = RenderPool()
@@ -0,0 +1,172 @@
+"""
+Research cache
+Two-tier (LRU memory + SQLite disk) cache for Firecrawl scrape and search results
+"""
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Configuration
+RESEARCH_CACHE_PATH = os.environ.get("RESEARCH_CACHE_PATH", "./research_cache.db")
+RESEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("RESEARCH_CACHE_MAX_ENTRIES", "1000"))
+RESEARCH_CACHE_TTLS = {
+    "scrape": float(os.environ.get("RESEARCH_CACHE_TTL_SCRAPE", str(24 * 3600))),
+    "search": float(os.environ.get("RESEARCH_CACHE_TTL_SEARCH", str(6 * 3600))),
+}
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL so trivially different spellings share an entry"""
+    url = url.strip()
+    if "://" not in url:
+        url = f"https://{url}"
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query)))
+    return urlunsplit((parts.scheme.lower(), host, path, query, ""))
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a search query (case and whitespace insensitive)"""
+    return " ".join(query.lower().split())
+
+
+def cache_key(kind: str, target: str, **params) -> str:
+    """Build the cache key for a scrape URL or search query"""
+    normalized = normalize_url(target) if kind == "scrape" else normalize_query(target)
+    suffix = "".join(f"|{k}={params[k]}" for k in sorted(params))
+    return f"{kind}:{normalized}{suffix}"
+
+
+class ResearchCache:
+    """LRU memory tier in front of a SQLite tier that survives restarts"""
+
+    def __init__(
+        self,
+        path: Optional[str] = RESEARCH_CACHE_PATH,
+        max_entries: int = RESEARCH_CACHE_MAX_ENTRIES,
+        ttls: Optional[Dict[str, float]] = None
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttls = ttls or RESEARCH_CACHE_TTLS
+        self._memory: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS research_cache ("
+                "key TEXT PRIMARY KEY, kind TEXT NOT NULL, "
+                "value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, Dict]]:
+        with self._db_lock:
+            db = self._connection()
+            if db is None:
+                return None
+            row = db.execute(
+                "SELECT value, expires_at FROM research_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[1], json.loads(row[0])
+
+    def _disk_set(self, key: str, kind: str, value: Dict, expires_at: float):
+        payload = json.dumps(value, separators=(",", ":"))
+        with self._db_lock:
+            db = self._connection()
+            if db is None:
+                return
+            db.execute(
+                "INSERT OR REPLACE INTO research_cache (key, kind, value, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, kind, payload, expires_at)
+            )
+            db.execute("DELETE FROM research_cache WHERE expires_at < ?", (time.time(),))
+            db.commit()
+
+    def _remember(self, key: str, expires_at: float, value: Dict):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """Return a fresh cached value, checking memory before disk"""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return entry[1]
+            del self._memory[key]
+            self._stats["expired"] += 1
+
+        entry = await asyncio.to_thread(self._disk_get, key)
+        if entry is not None and entry[0] > now:
+            self._remember(key, *entry)
+            self._stats["disk_hits"] += 1
+            return entry[1]
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Dict):
+        """Store a value in both tiers with its kind's TTL"""
+        kind = key.split(":", 1)[0]
+        expires_at = time.time() + self.ttls.get(kind, 3600)
+        self._remember(key, expires_at, value)
+        self._stats["writes"] += 1
+        await asyncio.to_thread(self._disk_set, key, kind, value, expires_at)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and tier sizes"""
+        lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+        hits = lookups - self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_enabled": bool(self.path),
+        }
+
+    def close(self):
+        """Close the disk tier"""
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+research_cache = ResearchCache()
@@ -0,0 +1,59 @@
+"""
+Response encoding
+orjson-backed JSON responses and fields= projections of large response objects
+"""
+
+import json
+from typing import Any, Dict, Optional
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON; orjson when installed, the standard library otherwise"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson.
+
+    The default response class of the app. Endpoints returning large
+    plain dicts can return it directly, which also skips FastAPI's
+    jsonable_encoder pass over the content.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def project(data: Dict, fields: Optional[str]) -> Dict:
+    """Keep only the comma-separated fields of data; dotted paths reach into nested objects.
+
+    Fields data doesn't have are left out, and an empty selection returns
+    data unchanged.
+    """
+    paths = [path.strip() for path in (fields or "").split(",") if path.strip()]
+    if not paths:
+        return data
+
+    result: Dict = {}
+    for path in paths:
+        *parents, leaf = path.split(".")
+        source, target = data, result
+        for key in parents:
+            value = source.get(key) if isinstance(source, dict) else None
+            # Missing, not an object, or already selected whole by an earlier path
+            if not isinstance(value, dict) or target.get(key) is value:
+                break
+            source, target = value, target.setdefault(key, {})
+        else:
+            if isinstance(source, dict) and leaf in source:
+                target[leaf] = source[leaf]
+    return result
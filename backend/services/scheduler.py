@@ -0,0 +1,179 @@
+"""
+Diagnostic scheduler
+Fixed pool of worker tasks claiming jobs from a priority queue shared by every worker process
+"""
+
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from services.metrics import registry
+
+# Configuration
+DIAGNOSTIC_WORKERS = int(os.environ.get("DIAGNOSTIC_WORKERS", "4"))
+DIAGNOSTIC_QUEUE_SIZE = int(os.environ.get("DIAGNOSTIC_QUEUE_SIZE", "100"))
+# How often idle workers look for jobs queued by other processes, in seconds
+SCHEDULER_POLL_INTERVAL = float(os.environ.get("SCHEDULER_POLL_INTERVAL", "1.0"))
+
+# Lower rank runs first
+MODE_PRIORITY = {"express": 0, "strategic": 1, "full": 2}
+# Ranks the account's tier; it must come from the server's own records, never from the request body
+TIER_PRIORITY = {"enterprise": 0, "prime": 1, "strategic": 2, "express": 3}
+DEFAULT_RANK = 9
+# Batch items are queued from this priority up, below every interactive job and outside its queue bound
+BATCH_PRIORITY = 100
+
+# Used for Retry-After until real durations have been observed
+DEFAULT_JOB_SECONDS = 60.0
+
+queue_wait = registry.histogram(
+    "marketsauce_diagnostic_queue_wait_seconds",
+    "Time diagnostic jobs spend queued before a worker picks them up"
+)
+
+
+class QueueFull(Exception):
+    """Raised when the queue has no room; carries a Retry-After hint in seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Diagnostic queue is full")
+        self.retry_after = retry_after
+
+
+def job_priority(mode: Optional[str], tier: Optional[str], batch: bool = False) -> int:
+    # Ranks are single digits, so batch, mode, tier order packs into one sortable integer;
+    # bulk batch items run after every interactive job
+    return (BATCH_PRIORITY if batch else 0) + MODE_PRIORITY.get(mode, DEFAULT_RANK) * 10 + TIER_PRIORITY.get(tier, DEFAULT_RANK)
+
+
+class DiagnosticScheduler:
+    """Runs `workers` jobs at a time from the shared queue, which admits at most `max_queue` waiting interactive jobs.
+
+    The queue lives in the job store, so a job submitted to one process
+    may run on any. Workers lease the jobs they claim and renew the
+    leases while they run; a job whose worker dies is claimed again once
+    its lease expires and resumes from its checkpoint. Batch items wait
+    behind interactive jobs and don't count towards `max_queue`, so a
+    large batch never turns interactive requests away.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[str], Awaitable[None]],
+        queue,
+        workers: int = DIAGNOSTIC_WORKERS,
+        max_queue: int = DIAGNOSTIC_QUEUE_SIZE
+    ):
+        self.runner = runner
+        self.queue = queue
+        self.workers = workers
+        self.max_queue = max_queue
+        self._ready: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        self.running: Dict[str, float] = {}
+        self._avg_seconds: Optional[float] = None
+        # Last count of interactive jobs in the shared queue, for metrics; refreshed by `count` and the heartbeat
+        self.depth = 0
+
+    async def start(self):
+        """Spawn the worker pool and the lease heartbeat"""
+        self._ready = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        """Cancel the workers and hand their unfinished jobs back to the queue for another process"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.queue.release_held()
+
+    async def count(self) -> int:
+        """Interactive jobs waiting in the shared queue"""
+        self.depth = await self.queue.queue_depth(below=BATCH_PRIORITY)
+        return self.depth
+
+    async def full(self) -> bool:
+        return await self.count() >= self.max_queue
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up"""
+        per_job = self._avg_seconds or DEFAULT_JOB_SECONDS
+        return max(1, int(per_job / self.workers))
+
+    async def submit(
+        self,
+        job_id: str,
+        mode: Optional[str] = None,
+        tier: Optional[str] = None,  # verified on the server; clients' own claims are ignored
+        force: bool = False,
+        batch: bool = False
+    ) -> int:
+        """Queue a job and return its 1-based position; raises QueueFull unless forced"""
+        if not force and await self.full():
+            raise QueueFull(self.retry_after())
+        await self.queue.enqueue(job_id, job_priority(mode, tier, batch))
+        position = await self.position(job_id)
+        if self._ready is not None:
+            async with self._ready:
+                self._ready.notify()
+        # A worker somewhere may already have claimed it
+        return position or 1
+
+    async def position(self, job_id: str) -> Optional[int]:
+        """1-based place in line, or None if the job is not waiting"""
+        return await self.queue.queue_position(job_id)
+
+    async def stats(self) -> Dict:
+        return {
+            "worker_process": self.queue.owner,
+            "workers": self.workers,
+            "running": len(self.running),
+            "queue_depth": await self.count(),
+            "batch_queue_depth": await self.queue.queue_depth(at_least=BATCH_PRIORITY),
+            "max_queue": self.max_queue,
+            "avg_job_seconds": round(self._avg_seconds, 2) if self._avg_seconds else None,
+        }
+
+    async def _next(self) -> str:
+        while True:
+            try:
+                claimed = await self.queue.claim()
+            except Exception as e:
+                print(f"Claiming a diagnostic failed: {e}")
+                claimed = None
+            if claimed is not None:
+                job_id, queued_at = claimed
+                if queued_at is not None:
+                    queue_wait.observe(max(0.0, time.time() - queued_at))
+                return job_id
+            # Woken at once by a local submit; jobs queued by other processes are found by polling
+            async with self._ready:
+                try:
+                    await asyncio.wait_for(self._ready.wait(), timeout=SCHEDULER_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.queue.lease_ttl / 3)
+            try:
+                await self.queue.renew()
+                await self.count()
+            except Exception as e:
+                print(f"Renewing diagnostic leases failed: {e}")
+
+    async def _worker(self):
+        while True:
+            job_id = await self._next()
+            started = self.running[job_id] = time.monotonic()
+            try:
+                await self.runner(job_id)
+            except Exception as e:
+                print(f"Diagnostic {job_id} failed in scheduler: {e}")
+            finally:
+                self.running.pop(job_id, None)
+                elapsed = time.monotonic() - started
+                self._avg_seconds = elapsed if self._avg_seconds is None else 0.8 * self._avg_seconds + 0.2 * elapsed
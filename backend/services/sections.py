@@ -0,0 +1,171 @@
+"""
+Diagnostic section index
+Single-pass markdown heading parser with offsets, shared by every section extractor
+"""
+
+import re
+import itertools
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# One scan handles both headings and code fences (headings inside fences are ignored).
+# Anchoring on a literal newline rather than re.M `^` lets the regex engine skip
+# ahead with a fast prefix search instead of trying every position.
+TOKEN = re.compile(r"\n(?:(?P<fence>```|~~~)|(?P<hashes>#{1,6})[ \t]+(?P<title>[^\n]*))")
+LEADING_TOKEN = re.compile(r"(?:(?P<fence>```|~~~)|(?P<hashes>#{1,6})[ \t]+(?P<title>[^\n]*))")
+FOLLOW_UP_ITEM = re.compile(r"^[ \t]*(?:\*\*)?(\d{1,2})[.)]", re.M)
+RULE = re.compile(r"^[ \t]*(?:---+|\*\*\*+)[ \t]*$", re.M)
+
+MAX_FOLLOW_UP_PROMPTS = 15
+
+
+@dataclass
+class Section:
+    """A heading and the span of text it owns"""
+    index: int
+    level: int
+    title: str
+    start: int
+    body_start: int
+    end: int
+    parent: Optional[int] = None
+    children: List[int] = field(default_factory=list)
+
+
+class SectionIndex:
+    """Heading tree over a diagnostic, built in one linear pass.
+
+    A section runs from its heading to the next heading of the same or a
+    higher level, so nested subsections fall inside their parent's span.
+    """
+
+    def __init__(self, text: str, sections: List[Section]):
+        self.text = text
+        self.sections = sections
+
+    @classmethod
+    def build(cls, text: str) -> "SectionIndex":
+        sections: List[Section] = []
+        stack: List[Section] = []
+        in_fence = None
+        leading = LEADING_TOKEN.match(text)
+        matches = TOKEN.finditer(text)
+        if leading is not None:
+            matches = itertools.chain([leading], matches)
+        for match in matches:
+            fence = match.group("fence")
+            if fence:
+                in_fence = None if in_fence == fence else (in_fence or fence)
+                continue
+            if in_fence:
+                continue
+            level = len(match.group("hashes"))
+            start = match.start("hashes")
+            while stack and stack[-1].level >= level:
+                stack.pop().end = start
+            section = Section(
+                index=len(sections),
+                level=level,
+                title=match.group("title").strip().rstrip("#").rstrip(),
+                start=start,
+                body_start=min(match.end() + 1, len(text)),
+                end=len(text),
+                parent=stack[-1].index if stack else None
+            )
+            if stack:
+                stack[-1].children.append(section.index)
+            sections.append(section)
+            stack.append(section)
+        return cls(text, sections)
+
+    @classmethod
+    def from_dict(cls, text: str, data: Dict) -> "SectionIndex":
+        """Rebuild from the compact form stored on a job (falls back to reparsing)"""
+        if not data or data.get("length") != len(text):
+            return cls.build(text)
+        sections = [
+            Section(index=i, level=level, title=title, start=start, body_start=body_start, end=end, parent=parent)
+            for i, (level, title, start, body_start, end, parent) in enumerate(data["sections"])
+        ]
+        for section in sections:
+            if section.parent is not None:
+                sections[section.parent].children.append(section.index)
+        return cls(text, sections)
+
+    def to_dict(self) -> Dict:
+        return {
+            "length": len(self.text),
+            "sections": [
+                [s.level, s.title, s.start, s.body_start, s.end, s.parent]
+                for s in self.sections
+            ]
+        }
+
+    def outline(self) -> List[Dict]:
+        """Headings with offsets, without section text"""
+        return [
+            {
+                "id": s.index,
+                "level": s.level,
+                "title": s.title,
+                "start": s.start,
+                "end": s.end,
+                "parent": s.parent
+            }
+            for s in self.sections
+        ]
+
+    def content(self, section: Section) -> str:
+        return self.text[section.start:section.end].strip()
+
+    def body(self, section: Section) -> str:
+        return self.text[section.body_start:section.end]
+
+    def find(self, *prefixes: str, max_level: int = 6) -> Optional[Section]:
+        """First section whose title starts with one of the prefixes (case-insensitive)"""
+        prefixes = tuple(p.upper() for p in prefixes)
+        for section in self.sections:
+            if section.level <= max_level and section.title.upper().startswith(prefixes):
+                return section
+        return None
+
+    def top_level(self, section: Section) -> Section:
+        """The outermost level-2 (or higher) section containing this one"""
+        while section.parent is not None and section.level > 2:
+            section = self.sections[section.parent]
+        return section
+
+    def phase(self, number: int) -> Optional[Section]:
+        """The `## PHASE n` section, if present"""
+        pattern = re.compile(rf"PHASE\s+{number}\b", re.I)
+        return next((s for s in self.sections if s.level <= 2 and pattern.match(s.title)), None)
+
+    def executive_summary(self) -> str:
+        section = self.phase(8) or self.find("Executive Summary", max_level=3)
+        if section is None:
+            return self.text[:2000]
+        return self.content(section)
+
+    def system_prompt(self) -> Optional[str]:
+        section = self.find("9.2 System Prompt") or self.find("System Prompt", max_level=3)
+        if section is None:
+            return None
+        end = self.top_level(section).end
+        return self.text[section.start:end].strip()
+
+    def follow_up_prompts(self) -> Optional[List[str]]:
+        section = self.phase(10)
+        if section is None:
+            return None
+        items = list(FOLLOW_UP_ITEM.finditer(self.text, section.body_start, section.end))
+        prompts = []
+        for item, following in zip(items, items[1:] + [None]):
+            end = following.start() if following else section.end
+            # A horizontal rule closes the list (e.g. the closing footnote)
+            rule = RULE.search(self.text, item.start(), end)
+            if rule is not None:
+                end = rule.start()
+            prompts.append(self.text[item.start():end].strip())
+            if len(prompts) == MAX_FOLLOW_UP_PROMPTS:
+                break
+        return prompts or None
@@ -0,0 +1,349 @@
+"""
+Chat session store
+Memory-bounded LRU/idle-TTL session cache over an append-only on-disk log shared by worker processes
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+# Configuration
+CHAT_SESSIONS_DIR = os.environ.get("CHAT_SESSIONS_DIR", "./chat_sessions")
+CHAT_SESSIONS_MAX_BYTES = int(os.environ.get("CHAT_SESSIONS_MAX_BYTES", str(64 * 1024 * 1024)))
+CHAT_SESSION_IDLE_TTL = float(os.environ.get("CHAT_SESSION_IDLE_TTL", "1800"))
+# Logs not written to for this long are deleted, in seconds (0 keeps them)
+CHAT_SESSIONS_RETENTION = float(os.environ.get("CHAT_SESSIONS_RETENTION", str(30 * 24 * 3600)))
+# Least recently written logs are deleted while the directory holds more than this (0 for no limit)
+CHAT_SESSIONS_MAX_DISK_BYTES = int(os.environ.get("CHAT_SESSIONS_MAX_DISK_BYTES", str(1024 ** 3)))
+
+# Creating a session sweeps the directory at most this often, in seconds
+SWEEP_INTERVAL = 300.0
+
+
+def session_size(session: Dict) -> int:
+    """Approximate resident size of a session in bytes"""
+    size = 256
+    for field in ("system_prompt", "diagnostic_context"):
+        size += len(session.get(field) or "")
+    size += len((session.get("summary") or {}).get("text") or "")
+    for message in session.get("messages", []):
+        size += message_size(message)
+    return size
+
+
+def message_size(message: Dict) -> int:
+    return 64 + len(message.get("content") or "")
+
+
+class SessionStore:
+    """Resident sessions are evicted by LRU (memory budget) and idle TTL.
+
+    Every session is also an append-only JSON-lines log on disk: one
+    header record, then one record per message, plus a summary record
+    each time the rolling summary is refreshed (the last one wins).
+    Evicted sessions are rebuilt from their log the next time they are
+    requested. Logs past the retention window or over the disk budget are
+    swept, least recently written first, as new sessions are created.
+
+    The log is the source of truth, so several worker processes can serve
+    the same session: each remembers how far into the log its resident
+    copy has read and applies whatever other processes appended before
+    using it. Without a directory sessions live in one process only.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = CHAT_SESSIONS_DIR,
+        max_bytes: int = CHAT_SESSIONS_MAX_BYTES,
+        idle_ttl: float = CHAT_SESSION_IDLE_TTL,
+        retention: float = CHAT_SESSIONS_RETENTION,
+        max_disk_bytes: int = CHAT_SESSIONS_MAX_DISK_BYTES
+    ):
+        self.directory = Path(directory) if directory else None
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.retention = retention
+        self.max_disk_bytes = max_disk_bytes
+        self._swept_at: Optional[float] = None
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._touched: Dict[str, float] = {}
+        # Log file (inode) and offset each resident session has been read up to
+        self._positions: Dict[str, Tuple[int, int]] = {}
+        self._bytes = 0
+        self._counters = {
+            "lru_evictions": 0,
+            "idle_evictions": 0,
+            "reloads": 0,
+            "appends": 0,
+            "swept_logs": 0,
+        }
+
+    def _path(self, session_id: str) -> Optional[Path]:
+        if self.directory is None:
+            return None
+        # Session ids come from clients, so never use them as file names directly
+        digest = hashlib.sha256(session_id.encode()).hexdigest()
+        return self.directory / f"{digest}.jsonl"
+
+    def _append_records(self, session_id: str, records: List[Dict]):
+        path = self._path(session_id)
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        # One unbuffered append, so records from concurrent processes never interleave
+        with path.open("ab", buffering=0) as f:
+            f.write(data.encode("utf-8"))
+
+    def _read_log(self, session_id: str, position: Optional[Tuple[int, int]] = None) -> Optional[Tuple[List[Dict], Tuple[int, int], bool]]:
+        """Complete records after `position` (inode, offset), the position after them and whether
+        the log was read from the start because it is new or was recreated since"""
+        path = self._path(session_id)
+        if path is None:
+            return None
+        try:
+            with path.open("rb") as f:
+                stat = os.fstat(f.fileno())
+                restart = position is None or position[0] != stat.st_ino or position[1] > stat.st_size
+                offset = 0 if restart else position[1]
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # A record another process is still writing is left for the next read
+        end = data.rfind(b"\n") + 1
+        return [json.loads(line) for line in data[:end].splitlines()], (stat.st_ino, offset + end), restart
+
+    def _apply(self, session: Optional[Dict], records: List[Dict]) -> Optional[Dict]:
+        for record in records:
+            kind = record.pop("type")
+            if kind == "session":
+                session = {**record, "messages": []}
+            elif kind == "message" and session is not None:
+                session["messages"].append(record)
+            elif kind == "summary" and session is not None:
+                session["summary"] = record
+        return session
+
+    async def _refresh(self, session_id: str) -> Optional[Dict]:
+        """Bring a resident session up to date with its log; None if the log is gone or it was evicted"""
+        session = self._sessions.get(session_id)
+        if session is None or self.directory is None:
+            return session
+        position = self._positions[session_id]
+        read = await asyncio.to_thread(self._read_log, session_id, position)
+        # Someone else in this process refreshed it while we were reading
+        if self._positions.get(session_id) != position:
+            return self._sessions.get(session_id)
+        if read is None:
+            # Deleted by another process
+            self._drop(session_id)
+            return None
+        records, position, restart = read
+        if restart:
+            session = self._apply(None, records)
+            self._drop(session_id)
+            if session is None:
+                return None
+            self._admit(session_id, session, position)
+            return session
+        if records:
+            self._apply(session, records)
+            self._bytes -= self._sizes[session_id]
+            self._sizes[session_id] = size = session_size(session)
+            self._bytes += size
+        self._positions[session_id] = position
+        return session
+
+    def _delete_log(self, session_id: str):
+        path = self._path(session_id)
+        if path is not None and path.exists():
+            path.unlink()
+
+    def _sweep_logs(self, keep: Set[str]) -> int:
+        """Delete logs past retention, then the least recently written while over the disk budget"""
+        logs = []
+        for path in self.directory.glob("*.jsonl"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            logs.append((stat.st_mtime, stat.st_size, path))
+        logs.sort()
+        total = sum(size for _, size, _ in logs)
+        cutoff = time.time() - self.retention
+        removed = 0
+        for mtime, size, path in logs:
+            expired = self.retention > 0 and mtime < cutoff
+            over_budget = self.max_disk_bytes > 0 and total > self.max_disk_bytes
+            if not (expired or over_budget):
+                break
+            if path.name in keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+    async def sweep(self) -> int:
+        """Delete on-disk logs past retention or over the disk budget; resident sessions are kept"""
+        self._swept_at = time.monotonic()
+        if self.directory is None or not self.directory.exists():
+            return 0
+        # Other processes notice a swept log on their next refresh and drop their copy
+        keep = {self._path(session_id).name for session_id in self._sessions}
+        removed = await asyncio.to_thread(self._sweep_logs, keep)
+        self._counters["swept_logs"] += removed
+        return removed
+
+    def _admit(self, session_id: str, session: Dict, position: Optional[Tuple[int, int]] = None):
+        self._sessions[session_id] = session
+        self._positions[session_id] = position
+        self._sessions.move_to_end(session_id)
+        self._sizes[session_id] = size = session_size(session)
+        self._bytes += size
+        self._touched[session_id] = time.monotonic()
+
+    def _drop(self, session_id: str):
+        self._sessions.pop(session_id, None)
+        self._bytes -= self._sizes.pop(session_id, 0)
+        self._touched.pop(session_id, None)
+        self._positions.pop(session_id, None)
+
+    def _touch(self, session_id: str):
+        self._sessions.move_to_end(session_id)
+        self._touched[session_id] = time.monotonic()
+
+    def _evict(self, keep: Optional[str] = None):
+        """Drop idle sessions, then least recently used ones until under budget"""
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._sessions:
+            oldest = next(iter(self._sessions))
+            if oldest == keep or self._touched[oldest] >= cutoff:
+                break
+            self._drop(oldest)
+            self._counters["idle_evictions"] += 1
+
+        for session_id in list(self._sessions):
+            if self._bytes <= self.max_bytes:
+                break
+            if session_id == keep:
+                continue
+            self._drop(session_id)
+            self._counters["lru_evictions"] += 1
+
+    def __contains__(self, session_id: str) -> bool:
+        if session_id in self._sessions:
+            return True
+        path = self._path(session_id)
+        return path is not None and path.exists()
+
+    async def create(self, session: Dict) -> Dict:
+        """Register a new session and write its log header"""
+        session_id = session["session_id"]
+        session.setdefault("messages", [])
+        if self._swept_at is None or time.monotonic() - self._swept_at > SWEEP_INTERVAL:
+            try:
+                await self.sweep()
+            except OSError as e:
+                print(f"Sweeping chat session logs failed: {e}")
+        header = {k: v for k, v in session.items() if k != "messages"}
+        await asyncio.to_thread(self._delete_log, session_id)
+        await asyncio.to_thread(
+            self._append_records,
+            session_id,
+            [{"type": "session", **header}] + [{"type": "message", **m} for m in session["messages"]]
+        )
+        self._drop(session_id)
+        # No position yet: the first refresh re-reads the log this process just wrote
+        self._admit(session_id, session)
+        self._evict(keep=session_id)
+        return session
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        """Return a session, current with its log, reloading it from disk if it was evicted"""
+        if session_id in self._sessions:
+            session = await self._refresh(session_id)
+            if session is not None:
+                self._touch(session_id)
+            return session
+
+        read = await asyncio.to_thread(self._read_log, session_id)
+        session = self._apply(None, read[0]) if read is not None else None
+        if session is None:
+            return None
+        # Another request may have reloaded it while we were reading
+        if session_id in self._sessions:
+            self._touch(session_id)
+            return self._sessions[session_id]
+        self._counters["reloads"] += 1
+        self._admit(session_id, session, read[1])
+        self._evict(keep=session_id)
+        return session
+
+    async def _reload(self, session_id: str) -> Dict:
+        # Evicted by another request while our records were being written; the log has them all
+        session = await self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    async def append(self, session_id: str, *messages: Dict) -> Dict:
+        """Add messages to a session, appending only the new records to its log"""
+        session = await self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        self._counters["appends"] += len(messages)
+        if self.directory is None:
+            session["messages"].extend(messages)
+            added = sum(message_size(m) for m in messages)
+            self._sizes[session_id] += added
+            self._bytes += added
+        else:
+            # Read back through the log, so messages other processes appended keep their order
+            await asyncio.to_thread(
+                self._append_records, session_id, [{"type": "message", **m} for m in messages]
+            )
+            session = await self._refresh(session_id) or await self._reload(session_id)
+        self._evict(keep=session_id)
+        return session
+
+    async def set_summary(self, session_id: str, summary: Dict) -> Dict:
+        """Replace a session's rolling summary and append it to the log"""
+        session = await self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        if self.directory is None:
+            previous = len((session.get("summary") or {}).get("text") or "")
+            session["summary"] = summary
+            added = len(summary.get("text") or "") - previous
+            self._sizes[session_id] += added
+            self._bytes += added
+        else:
+            await asyncio.to_thread(self._append_records, session_id, [{"type": "summary", **summary}])
+            session = await self._refresh(session_id) or await self._reload(session_id)
+        self._evict(keep=session_id)
+        return session
+
+    async def delete(self, session_id: str):
+        """Remove a session from memory and disk"""
+        self._drop(session_id)
+        await asyncio.to_thread(self._delete_log, session_id)
+
+    def metrics(self) -> Dict:
+        """Resident session count, bytes and eviction counters"""
+        return {
+            "resident_sessions": len(self._sessions),
+            "resident_bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_seconds": self.idle_ttl,
+            "retention_seconds": self.retention,
+            "max_disk_bytes": self.max_disk_bytes,
+            **self._counters,
+        }
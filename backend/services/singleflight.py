@@ -0,0 +1,72 @@
+"""
+Request coalescing
+Concurrent callers with the same key share one in-flight call, its result and its error
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class Flight:
+    """One shared call and how many callers are waiting on it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces identical in-flight calls.
+
+    The first caller for a key starts the call as a task; later callers
+    with the same key await that task instead of starting their own. A
+    caller that is cancelled (a research deadline, a disconnected client)
+    stops waiting without disturbing the others, and when the last waiter
+    leaves the shared call is cancelled too. Results are not kept once the
+    call finishes; caching is the caller's business.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._counters = {
+            "calls": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "abandoned": 0,
+        }
+
+    async def do(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        """Await call(), or the identical call already in flight for key"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = Flight(asyncio.create_task(call()))
+            flight.task.add_done_callback(lambda task: self._finished(key, flight))
+            self._counters["calls"] += 1
+        else:
+            self._counters["coalesced"] += 1
+
+        flight.waiters += 1
+        try:
+            # Shielded so one waiter's cancellation doesn't cancel the call under everyone else
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self._counters["abandoned"] += 1
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key: str, flight: Flight):
+        # A newer flight may already hold the key
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _finished(self, key: str, flight: Flight):
+        self._forget(key, flight)
+        if not flight.task.cancelled() and flight.task.exception() is not None:
+            self._counters["errors"] += 1
+
+    def stats(self) -> Dict:
+        return {**self._counters, "in_flight": len(self._flights)}
@@ -0,0 +1,42 @@
+"""
+Streaming helpers
+Server-Sent Event framing and Anthropic Messages stream decoding
+"""
+
+import json
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from services.usage import merge_stream_usage
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def format_sse(event_id: int, event: str, data: Any) -> str:
+    """Encode one Server-Sent Event frame"""
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def anthropic_text_deltas(response: httpx.Response, usage: Optional[Dict] = None) -> AsyncIterator[str]:
+    """Yield text deltas from a streaming Messages API response.
+
+    If a usage dict is given it is filled from the message_start and
+    message_delta events as they arrive.
+    """
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        event = json.loads(line[5:])
+        if usage is not None:
+            merge_stream_usage(usage, event)
+        if event.get("type") == "content_block_delta":
+            delta = event.get("delta", {})
+            if delta.get("type") == "text_delta":
+                yield delta["text"]
+        elif event.get("type") == "error":
+            raise HTTPException(
+                status_code=502,
+                detail=event.get("error", {}).get("message", "Claude stream error")
+            )
@@ -0,0 +1,403 @@
+"""
+Resilient upstream calls
+Per-call deadlines, jittered retries that honor retry-after, per-upstream circuit breakers and hedged requests
+"""
+
+import os
+import time
+import random
+import asyncio
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from services.http_clients import UPSTREAMS, get_client
+from services.metrics import registry, track_upstream
+
+# Configuration
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", "8"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", "30"))
+UPSTREAM_HEDGING = os.environ.get("UPSTREAM_HEDGING", "true").lower() == "true"
+
+# Overall deadline of one call, retries and backoff included, unless the caller sets its own.
+# Firecrawl's sits inside RESEARCH_TASK_TIMEOUT so retries end before the task is abandoned
+UPSTREAM_DEADLINES = {
+    "anthropic": float(os.environ.get("ANTHROPIC_DEADLINE", "300")),
+    "firecrawl": float(os.environ.get("FIRECRAWL_DEADLINE", "40")),
+}
+
+# A hedge goes out once an attempt outlives this percentile of recent successful ones
+HEDGE_PERCENTILE = 0.95
+HEDGE_LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+# Statuses worth another attempt: the Anthropic SDK's list plus 529 (overloaded)
+RETRY_STATUSES = frozenset((408, 409, 429, 500, 502, 503, 504, 529))
+RETRY_AFTER_STATUSES = frozenset((429, 503, 529))
+# Only server-side failures count against a breaker; a 429 is about our rate, not the upstream's health
+BREAKER_STATUSES = frozenset((500, 502, 503, 504, 529))
+TRANSIENT_ERRORS = (httpx.TransportError, asyncio.TimeoutError)
+# The request never left, so even a non-idempotent call can be sent again
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class UpstreamUnavailable(HTTPException):
+    """Raised without calling out while an upstream's breaker is open"""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(
+            status_code=503,
+            detail=f"{upstream} is temporarily unavailable",
+            headers={"Retry-After": str(max(1, round(retry_after)))}
+        )
+        self.upstream = upstream
+
+
+class CircuitBreaker:
+    """Opens after consecutive upstream failures; after the reset timeout one probe call decides whether it closes"""
+
+    def __init__(
+        self,
+        upstream: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT
+    ):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._probing = False
+
+    def retry_in(self) -> float:
+        """Seconds until an open breaker lets a probe through"""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def acquire(self) -> bool:
+        """Admit a call or raise UpstreamUnavailable; True if the call is the half-open probe"""
+        if self.state == "open" and self.retry_in() == 0:
+            self.state = "half_open"
+        if self.state == "open" or (self.state == "half_open" and self._probing):
+            self.rejected += 1
+            raise UpstreamUnavailable(self.upstream, self.retry_in() or self.reset_timeout)
+        if self.state == "half_open":
+            self._probing = True
+            return True
+        return False
+
+    def release(self, probe: bool, healthy: Optional[bool]):
+        """Report how an admitted call went; None if it said nothing about the upstream (cancelled)"""
+        if probe:
+            self._probing = False
+        if healthy is None:
+            return
+        if healthy:
+            self.failures = 0
+            self.state = "closed"
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+                print(f"Circuit breaker for {self.upstream} opened after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in_seconds": round(self.retry_in(), 1),
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyWindow:
+    """Recent successful attempt latencies of one operation"""
+
+    def __init__(self, size: int = HEDGE_LATENCY_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+breakers: Dict[str, CircuitBreaker] = {upstream: CircuitBreaker(upstream) for upstream in UPSTREAMS}
+latencies: Dict[Tuple[str, str], LatencyWindow] = {}
+
+upstream_retries = registry.counter(
+    "marketsauce_upstream_retries_total",
+    "Upstream attempts retried, by the status code or error that triggered the retry",
+    ("upstream", "operation", "reason")
+)
+upstream_hedges = registry.counter(
+    "marketsauce_upstream_hedges_total",
+    "Hedged duplicate requests sent, by whether the hedge answered first",
+    ("upstream", "operation", "outcome")
+)
+registry.gauge(
+    "marketsauce_upstream_breaker_state",
+    "Circuit breaker state per upstream (0 closed, 1 half-open, 2 open)",
+    lambda: {(name,): BREAKER_STATES[breaker.state] for name, breaker in breakers.items()},
+    ("upstream",)
+)
+
+
+def get_breaker(upstream: str) -> CircuitBreaker:
+    breaker = breakers.get(upstream)
+    if breaker is None:
+        breaker = breakers[upstream] = CircuitBreaker(upstream)
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict]:
+    """Breaker snapshot per upstream, for /health"""
+    return {name: breaker.snapshot() for name, breaker in breakers.items()}
+
+
+def retry_after(headers: httpx.Headers) -> Optional[float]:
+    """Seconds the upstream asked us to wait, from retry-after-ms or retry-after (seconds or HTTP date)"""
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """Delay before retry `attempt` (from 1): the upstream's retry-after hint, else full-jitter exponential"""
+    if response is not None and response.status_code in RETRY_AFTER_STATUSES:
+        hinted = retry_after(response.headers)
+        if hinted is not None:
+            return hinted
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def next_delay(
+    attempt: int,
+    expires: float,
+    response: Optional[httpx.Response] = None,
+    error: Optional[BaseException] = None,
+    idempotent: bool = True
+) -> Optional[float]:
+    """Seconds to wait before retrying, or None to give up with this outcome"""
+    if error is not None and not (idempotent or isinstance(error, UNSENT_ERRORS)):
+        return None
+    if response is not None and response.status_code not in RETRY_STATUSES:
+        return None
+    if attempt > UPSTREAM_MAX_RETRIES:
+        return None
+    delay = backoff(attempt, response)
+    # A retry that can't start before the deadline would only fail later
+    return delay if delay < expires - time.monotonic() else None
+
+
+async def guarded_send(
+    upstream: str,
+    operation: str,
+    client: httpx.AsyncClient,
+    build: Callable[[], httpx.Request],
+    timeout: float,
+    stream: bool = False
+) -> httpx.Response:
+    """One attempt under the upstream's breaker, bounded by the time left before the deadline"""
+    breaker = get_breaker(upstream)
+    probe = breaker.acquire()
+    healthy = None
+    started = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(client.send(build(), stream=stream), timeout=timeout)
+        healthy = response.status_code not in BREAKER_STATUSES
+        if response.status_code < 400 and not stream:
+            latencies.setdefault((upstream, operation), LatencyWindow()).add(time.perf_counter() - started)
+        return response
+    except TRANSIENT_ERRORS:
+        healthy = False
+        raise
+    finally:
+        breaker.release(probe, healthy)
+
+
+async def tracked_send(
+    upstream: str,
+    operation: str,
+    client: httpx.AsyncClient,
+    build: Callable[[], httpx.Request],
+    timeout: float
+) -> httpx.Response:
+    async with track_upstream(upstream, operation) as call:
+        response = await guarded_send(upstream, operation, client, build, timeout)
+        call.status(response.status_code)
+    return response
+
+
+async def hedged_send(
+    upstream: str,
+    operation: str,
+    client: httpx.AsyncClient,
+    build: Callable[[], httpx.Request],
+    timeout: float
+) -> httpx.Response:
+    """Send, and send again if the first attempt outlives the operation's p95; the first good answer wins"""
+    window = latencies.get((upstream, operation))
+    delay = window.percentile(HEDGE_PERCENTILE) if window else None
+    # No hedging on too little history, a nearly spent deadline or an upstream already in trouble
+    if delay is None or delay >= timeout or get_breaker(upstream).state != "closed":
+        return await tracked_send(upstream, operation, client, build, timeout)
+
+    started = time.monotonic()
+    primary = asyncio.create_task(tracked_send(upstream, operation, client, build, timeout))
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        hedged = not done
+        if hedged:
+            remaining = timeout - (time.monotonic() - started)
+            tasks.add(asyncio.create_task(tracked_send(upstream, operation, client, build, remaining)))
+        while True:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finished = [
+                task for task in done
+                if task.exception() is None and task.result().status_code not in RETRY_STATUSES
+            ]
+            if finished or not tasks:
+                winner = finished[0] if finished else done.pop()
+                if hedged:
+                    upstream_hedges.inc(
+                        upstream=upstream, operation=operation, outcome="lost" if winner is primary else "won"
+                    )
+                return winner.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def upstream_request(
+    upstream: str,
+    operation: str,
+    method: str,
+    url: str,
+    client: Optional[httpx.AsyncClient] = None,
+    deadline: Optional[float] = None,
+    idempotent: Optional[bool] = None,
+    hedge: bool = False,
+    **kwargs
+) -> httpx.Response:
+    """Send a request, retrying transient failures until the deadline.
+
+    Returns the last response (which may still be an error status) and
+    raises the last transport error if no response arrived. Calls that
+    aren't idempotent (POST unless told otherwise) are only retried on
+    statuses that mean the request wasn't processed, or when it never
+    left. `hedge` is for idempotent reads whose duplicates are harmless.
+    """
+    client = client or get_client(upstream)
+    if idempotent is None:
+        idempotent = method in ("GET", "HEAD")
+    expires = time.monotonic() + (deadline if deadline is not None else UPSTREAM_DEADLINES.get(upstream, 60.0))
+    send = hedged_send if hedge and idempotent and UPSTREAM_HEDGING else tracked_send
+
+    def build() -> httpx.Request:
+        return client.build_request(method, url, **kwargs)
+
+    for attempt in itertools.count(1):
+        try:
+            response = await send(upstream, operation, client, build, expires - time.monotonic())
+            delay = next_delay(attempt, expires, response=response)
+            if delay is None:
+                return response
+            reason = str(response.status_code)
+        except TRANSIENT_ERRORS as e:
+            delay = next_delay(attempt, expires, error=e, idempotent=idempotent)
+            if delay is None:
+                raise
+            reason = type(e).__name__
+        upstream_retries.inc(upstream=upstream, operation=operation, reason=reason)
+        await asyncio.sleep(delay)
+
+
+@asynccontextmanager
+async def upstream_stream(
+    upstream: str,
+    operation: str,
+    method: str,
+    url: str,
+    client: Optional[httpx.AsyncClient] = None,
+    deadline: Optional[float] = None,
+    idempotent: Optional[bool] = None,
+    **kwargs
+) -> AsyncIterator[httpx.Response]:
+    """Open a streamed response, retrying like upstream_request until its headers arrive.
+
+    The deadline covers getting the headers; once the body starts, only the
+    request's own read timeout applies and nothing is retried.
+    """
+    client = client or get_client(upstream)
+    if idempotent is None:
+        idempotent = method in ("GET", "HEAD")
+    expires = time.monotonic() + (deadline if deadline is not None else UPSTREAM_DEADLINES.get(upstream, 60.0))
+
+    def build() -> httpx.Request:
+        return client.build_request(method, url, **kwargs)
+
+    for attempt in itertools.count(1):
+        opened = False
+        try:
+            async with track_upstream(upstream, operation) as call:
+                response = await guarded_send(
+                    upstream, operation, client, build, expires - time.monotonic(), stream=True
+                )
+                call.status(response.status_code)
+                delay = next_delay(attempt, expires, response=response)
+                if delay is None:
+                    opened = True
+                    try:
+                        yield response
+                    finally:
+                        await response.aclose()
+                    return
+                await response.aclose()
+                reason = str(response.status_code)
+        except TRANSIENT_ERRORS as e:
+            if opened:
+                raise
+            delay = next_delay(attempt, expires, error=e, idempotent=idempotent)
+            if delay is None:
+                raise
+            reason = type(e).__name__
+        upstream_retries.inc(upstream=upstream, operation=operation, reason=reason)
+        await asyncio.sleep(delay)
@@ -0,0 +1,76 @@
+"""
+Token usage accounting
+Aggregates the `usage` block of Claude responses, including prompt-cache reads and writes
+"""
+
+from collections import defaultdict
+from typing import Dict, Optional
+
+from services.metrics import registry
+
+USAGE_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+)
+
+
+class UsageTracker:
+    """Running token totals per purpose (diagnostic, chat, ...)"""
+
+    def __init__(self):
+        self._totals: Dict[str, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+        self._requests: Dict[str, int] = defaultdict(int)
+
+    def record(self, purpose: str, usage: Optional[Dict], into: Optional[Dict] = None):
+        """Add one response's usage to the totals (and optionally to a per-job dict)"""
+        if not usage:
+            return
+        self._requests[purpose] += 1
+        totals = self._totals[purpose]
+        for field in USAGE_FIELDS:
+            value = usage.get(field) or 0
+            totals[field] += value
+            if into is not None:
+                into[field] = into.get(field, 0) + value
+
+    def snapshot(self) -> Dict:
+        result = {}
+        for purpose, totals in self._totals.items():
+            cached = totals["cache_read_input_tokens"]
+            prompt = totals["input_tokens"] + totals["cache_creation_input_tokens"] + cached
+            result[purpose] = {
+                **totals,
+                "requests": self._requests[purpose],
+                "cache_hit_ratio": round(cached / prompt, 4) if prompt else 0.0,
+            }
+        return result
+
+
+usage_tracker = UsageTracker()
+
+registry.callback_counter(
+    "marketsauce_claude_tokens_total",
+    "Tokens reported in the usage block of Claude responses",
+    lambda: {
+        (purpose, field): value
+        for purpose, totals in usage_tracker._totals.items()
+        for field, value in totals.items()
+    },
+    ("purpose", "type")
+)
+registry.callback_counter(
+    "marketsauce_claude_requests_total",
+    "Claude responses that reported usage",
+    lambda: {(purpose,): count for purpose, count in usage_tracker._requests.items()},
+    ("purpose",)
+)
+
+
+def merge_stream_usage(usage: Dict, event: Dict):
+    """Fold usage from message_start / message_delta stream events into one dict"""
+    if event.get("type") == "message_start":
+        usage.update(event.get("message", {}).get("usage", {}))
+    elif event.get("type") == "message_delta":
+        usage.update(event.get("usage", {}))
@@ -0,0 +1,19 @@
+"""
+Test configuration
+Points the app's database and caches at a scratch directory before any backend module reads its settings
+"""
+
+import os
+import tempfile
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="marketsauce-tests-")
+
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{SCRATCH_DIR}/app.db",
+    "CHAT_SESSIONS_DIR": os.path.join(SCRATCH_DIR, "chat_sessions"),
+    "DOCUMENT_CACHE_DIR": "",
+    "RESEARCH_CACHE_PATH": "",
+})
+# Demo mode: nothing under test reaches Claude or Firecrawl
+for name in ("ANTHROPIC_API_KEY", "FIRECRAWL_API_KEY"):
+    os.environ.pop(name, None)
@@ -0,0 +1,74 @@
+"""
+Claude admission tests
+ClaudeBudget.acquire: priority-then-arrival admission and wait limits
+"""
+
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionTimeout, ClaudeBudget
+
+BODY = {"max_tokens": 100, "messages": [{"role": "user", "content": "Hello"}]}
+
+
+async def drained_budget() -> ClaudeBudget:
+    """A budget of six requests a minute with every request spent"""
+    budget = ClaudeBudget(rpm=6, itpm=0, otpm=0, reserve=0.0, processes=1)
+    for _ in range(6):
+        await budget.acquire("chat", BODY)
+    return budget
+
+
+async def test_acquire_admits_by_priority_then_arrival():
+    budget = await drained_budget()
+    admitted = []
+
+    async def call(purpose: str, name: str):
+        await budget.acquire(purpose, BODY)
+        admitted.append(name)
+
+    tasks = [
+        asyncio.create_task(call(purpose, name))
+        for purpose, name in [("diagnostic", "diagnostic"), ("chat_summary", "summary"), ("chat", "chat 1"), ("chat", "chat 2")]
+    ]
+    await asyncio.sleep(0.01)
+    assert admitted == [] and budget.stats()["waiting"] == 4
+
+    # Refill one request at a time; each goes to the head of the queue
+    for _ in tasks:
+        budget.buckets["requests"].credit(1)
+        budget._notify()
+        await asyncio.sleep(0.01)
+    await asyncio.gather(*tasks)
+
+    assert admitted == ["chat 1", "chat 2", "summary", "diagnostic"]
+
+
+async def test_acquire_times_out_with_retry_after_and_leaves_the_queue():
+    budget = await drained_budget()
+
+    with pytest.raises(AdmissionTimeout) as raised:
+        await budget.acquire("chat", BODY, max_wait=0.05)
+
+    assert raised.value.status_code == 429
+    assert int(raised.value.headers["Retry-After"]) >= 1
+    assert budget.stats()["waiting"] == 0
+    assert budget.stats()["timeouts"] == {"chat": 1}
+
+    # The timed-out call no longer holds the head of the queue
+    budget.buckets["requests"].credit(1)
+    await asyncio.wait_for(budget.acquire("diagnostic", BODY), timeout=1)
+
+
+async def test_background_calls_wait_without_a_limit():
+    budget = await drained_budget()
+
+    waiting = asyncio.create_task(budget.acquire("diagnostic", BODY))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert budget.stats()["waiting"] == 0
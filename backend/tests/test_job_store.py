@@ -0,0 +1,133 @@
+"""
+Job store tests
+Leasing queued jobs (the compare-and-set in JobStore._claim, lease expiry) and ordered, versioned job writes
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, true
+from sqlalchemy.orm import sessionmaker
+
+from services import job_store
+from services.database import Base
+from services.job_store import DiagnosticJob, JobStore
+from services.responses import dumps
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine, expire_on_commit=False)
+    engine.dispose()
+
+
+async def enqueue(store: JobStore, job_id: str, priority: int = 0):
+    store[job_id] = {"job_id": job_id, "status": "queued", "inputs": {"business_name": job_id}}
+    await store.enqueue(job_id, priority)
+
+
+async def test_claim_takes_jobs_in_queue_order(session_factory):
+    store = JobStore(session_factory)
+    await enqueue(store, "later", priority=5)
+    await enqueue(store, "first", priority=1)
+
+    assert [job_id for job_id, _ in store._claim(true(), 2)] == ["first", "later"]
+    assert store["first"]["status"] == "queued"
+
+
+async def test_claimed_job_is_not_claimed_again(session_factory):
+    first, second = JobStore(session_factory), JobStore(session_factory)
+    await enqueue(first, "job")
+
+    assert [job_id for job_id, _ in first._claim(true(), 1)] == ["job"]
+    assert second._claim(true(), 1) == []
+
+
+async def test_claim_skips_a_job_a_rival_wins_between_select_and_update(session_factory, monkeypatch):
+    first, rival = JobStore(session_factory), JobStore(session_factory)
+    await enqueue(first, "contested", priority=1)
+    await enqueue(first, "next", priority=2)
+
+    # The rival claims as soon as `first` has picked its candidates, before its UPDATE runs
+    real_update = job_store.update
+    rival_claimed = []
+
+    def update_after_rival(*args):
+        if not rival_claimed:
+            rival_claimed.append(None)
+            rival_claimed.extend(job_id for job_id, _ in rival._claim(true(), 1))
+        return real_update(*args)
+
+    monkeypatch.setattr(job_store, "update", update_after_rival)
+
+    assert [job_id for job_id, _ in first._claim(true(), 1)] == ["next"]
+    assert rival_claimed[1:] == ["contested"]
+    assert "contested" not in list(first)
+
+
+async def test_expired_lease_can_be_claimed(session_factory):
+    dead = JobStore(session_factory, lease_ttl=-1)
+    survivor = JobStore(session_factory)
+    await enqueue(dead, "orphan")
+
+    assert [job_id for job_id, _ in dead._claim(true(), 1)] == ["orphan"]
+    assert [job_id for job_id, _ in survivor._claim(true(), 1)] == ["orphan"]
+
+
+def stored(session_factory, job_id: str) -> DiagnosticJob:
+    with session_factory() as session:
+        return session.get(DiagnosticJob, job_id)
+
+
+async def test_saves_land_in_order_and_coalesce(session_factory, monkeypatch):
+    store = JobStore(session_factory)
+    store["job"] = {"job_id": "job", "status": "processing", "current_phase": 0}
+    writes = []
+    real_write = store._write
+
+    def counted_write(job_id, snapshot, version, **write):
+        writes.append(version)
+        return real_write(job_id, snapshot, version, **write)
+
+    monkeypatch.setattr(store, "_write", counted_write)
+
+    async def advance(phase: int):
+        store["job"]["current_phase"] = phase
+        await store.save("job")
+
+    await asyncio.gather(*[advance(phase) for phase in range(1, 6)])
+
+    row = stored(session_factory, "job")
+    assert row.progress["current_phase"] == 5 and row.version == 5
+    # Saves queued behind a write that already held their changes were skipped
+    assert writes == sorted(writes) and len(writes) < 5
+
+
+async def test_older_version_never_overwrites_a_newer_one(session_factory):
+    store = JobStore(session_factory)
+    assert store._write("job", dumps({"status": "processing", "current_phase": 2}), 2)
+
+    assert not store._write("job", dumps({"status": "processing", "current_phase": 1}), 1)
+    assert stored(session_factory, "job").progress["current_phase"] == 2
+
+
+async def test_write_is_dropped_while_another_worker_holds_the_lease(session_factory):
+    owner, stale = JobStore(session_factory), JobStore(session_factory)
+    assert owner._write("job", dumps({"status": "processing", "current_phase": 3}), 1)
+
+    assert not stale._write("job", dumps({"status": "processing", "current_phase": 9}), 5)
+    row = stored(session_factory, "job")
+    assert row.lease_owner == owner.owner and row.progress["current_phase"] == 3
+
+
+async def test_claimed_job_continues_the_stored_version(session_factory):
+    first, second = JobStore(session_factory), JobStore(session_factory)
+    await enqueue(first, "job")
+    second._claim(true(), 1)
+
+    second["job"]["current_phase"] = 1
+    await second.save("job")
+
+    assert stored(session_factory, "job").version == 2
@@ -0,0 +1,58 @@
+"""
+Diagnostic scheduler tests
+Admission to the shared queue: batch items wait behind interactive jobs without using up its bound
+"""
+
+import uuid
+
+import httpx
+import pytest
+
+from api.diagnostic import diagnostic_scheduler, diagnostics_store
+from main import app
+from services.database import init_db
+
+INPUTS = {
+    "business_name": "Queue Co",
+    "website_url": "https://queue.example.com",
+    "target_market": "Independent gyms",
+    "what_they_sell": "Class booking software",
+    "mode": "express",
+}
+
+
+@pytest.fixture
+async def client(monkeypatch):
+    init_db()
+    monkeypatch.setattr(diagnostic_scheduler, "max_queue", 3)
+    # No lifespan, so no workers: everything submitted stays queued
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+async def submit_batch_item():
+    job_id = str(uuid.uuid4())
+    diagnostics_store[job_id] = {"job_id": job_id, "status": "queued", "inputs": dict(INPUTS)}
+    await diagnostics_store.save(job_id)
+    await diagnostic_scheduler.submit(job_id, INPUTS["mode"], force=True, batch=True)
+
+
+async def test_create_is_admitted_while_a_batch_larger_than_the_queue_waits(client):
+    for _ in range(diagnostic_scheduler.max_queue * 3):
+        await submit_batch_item()
+
+    responses = [await client.post("/api/diagnostic/create", json=INPUTS) for _ in range(diagnostic_scheduler.max_queue)]
+
+    assert [response.status_code for response in responses] == [200] * diagnostic_scheduler.max_queue
+    # Interactive jobs queue ahead of every batch item
+    assert [response.json()["message"] for response in responses] == [
+        f"Diagnostic queued at position {position}" for position in range(1, diagnostic_scheduler.max_queue + 1)
+    ]
+    stats = await diagnostic_scheduler.stats()
+    assert stats["queue_depth"] == diagnostic_scheduler.max_queue
+    assert stats["batch_queue_depth"] == diagnostic_scheduler.max_queue * 3
+
+    # The bound still applies to interactive jobs
+    full = await client.post("/api/diagnostic/create", json=INPUTS)
+    assert full.status_code == 429
+    assert "Retry-After" in full.headers
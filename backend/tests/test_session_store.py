@@ -0,0 +1,84 @@
+"""
+Chat session store tests
+SessionStore._refresh: replaying records other processes append, restarting from recreated logs and sessions evicted mid-append
+"""
+
+import asyncio
+
+from services.session_store import SessionStore
+
+
+def new_session(session_id: str, prompt: str = "You are helpful") -> dict:
+    return {"session_id": session_id, "system_prompt": prompt, "created_at": "2026-10-17T12:00:00"}
+
+
+async def test_refresh_replays_records_appended_by_another_process(tmp_path):
+    ours, theirs = SessionStore(str(tmp_path)), SessionStore(str(tmp_path))
+    await ours.create(new_session("s"))
+    await ours.append("s", {"role": "user", "content": "one"})
+
+    await theirs.append("s", {"role": "assistant", "content": "two"})
+    await theirs.set_summary("s", {"text": "summary", "through": 2})
+
+    session = await ours.get("s")
+    assert [m["content"] for m in session["messages"]] == ["one", "two"]
+    assert session["summary"] == {"text": "summary", "through": 2}
+    # Only the new records were read, and the resident size follows them
+    assert ours.metrics()["reloads"] == 0
+    assert ours.metrics()["resident_bytes"] == ours._sizes["s"]
+
+
+async def test_refresh_keeps_a_partly_written_record_for_later(tmp_path):
+    store = SessionStore(str(tmp_path))
+    await store.create(new_session("s"))
+    await store.get("s")
+
+    path = store._path("s")
+    with path.open("ab") as f:
+        f.write(b'{"type":"message","role":"user","content":"hal')
+    assert (await store.get("s"))["messages"] == []
+
+    with path.open("ab") as f:
+        f.write(b'f"}\n')
+    assert [m["content"] for m in (await store.get("s"))["messages"]] == ["half"]
+
+
+async def test_refresh_restarts_when_the_log_is_recreated(tmp_path):
+    ours, theirs = SessionStore(str(tmp_path)), SessionStore(str(tmp_path))
+    await ours.create(new_session("s", prompt="old"))
+    await ours.append("s", {"role": "user", "content": "a long message " * 20})
+
+    await theirs.create(new_session("s", prompt="new"))
+
+    session = await ours.get("s")
+    assert session["system_prompt"] == "new"
+    assert session["messages"] == []
+
+
+async def test_refresh_drops_a_session_deleted_elsewhere(tmp_path):
+    ours, theirs = SessionStore(str(tmp_path)), SessionStore(str(tmp_path))
+    await ours.create(new_session("s"))
+    await ours.get("s")
+
+    await theirs.delete("s")
+
+    assert await ours.get("s") is None
+    assert ours.metrics()["resident_sessions"] == 0
+    assert ours.metrics()["resident_bytes"] == 0
+
+
+async def test_concurrent_appends_survive_evicting_each_other(tmp_path):
+    # Room for one session at a time, so each append evicts the other session
+    store = SessionStore(str(tmp_path), max_bytes=1500)
+    await store.create(new_session("a"))
+    await store.create(new_session("b"))
+
+    results = await asyncio.gather(
+        store.append("a", {"role": "user", "content": "a" * 1024}),
+        store.append("b", {"role": "user", "content": "b" * 1024}),
+        return_exceptions=True
+    )
+
+    assert [[m["content"][0] for m in session["messages"]] for session in results] == [["a"], ["b"]]
+    assert [m["content"][0] for m in (await store.get("a"))["messages"]] == ["a"]
+    assert [m["content"][0] for m in (await store.get("b"))["messages"]] == ["b"]
@@ -0,0 +1,89 @@
+"""
+Request coalescing tests
+SingleFlight: shared results, shared errors and cancellation of coalesced callers
+"""
+
+import asyncio
+
+import pytest
+
+from services.singleflight import SingleFlight
+
+
+async def test_coalesced_callers_share_one_call():
+    flights = SingleFlight()
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    results = await asyncio.gather(*[flights.do("key", call) for _ in range(3)])
+
+    assert results == ["result"] * 3
+    assert calls == 1
+    assert flights.stats() == {"calls": 1, "coalesced": 2, "errors": 0, "abandoned": 0, "in_flight": 0}
+
+
+async def test_error_reaches_every_caller_and_is_not_kept():
+    flights = SingleFlight()
+    attempts = 0
+
+    async def failing():
+        nonlocal attempts
+        attempts += 1
+        await asyncio.sleep(0.01)
+        raise ValueError(f"attempt {attempts}")
+
+    results = await asyncio.gather(*[flights.do("key", failing) for _ in range(3)], return_exceptions=True)
+
+    assert [str(result) for result in results] == ["attempt 1"] * 3
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.stats()["errors"] == 1
+
+    # The failure is forgotten; the next caller starts a fresh call
+    with pytest.raises(ValueError, match="attempt 2"):
+        await flights.do("key", failing)
+
+
+async def test_cancelled_caller_leaves_the_others_waiting():
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def call():
+        await release.wait()
+        return "result"
+
+    leaving = asyncio.create_task(flights.do("key", call))
+    staying = asyncio.create_task(flights.do("key", call))
+    await asyncio.sleep(0)
+    leaving.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await staying == "result"
+    assert leaving.cancelled()
+
+
+async def test_call_is_cancelled_when_every_caller_leaves():
+    flights = SingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def call():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    caller = asyncio.create_task(flights.do("key", call))
+    await started.wait()
+    caller.cancel()
+    await asyncio.gather(caller, return_exceptions=True)
+
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    assert flights.stats()["abandoned"] == 1 and flights.stats()["in_flight"] == 0
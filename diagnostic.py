@@ -1,22 +1,52 @@
 """
 MarketSauce Agent Backend API
 Orchestrates Firecrawl research and Claude diagnostic generation
+
+Shares the backend's services; run from the repository root: PYTHONPATH=backend python diagnostic.py
 """
 
 import os
-import json
 import asyncio
 from typing import Dict, List, Optional
 from dataclasses import dataclass
 from datetime import datetime
 import httpx
 
+from services.sections import SectionIndex
+from services.prompts import cached_system, system_prompt_text
+from services.upstream import upstream_request
+from services.singleflight import SingleFlight
+from services.research_cache import cache_key, normalize_query, normalize_url
+from services.context_budget import budget_research, query_terms
+from services.phase_graph import Phase, PhaseGraph
+
 
 # Configuration
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
 FIRECRAWL_API_KEY = os.environ.get("FIRECRAWL_API_KEY")
-ANTHROPIC_BASE_URL = "https://api.anthropic.com/v1"
-FIRECRAWL_BASE_URL = "https://api.firecrawl.dev/v1"
+# Base URLs are hosts (no /v1), matching the SDK convention, so stand-ins can be swapped in
+ANTHROPIC_BASE_URL = os.environ.get("ANTHROPIC_BASE_URL", "https://api.anthropic.com").rstrip("/") + "/v1"
+FIRECRAWL_BASE_URL = os.environ.get("FIRECRAWL_BASE_URL", "https://api.firecrawl.dev").rstrip("/") + "/v1"
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+FIRECRAWL_CONCURRENCY = int(os.environ.get("FIRECRAWL_CONCURRENCY", "8"))
+RESEARCH_TASK_TIMEOUT = float(os.environ.get("RESEARCH_TASK_TIMEOUT", "45"))
+AGENT_TASK_TIMEOUT = float(os.environ.get("AGENT_TASK_TIMEOUT", "150"))
+# What a diagnostic run produces; mode graphs keep only the phases these need
+DIAGNOSTIC_TARGETS = ("diagnostic", "deliverables")
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build a pooled HTTP/2 client with keep-alive"""
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+    )
 
 
 @dataclass
@@ -38,24 +68,44 @@ class ResearchData:
     website_content: str
     competitor_data: List[Dict]
     market_trends: List[Dict]
-    industry_insights: str
+    industry_insights: Dict
+
+
+# Identical Firecrawl calls in flight at once, from any orchestrator, share one request
+firecrawl_flights = SingleFlight()
+
+
+def agent_key(prompt: str, urls: Optional[List[str]] = None) -> str:
+    """Coalescing key of an agent run: the normalized prompt and the set of seed URLs"""
+    seeds = ",".join(sorted({normalize_url(url) for url in urls or []}))
+    return f"agent:{normalize_query(prompt)}|urls={seeds}"
 
 
 class FirecrawlClient:
     """Client for Firecrawl web research"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, client: Optional[httpx.AsyncClient] = None):
         self.api_key = api_key
+        self.client = client or create_http_client()
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {api_key}"
         }
     
+    async def aclose(self):
+        """Close the underlying connection pool"""
+        await self.client.aclose()
+    
     async def scrape_website(self, url: str) -> Dict:
         """Scrape a single website for content"""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
+        async def fetch() -> Dict:
+            response = await upstream_request(
+                "firecrawl",
+                "scrape",
+                "POST",
                 f"{FIRECRAWL_BASE_URL}/scrape",
+                client=self.client,
+                idempotent=True,
                 headers=self.headers,
                 json={
                     "url": url,
@@ -65,12 +115,20 @@ class FirecrawlClient:
                 timeout=60.0
             )
             return response.json()
+
+        return await firecrawl_flights.do(cache_key("scrape", url), fetch)
     
     async def search_web(self, query: str, limit: int = 5) -> Dict:
         """Search the web for relevant information"""
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
+        async def fetch() -> Dict:
+            response = await upstream_request(
+                "firecrawl",
+                "search",
+                "POST",
                 f"{FIRECRAWL_BASE_URL}/search",
+                client=self.client,
+                idempotent=True,
+                hedge=True,
                 headers=self.headers,
                 json={
                     "query": query,
@@ -83,34 +141,49 @@ class FirecrawlClient:
                 timeout=60.0
             )
             return response.json()
+
+        return await firecrawl_flights.do(cache_key("search", query, limit=limit), fetch)
     
     async def run_agent(self, prompt: str, urls: Optional[List[str]] = None) -> Dict:
         """Use Firecrawl agent for complex research tasks"""
-        async with httpx.AsyncClient() as client:
-            payload = {"prompt": prompt}
-            if urls:
-                payload["urls"] = urls
-            
-            response = await client.post(
+        payload = {"prompt": prompt}
+        if urls:
+            payload["urls"] = urls
+        
+        async def fetch() -> Dict:
+            # Starting an agent run isn't idempotent, so it is only retried if it never reached Firecrawl
+            response = await upstream_request(
+                "firecrawl",
+                "agent",
+                "POST",
                 f"{FIRECRAWL_BASE_URL}/agent",
+                client=self.client,
+                deadline=120.0,
                 headers=self.headers,
                 json=payload,
                 timeout=120.0
             )
             return response.json()
 
+        return await firecrawl_flights.do(agent_key(prompt, urls), fetch)
+
 
 class ClaudeClient:
     """Client for Claude API interactions"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, client: Optional[httpx.AsyncClient] = None):
         self.api_key = api_key
+        self.client = client or create_http_client()
         self.headers = {
             "Content-Type": "application/json",
             "x-api-key": api_key,
             "anthropic-version": "2024-01-01"
         }
     
+    async def aclose(self):
+        """Close the underlying connection pool"""
+        await self.client.aclose()
+    
     async def generate_diagnostic(
         self, 
         inputs: DiagnosticInput, 
@@ -122,29 +195,31 @@ class ClaudeClient:
         
         # Load system prompt if not provided
         if not system_prompt:
-            with open("prompts/system.md", "r") as f:
-                system_prompt = f.read()
+            system_prompt = system_prompt_text()
         
         # Build the user prompt with inputs and research
         user_prompt = self._build_diagnostic_prompt(inputs, research, mode)
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{ANTHROPIC_BASE_URL}/messages",
-                headers=self.headers,
-                json={
-                    "model": "claude-sonnet-4-20250514",
-                    "max_tokens": 16000,
-                    "system": system_prompt,
-                    "messages": [
-                        {"role": "user", "content": user_prompt}
-                    ]
-                },
-                timeout=300.0
-            )
-            
-            result = response.json()
-            return result["content"][0]["text"]
+        response = await upstream_request(
+            "anthropic",
+            "diagnostic",
+            "POST",
+            f"{ANTHROPIC_BASE_URL}/messages",
+            client=self.client,
+            headers=self.headers,
+            json={
+                "model": "claude-sonnet-4-20250514",
+                "max_tokens": 16000,
+                "system": cached_system(system_prompt),
+                "messages": [
+                    {"role": "user", "content": user_prompt}
+                ]
+            },
+            timeout=300.0
+        )
+        
+        result = response.json()
+        return result["content"][0]["text"]
     
     def _build_diagnostic_prompt(
         self, 
@@ -160,6 +235,20 @@ class ClaudeClient:
             "full": "Execute FULL DIAGNOSTIC: All 10 phases with complete analysis."
         }.get(mode, "Execute STRATEGIC MODE")
         
+        context = budget_research(
+            {
+                "website_content": research.website_content,
+                "competitor_data": research.competitor_data,
+                "market_trends": research.market_trends,
+                "industry_insights": research.industry_insights
+            },
+            query_terms(
+                inputs.business_name, inputs.target_market, inputs.what_they_sell,
+                inputs.competitors, inputs.challenges, inputs.goals, inputs.context
+            ),
+            mode
+        )
+        
         return f"""
 {mode_instruction}
 
@@ -177,16 +266,16 @@ class ClaudeClient:
 ## Research Data
 
 ### Website Content
-{research.website_content[:5000]}
+{context["website_content"]}
 
 ### Competitor Intelligence
-{json.dumps(research.competitor_data, indent=2)[:3000]}
+{context["competitor_data"]}
 
 ### Market Trends
-{json.dumps(research.market_trends, indent=2)[:2000]}
+{context["market_trends"]}
 
 ### Industry Insights
-{research.industry_insights[:2000]}
+{context["industry_insights"]}
 
 ---
 
@@ -200,6 +289,103 @@ class DiagnosticOrchestrator:
     def __init__(self):
         self.firecrawl = FirecrawlClient(FIRECRAWL_API_KEY)
         self.claude = ClaudeClient(ANTHROPIC_API_KEY)
+        self.firecrawl_slots = asyncio.Semaphore(FIRECRAWL_CONCURRENCY)
+        self.graph = self._phase_graph()
+    
+    async def _research_task(self, coro, timeout: float = RESEARCH_TASK_TIMEOUT) -> Dict:
+        """Run one research call under the Firecrawl concurrency limit and a deadline"""
+        async def bounded():
+            async with self.firecrawl_slots:
+                return await coro
+        
+        try:
+            return await asyncio.wait_for(bounded(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return {}
+    
+    async def aclose(self):
+        """Close the upstream connection pools"""
+        await self.firecrawl.aclose()
+        await self.claude.aclose()
+    
+    def _phase_graph(self) -> PhaseGraph:
+        """Research, generation and extraction phases; each starts once its inputs are ready"""
+        deep = frozenset(("strategic", "full"))
+        return PhaseGraph([
+            Phase("website", "Scraping the website", self._website, inputs=("inputs",), outputs=("website_content",)),
+            Phase("market", "Researching market trends", self._market, inputs=("inputs",), outputs=("market_trends",)),
+            Phase(
+                "industry", "Researching industry insights", self._industry,
+                inputs=("inputs",), outputs=("industry_insights",), modes=deep
+            ),
+            Phase(
+                "competitors", "Researching competitors", self._competitors,
+                inputs=("inputs",), outputs=("competitor_data",), modes=deep
+            ),
+            Phase(
+                "generate", "Generating strategic diagnostic", self._generate,
+                inputs=("inputs", "mode", "website_content", "market_trends"),
+                optional=("competitor_data", "industry_insights"),
+                outputs=("diagnostic",)
+            ),
+            Phase(
+                "deliverables", "Extracting deliverables", self._deliverables,
+                inputs=("diagnostic",), outputs=("deliverables",)
+            ),
+        ])
+    
+    async def _website(self, values: Dict) -> Dict:
+        website_data = await self._research_task(self.firecrawl.scrape_website(values["inputs"].website_url))
+        return {"website_content": website_data.get("markdown", "")}
+    
+    async def _market(self, values: Dict) -> Dict:
+        industry_query = f"{values['inputs'].target_market} industry trends 2025 2026"
+        market_trends = await self._research_task(self.firecrawl.search_web(industry_query, limit=5))
+        return {"market_trends": market_trends.get("results", [])}
+    
+    async def _industry(self, values: Dict) -> Dict:
+        insights_result = await self._research_task(
+            self.firecrawl.run_agent(
+                f"Find key statistics, trends, and insights about {values['inputs'].target_market} "
+                f"including market size, growth rates, and emerging opportunities"
+            ),
+            timeout=AGENT_TASK_TIMEOUT
+        )
+        return {"industry_insights": insights_result.get("data", {})}
+    
+    async def _competitors(self, values: Dict) -> Dict:
+        inputs = values["inputs"]
+        competitors = []
+        if inputs.competitors:
+            competitors = [c.strip() for c in inputs.competitors.split(",")][:5]
+        
+        competitor_results = await asyncio.gather(*[
+            self._research_task(self.firecrawl.search_web(f"{comp} company reviews pricing features", limit=3))
+            for comp in competitors
+        ])
+        return {"competitor_data": [
+            {"name": comp, "data": data}
+            for comp, data in zip(competitors, competitor_results)
+        ]}
+    
+    async def _generate(self, values: Dict) -> Dict:
+        research = ResearchData(
+            website_content=values["website_content"],
+            competitor_data=values.get("competitor_data", []),
+            market_trends=values["market_trends"],
+            industry_insights=values.get("industry_insights", {})
+        )
+        return {"diagnostic": await self.claude.generate_diagnostic(values["inputs"], research, values["mode"])}
+    
+    async def _deliverables(self, values: Dict) -> Dict:
+        # System prompt and follow-ups come from one section index
+        diagnostic = values["diagnostic"]
+        index = SectionIndex.build(diagnostic)
+        return {"deliverables": {
+            "system_prompt": self._extract_system_prompt(diagnostic, index),
+            "follow_up_prompts": self._extract_follow_up_prompts(diagnostic, index),
+            "section_index": index.to_dict()
+        }}
     
     async def generate(
         self, 
@@ -207,133 +393,38 @@ class DiagnosticOrchestrator:
         mode: str = "strategic",
         progress_callback=None
     ) -> Dict:
-        """Run the full diagnostic generation pipeline"""
-        
+        """Run the diagnostic phase graph for a mode, reporting each phase as it starts"""
+        graph = self.graph.for_mode(mode, DIAGNOSTIC_TARGETS)
         results = {
             "status": "processing",
-            "phases": [],
+            "phases": graph.plan(),
             "diagnostic": None,
             "system_prompt": None,
             "follow_up_prompts": None
         }
         
-        # Phase 1: Website scraping
-        if progress_callback:
-            await progress_callback("Gathering website intelligence")
-        
-        website_data = await self.firecrawl.scrape_website(inputs.website_url)
-        results["phases"].append({
-            "name": "Website scraping",
-            "status": "complete"
-        })
-        
-        # Phase 2: Competitor research
-        if progress_callback:
-            await progress_callback("Researching competitors")
-        
-        competitor_data = []
-        if inputs.competitors:
-            competitors = [c.strip() for c in inputs.competitors.split(",")]
-            for comp in competitors[:5]:
-                comp_research = await self.firecrawl.search_web(
-                    f"{comp} company reviews pricing features",
-                    limit=3
-                )
-                competitor_data.append({
-                    "name": comp,
-                    "data": comp_research
-                })
+        async def changed(record: Dict):
+            if progress_callback and record["status"] == "running":
+                await progress_callback(record["title"])
         
-        results["phases"].append({
-            "name": "Competitor research",
-            "status": "complete"
-        })
-        
-        # Phase 3: Market trends
-        if progress_callback:
-            await progress_callback("Analyzing market trends")
-        
-        industry_query = f"{inputs.target_market} industry trends 2025 2026"
-        market_trends = await self.firecrawl.search_web(industry_query, limit=5)
-        
-        results["phases"].append({
-            "name": "Market trends",
-            "status": "complete"
-        })
-        
-        # Phase 4: Industry insights
-        if progress_callback:
-            await progress_callback("Gathering industry insights")
-        
-        insights_result = await self.firecrawl.run_agent(
-            f"Find key statistics, trends, and insights about {inputs.target_market} "
-            f"including market size, growth rates, and emerging opportunities"
+        outputs = await graph.run(
+            {"inputs": inputs, "mode": mode}, DIAGNOSTIC_TARGETS, plan=results["phases"], on_change=changed
         )
         
-        results["phases"].append({
-            "name": "Industry insights",
-            "status": "complete"
-        })
-        
-        # Compile research
-        research = ResearchData(
-            website_content=website_data.get("markdown", ""),
-            competitor_data=competitor_data,
-            market_trends=market_trends.get("results", []),
-            industry_insights=json.dumps(insights_result.get("data", {}))
-        )
-        
-        # Phase 5: Generate diagnostic
-        if progress_callback:
-            await progress_callback("Generating strategic diagnostic")
-        
-        diagnostic = await self.claude.generate_diagnostic(inputs, research, mode)
-        
-        results["phases"].append({
-            "name": "Diagnostic generation",
-            "status": "complete"
-        })
-        
-        # Extract system prompt from diagnostic
-        system_prompt = self._extract_system_prompt(diagnostic)
-        follow_up_prompts = self._extract_follow_up_prompts(diagnostic)
-        
         results["status"] = "complete"
-        results["diagnostic"] = diagnostic
-        results["system_prompt"] = system_prompt
-        results["follow_up_prompts"] = follow_up_prompts
+        results["diagnostic"] = outputs["diagnostic"]
+        results.update(outputs["deliverables"])
         results["completed_at"] = datetime.utcnow().isoformat()
         
         return results
     
-    def _extract_system_prompt(self, diagnostic: str) -> Optional[str]:
+    def _extract_system_prompt(self, diagnostic: str, index: Optional[SectionIndex] = None) -> Optional[str]:
         """Extract the system prompt section from diagnostic"""
-        if "## PHASE 9" in diagnostic:
-            start = diagnostic.find("### 9.2 System Prompt")
-            if start != -1:
-                end = diagnostic.find("## PHASE 10", start)
-                if end != -1:
-                    return diagnostic[start:end].strip()
-        return None
+        return (index or SectionIndex.build(diagnostic)).system_prompt()
     
-    def _extract_follow_up_prompts(self, diagnostic: str) -> Optional[List[str]]:
+    def _extract_follow_up_prompts(self, diagnostic: str, index: Optional[SectionIndex] = None) -> Optional[List[str]]:
         """Extract follow-up prompts from diagnostic"""
-        if "## PHASE 10" in diagnostic:
-            start = diagnostic.find("## PHASE 10")
-            if start != -1:
-                section = diagnostic[start:]
-                prompts = []
-                for i in range(1, 16):
-                    marker = f"**{i}."
-                    if marker in section:
-                        prompt_start = section.find(marker)
-                        next_marker = f"**{i+1}."
-                        prompt_end = section.find(next_marker, prompt_start)
-                        if prompt_end == -1:
-                            prompt_end = len(section)
-                        prompts.append(section[prompt_start:prompt_end].strip())
-                return prompts if prompts else None
-        return None
+        return (index or SectionIndex.build(diagnostic)).follow_up_prompts()
 
 
 # FastAPI Application (example endpoints)
@@ -389,7 +480,10 @@ async def main():
     async def progress(message):
         print(f"Progress: {message}")
     
-    results = await orchestrator.generate(inputs, "strategic", progress)
+    try:
+        results = await orchestrator.generate(inputs, "strategic", progress)
+    finally:
+        await orchestrator.aclose()
     
     print("\n" + "="*60)
     print("DIAGNOSTIC COMPLETE")
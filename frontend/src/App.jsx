@@ -261,8 +261,25 @@ const IntakeForm = ({ onSubmit, isProcessing, isDemoMode }) => {
   );
 };
 
+// Server phase statuses that count as done; restored phases were finished before a restart
+const FINISHED_PHASE_STATUSES = ['complete', 'restored'];
+
 // Progress Tracker Component
-const ProgressTracker = ({ currentPhase, phases, phaseName, isDemoMode }) => {
+// Shows the job's own phase records from the status endpoint (several may run at once);
+// the fixed `phases` labels, stepped through by `currentPhase`, are only for demo mode
+const ProgressTracker = ({ currentPhase, phases, phaseRecords, phaseName, isDemoMode }) => {
+  const steps = phaseRecords
+    ? phaseRecords.map((record) => ({
+        label: record.title,
+        isComplete: FINISHED_PHASE_STATUSES.includes(record.status),
+        isCurrent: record.status === 'running'
+      }))
+    : phases.map((phase, index) => ({
+        label: phase,
+        isComplete: index < currentPhase,
+        isCurrent: index === currentPhase
+      }));
+
   return (
     <div style={{ padding: '24px', backgroundColor: colors.darkGray, color: colors.white }}>
       <h3 style={{
@@ -276,10 +293,7 @@ const ProgressTracker = ({ currentPhase, phases, phaseName, isDemoMode }) => {
       </h3>
 
       <div style={{ display: 'flex', flexDirection: 'column', gap: '12px' }}>
-        {phases.map((phase, index) => {
-          const isComplete = index < currentPhase;
-          const isCurrent = index === currentPhase;
-
+        {steps.map(({ label, isComplete, isCurrent }, index) => {
           return (
             <div
               key={index}
@@ -310,7 +324,7 @@ const ProgressTracker = ({ currentPhase, phases, phaseName, isDemoMode }) => {
                 fontSize: '14px',
                 fontWeight: isCurrent ? '600' : '400'
               }}>
-                {phase}
+                {label}
               </span>
               {isCurrent && (
                 <div style={{
@@ -664,6 +678,7 @@ const App = () => {
   const [view, setView] = useState('pricing');
   const [currentPhase, setCurrentPhase] = useState(0);
   const [phaseName, setPhaseName] = useState('');
+  const [phaseRecords, setPhaseRecords] = useState(null);
   const [diagnosticData, setDiagnosticData] = useState(null);
   const [jobId, setJobId] = useState(null);
   const [expandedSections, setExpandedSections] = useState({ executive: true });
@@ -672,6 +687,7 @@ const App = () => {
   const [isCheckingBackend, setIsCheckingBackend] = useState(true);
   const [toast, setToast] = useState(null);
 
+  // Demo mode's simulated steps; real jobs report their own phases
   const phases = [
     'Gathering website intelligence',
     'Researching competitors',
@@ -734,6 +750,9 @@ const App = () => {
 
         setCurrentPhase(data.current_phase);
         setPhaseName(data.phase_name);
+        if (data.phases) {
+          setPhaseRecords(data.phases);
+        }
 
         if (data.status === 'complete') {
           setDiagnosticData({
@@ -853,6 +872,7 @@ Your market contains three main competitor types:
     setView('processing');
     setCurrentPhase(0);
     setPhaseName('Initializing');
+    setPhaseRecords(null);
 
     // If in demo mode, skip API entirely
     if (isDemoMode) {
@@ -1224,6 +1244,7 @@ Your market contains three main competitor types:
             <ProgressTracker
               currentPhase={currentPhase}
               phases={phases}
+              phaseRecords={phaseRecords}
               phaseName={phaseName}
               isDemoMode={isDemoMode}
             />